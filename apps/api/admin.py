@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Timeslot,YearGroup,Teacher,Subject,Room,ClassGroup,Block, SubjectGroup
+from .models import Timeslot,YearGroup,Teacher,Subject,Room,ClassGroup,Block, SubjectGroup, TimeslotChange
 from django.db.models import Count
 from .customFilters import PupilCountFilter,RoomCapacityFilter
 
@@ -22,8 +22,10 @@ class TimeSlotAdmin(admin.ModelAdmin):
 
 @admin.register(Teacher)
 class TeacherAdminView(admin.ModelAdmin):
-    list_display = ['id','name','LessonsWeekly']
+    list_display = ['id','name','LessonsWeekly','bookedLessons']
     list_filter = ['LessonsWeekly']
+    # counted from the timetable, see counters.py
+    readonly_fields = ['bookedLessons']
     list_display_links = ['name']
     search_fields = ['name']
 
@@ -50,8 +52,8 @@ class YearGroupAdminView(admin.ModelAdmin):
 
 @admin.register(ClassGroup)
 class GroupAdminDisplay(admin.ModelAdmin):
-    list_display = ['id','classCode','NumOfPupils']
-    list_filter = [PupilCountFilter]
+    list_display = ['id','classCode','year','half','NumOfPupils']
+    list_filter = ['year','half',PupilCountFilter]
     list_display_links = ['classCode']
     search_fields = ['classCode']
 
@@ -60,4 +62,11 @@ class SubjectAdminDisplay(admin.ModelAdmin):
     list_display = ['id','name','yearGroup','Count','block']
     list_filter = ['yearGroup__name']
     list_display_links = ['name']
-    search_fields = ['name']
\ No newline at end of file
+    search_fields = ['name']
+
+@admin.register(TimeslotChange)
+class TimeslotChangeAdminDisplay(admin.ModelAdmin):
+    # written by changelog.py, only looked at here
+    list_display = ['id','action','timeslot','changedAt']
+    list_filter = ['action']
+    readonly_fields = ['timeslot','action','changedAt']
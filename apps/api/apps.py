@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
-    name = 'apps.api'
\ No newline at end of file
+    name = 'apps.api'
+
+    def ready(self):
+        from . import signals, reference
+        # the cache is kept in files which outlive the process, the database may have changed since
+        reference.clear()
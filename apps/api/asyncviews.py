@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from .availability import freeComputerRooms, freeSubjectTeachers, teacherHours
+from .views import OverviewRoute, RoomRoutes
+from . import reference, versions
+
+"""
+Async views for GET /api/overview/ and GET /api/rooms/ under the ASGI
+server (config/asgi.py), the viewsets keep serving them under WSGI.
+Django 3.2 runs every sync view of an ASGI process on one thread, so the
+routes the frontend polls would wait on each other there. These views run
+their queries on a pool of ASYNC_QUERY_THREADS threads instead, each with
+its own database connection, and the overview runs its free rooms, free
+subject teachers and teacher hours queries at the same time.
+The checks are DRF's own: the viewset is made as the router makes it and
+its authentication, permissions, content negotiation and ETag are run, so
+the responses are the same as the viewset's. Requests the fast path does
+not handle, another method or a missing parameter, are given to the
+viewset itself on the pool.
+QUERY_METRICS adds a sync middleware, Django then runs these views one at
+a time again and the queries made on the pool are not counted.
+"""
+
+ROUTE = {'basename': 'overview', 'detail': False, 'suffix': 'List'}
+
+# threads are only started once used, a pool of one when queries run on Django's thread
+pool = ThreadPoolExecutor(max_workers=max(settings.ASYNC_QUERY_THREADS, 1), thread_name_prefix='api-queries')
+
+overviewRoute = OverviewRoute.as_view({'get': 'list'}, **ROUTE)
+roomsRoute = RoomRoutes.as_view({'get': 'list'}, **dict(ROUTE, basename='rooms'))
+
+
+def withConnection(function, *args):
+    # like a request of its own, a connection which is broken or past CONN_MAX_AGE is replaced
+    close_old_connections()
+    versions.requestStarted()
+    try:
+        return function(*args)
+    finally:
+        versions.requestFinished()
+        close_old_connections()
+
+
+async def run(function, *args):
+    '''Run a blocking function on the pool, or on Django's sync thread with ASYNC_QUERY_THREADS=0.'''
+    if not settings.ASYNC_QUERY_THREADS:
+        return await sync_to_async(function)(*args)
+    return await asyncio.get_running_loop().run_in_executor(pool, partial(withConnection, function, *args))
+
+
+def respond(route, request):
+    '''The response of the viewset's own view, rendered here rather than on Django's thread.'''
+    response = route(request)
+    return response.render() if isinstance(response, Response) else response
+
+
+def start(request) -> tuple:
+    """Run the checks of OverviewRoute.list on the request as DRF would:
+    authentication, permissions, throttles, content negotiation and the ETag.
+
+    Returns:
+        tuple: (view, DRF request, ETag, the response refusing it or None to go ahead)
+    """
+    view = OverviewRoute(action_map={'get': 'list'}, **ROUTE)
+    view.args, view.kwargs = (), {}
+    drfRequest = view.request = view.initialize_request(request)
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drfRequest)
+    except Exception as exc:
+        return view, drfRequest, None, view.handle_exception(exc)
+    etag = quote_etag(versions.tag(drfRequest, versions.GLOBAL))
+    return view, drfRequest, etag, get_conditional_response(request, etag=etag)
+
+
+def finish(view, drfRequest, response, etag=None):
+    '''Add DRF's headers and the ETag to the response and render it.'''
+    response = view.finalize_response(drfRequest, response)
+    if etag:
+        response['ETag'] = etag
+    return response.render() if isinstance(response, Response) else response
+
+
+async def overview(request):
+    '''GET /api/overview/?day=Mon&unit=1&subject=Maths, see OverviewRoute.list.'''
+    day, unit = request.GET.get('day'), request.GET.get('unit')
+    if request.method != 'GET' or day is None or unit is None:
+        return await run(respond, overviewRoute, request)
+
+    view, drfRequest, etag, refused = await run(start, request)
+    if refused is not None:
+        return await run(finish, view, drfRequest, refused)
+
+    unit = f'Unit{unit}'
+    subject = request.GET.get('subject')
+    parts = [run(lambda: reference.byId('rooms', freeComputerRooms(day, unit)))]
+    if subject:
+        parts += [
+            run(lambda: reference.byId('teachers', freeSubjectTeachers(day, unit, subject))),
+            run(teacherHours, day, unit),
+        ]
+    results = await asyncio.gather(*parts)
+    data = {'rooms': results[0], 'teachers': {}, 'teacherHours': {}}
+    if subject:
+        data['teachers'], data['teacherHours'] = results[1:]
+    return await run(finish, view, drfRequest, Response(data), etag)
+
+
+async def rooms(request):
+    '''GET /api/rooms/, RoomRoutes.list is one query so it is just run on the pool.'''
+    return await run(respond, roomsRoute, request)
+
+
+# DRF's views are exempt from Django's CSRF check, csrf_exempt would make these sync
+overview.csrf_exempt = True
+rooms.csrf_exempt = True
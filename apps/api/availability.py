@@ -0,0 +1,215 @@
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Case, When, BooleanField
+from django.db.models.query import QuerySet
+
+from .models import Teacher, Timeslot, Room, ClassGroup
+from . import occupancy, reference
+
+"""
+Queries shared by the suggestion routes to find out who is free
+on a timeslot. The counting is done in the database so a route
+costs the same number of queries however many teachers there are.
+Who is busy comes from the occupancy index unless it is turned off.
+The parts of the overview do not depend on each other so the async
+overview (asyncviews.py) runs them at the same time.
+"""
+
+
+def useIndex(day:str, unit:str) -> bool:
+    # unknown days or units are left to the database which just finds nothing
+    return occupancy.isEnabled() and day in occupancy.DAYS and unit in occupancy.UNITS
+
+
+def busyRooms(day:str, unit:str) -> set:
+    """Get the ids of the rooms which have a lesson on the day and unit.
+
+    Args:
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+
+    Returns:
+        set: ids of the used rooms
+    """
+    if useIndex(day, unit):
+        return occupancy.index.busy('room', day, unit)
+    return set(Timeslot.objects.at(day, unit).values_list('Room', flat=True))
+
+
+def freeTeachers(day:str, unit:str) -> 'QuerySet[Teacher]':
+    """Get the teachers who do not have a lesson on the day and unit
+    and still have hours left to teach, most missing hours first.
+    SELECT *, LessonsWeekly - bookedLessons AS remainingHours
+    FROM Teacher
+    WHERE NOT EXISTS (SELECT 1 FROM Timeslot WHERE period = (day, unit) ...)
+    ORDER BY remainingHours DESC
+    bookedLessons is kept up to date by counters.py so nothing is counted here.
+
+    Args:
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+
+    Returns:
+        QuerySet: teachers annotated with remainingHours
+    """
+    if useIndex(day, unit):
+        free = ~Q(id__in=occupancy.index.busy('teacher', day, unit))
+    else:
+        free = ~Exists(Timeslot.objects.at(day, unit).filter(Teacher=OuterRef('pk')))
+    return Teacher.objects.annotate(
+        remainingHours=F('LessonsWeekly') - F('bookedLessons'),
+    ).filter(
+        free,
+    ).exclude(
+        remainingHours=0,
+    ).order_by('-remainingHours', 'id')
+
+
+def splitBySubject(teachers:'QuerySet[Teacher]', subject:str) -> tuple:
+    """Split teachers into the ones who teach the subject and the rest,
+    keeping the order. A subquery is used for the subject so a teacher
+    of several groups with the subject is not repeated.
+
+    Args:
+        teachers (QuerySet): result of freeTeachers
+        subject (str): name of the subject
+
+    Returns:
+        tuple: (subject teachers, other teachers)
+    """
+    subjectTeachers = Teacher.objects.filter(SubjectTeach__subjects__name=subject).values('id')
+    return (
+        teachers.filter(id__in=subjectTeachers),
+        teachers.exclude(id__in=subjectTeachers),
+    )
+
+
+def freeComputerRooms(day:str, unit:str) -> list:
+    """Ids of the free ICT and Computing rooms in id order, for the overview.
+
+    Args:
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+
+    Returns:
+        list: room ids
+    """
+    free = set(reference.get('rooms')) - busyRooms(day, unit)
+    rooms = Room.objects.filter(Q(Description='ICT') | Q(Description='Computing'), id__in=free)
+    return list(rooms.order_by('id').values_list('id', flat=True))
+
+
+def freeSubjectTeachers(day:str, unit:str, subject:str) -> list:
+    '''Ids of the free teachers of the subject with hours left, most missing hours first.'''
+    subjectTeachers, _ = splitBySubject(freeTeachers(day, unit), subject)
+    return list(subjectTeachers.values_list('id', flat=True))
+
+
+def teacherHours(day:str, unit:str) -> dict:
+    '''Hours left of every free teacher who has some, by name, most missing hours first.'''
+    return dict(freeTeachers(day, unit).values_list('name', 'remainingHours'))
+
+
+def freeRoomsQuery(day:str, unit:str, classCode:str, teacher:str, subject:str) -> 'QuerySet[Room]':
+    '''The ordered query behind freeRooms, see there.'''
+    descriptions = ['ICT', 'Computing'] if subject in ('ICT', 'Computing') else [subject]
+    pupils = ClassGroup.objects.filter(classCode=classCode).values('NumOfPupils')[:1]
+
+    rooms = Room.objects.filter(Capacity__gte=Subquery(pupils))
+    if useIndex(day, unit):
+        rooms = rooms.exclude(id__in=occupancy.index.busy('room', day, unit))
+    else:
+        rooms = rooms.filter(~Exists(Timeslot.objects.at(day, unit).filter(Room=OuterRef('pk'))))
+    return rooms.annotate(
+        isTeacherRoom=Exists(Teacher.Room.through.objects.filter(
+            teacher__name=teacher, room__RoomNumber=OuterRef('RoomNumber'))),
+        matchesSubject=Case(When(Description__in=descriptions, then=True),
+                            default=False, output_field=BooleanField()),
+    ).order_by('-matchesSubject', '-isTeacherRoom', 'id')
+
+
+def freeRooms(day:str, unit:str, classCode:str, teacher:str, subject:str) -> list:
+    """Find the free rooms with space for the class, best first, in one query:
+    SELECT *, EXISTS(teacher's room) AS isTeacherRoom, Description IN (subject) AS matchesSubject
+    FROM Room
+    WHERE Capacity >= (SELECT NumOfPupils FROM ClassGroup WHERE classCode = class)
+    AND NOT EXISTS (SELECT 1 FROM Timeslot WHERE period = (day, unit) AND Room = Room.id)
+    ORDER BY matchesSubject DESC, isTeacherRoom DESC, id
+
+    Which of those rooms are returned follows the rules the route always had:
+        - if any of the teacher's rooms are free only those are used, unless the subject is AP
+        - ICT and Computing rooms are shared and only they are returned for those subjects
+        - for other subjects the rooms for the subject come first then every other free room
+        - if nothing is left all the free rooms are returned
+
+    Args:
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+        classCode (str): the class which needs a room
+        teacher (str): name of the teacher taking the lesson
+        subject (str): name of the subject
+
+    Returns:
+        list: Room objects in order
+    """
+    pooled = subject in ('ICT', 'Computing')
+    rooms = list(freeRoomsQuery(day, unit, classCode, teacher, subject))
+
+    # AP is excluded as there are no specific rooms for it
+    teacherRooms = [room for room in rooms if room.isTeacherRoom]
+    candidates = teacherRooms if teacherRooms and subject != 'AP' else rooms
+
+    result = [room for room in candidates if room.matchesSubject]
+    if not pooled:
+        # the subject rooms first then the rest so the user still has a choice
+        chosen = {room.id for room in result}
+        result += [room for room in rooms if room.id not in chosen]
+    return result or candidates
+
+
+def weekAvailability(subject:str=None, description:str=None) -> dict:
+    """Free rooms and free teachers for every Day and Unit of the week from
+    one read of the timetable. Ids are used in the slots and the names are
+    sent once in the lookup tables to keep the response small.
+
+    Args:
+        subject (str): only return teachers of this subject with hours left
+        description (str): only return rooms for this subject e.g Science
+
+    Returns:
+        dict: {'rooms': {id: RoomNumber}, 'teachers': {id: name}, 'teacherHours': {id: hours left},
+               'slots': {Day: {Unit: {'rooms': [ids], 'teachers': [ids]}}}}
+    """
+    if occupancy.isEnabled():
+        masks = occupancy.index.snapshot()
+    else:
+        masks = {'teacher': {}, 'room': {}}
+        for period, teacher, room in Timeslot.objects.values_list('period', 'Teacher', 'Room').iterator():
+            bit = 1 << period
+            masks['teacher'][teacher] = masks['teacher'].get(teacher, 0) | bit
+            masks['room'][room] = masks['room'].get(room, 0) | bit
+
+    rooms = Room.objects.order_by('id')
+    if description:
+        descriptions = ['ICT', 'Computing'] if description in ('ICT', 'Computing') else [description]
+        rooms = rooms.filter(Description__in=descriptions)
+    roomNames = dict(rooms.values_list('id', 'RoomNumber'))
+
+    teacherNames, teacherHours = {}, {}
+    if subject:
+        subjectTeachers = Teacher.objects.filter(SubjectTeach__subjects__name=subject).values('id')
+        teachers = Teacher.objects.filter(id__in=subjectTeachers).annotate(
+            remainingHours=F('LessonsWeekly') - F('bookedLessons'),
+        ).exclude(remainingHours__lte=0).order_by('-remainingHours', 'id')
+        for id_, name, hours in teachers.values_list('id', 'name', 'remainingHours'):
+            teacherNames[id_] = name
+            teacherHours[id_] = hours
+
+    slots = {}
+    for day in occupancy.DAYS:
+        slots[day] = {}
+        for unit in occupancy.UNITS:
+            bit = occupancy.slotBit(day, unit)
+            slots[day][unit] = {
+                'rooms': [id_ for id_ in roomNames if not masks['room'].get(id_, 0) & bit],
+                'teachers': [id_ for id_ in teacherNames if not masks['teacher'].get(id_, 0) & bit],
+            }
+    return {'rooms': roomNames, 'teachers': teacherNames, 'teacherHours': teacherHours, 'slots': slots}
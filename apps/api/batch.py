@@ -0,0 +1,247 @@
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup, periodOf
+from . import occupancy, versions, counters, changelog
+
+"""
+Apply many timeslot changes at once:
+    {'op': 'create', 'Day': 'Mon', 'Unit': 'Unit1', 'Teacher': 'Mrs Jones',
+     'Room': 'S4', 'Subject': 'Maths', 'ClassGroup': '7B2'}
+    {'op': 'delete', 'id': 12}
+    {'op': 'move', 'id': 12, 'Day': 'Tue', 'Unit': 'Unit3', 'Room': 'S5'}  Room is optional
+    {'op': 'swap', 'id': 12, 'with': 13}
+
+Names are resolved with one query per table, the timetable after the whole
+batch is checked for teachers, rooms or classes booked twice on a timeslot
+and everything is written in one transaction. If any operation is invalid
+nothing is written. The checks run in the same transaction as the writes,
+if another request still books a teacher, room or class in between the
+database refuses the batch and it is checked again to say which operations
+clash.
+"""
+
+OPERATIONS = ('create', 'delete', 'move', 'swap')
+# past the last real period, where moved rows wait while the batch is written
+PARKED_PERIOD = 1000
+
+
+class TimeslotBatch:
+    def __init__(self, operations:list):
+        # anything which is not an object is reported as an unknown op
+        self.operations = [item if isinstance(item, dict) else {} for item in operations]
+        self.errors = defaultdict(list)
+        # set when the database refused the batch after it had been checked
+        self.conflict = False
+
+    def error(self, index:int, message:str):
+        self.errors[index].append(message)
+
+    def checkSlot(self, index:int, item:dict):
+        if item.get('Day') not in occupancy.DAYS:
+            self.error(index, f"Unknown Day {item.get('Day')}")
+        if item.get('Unit') not in occupancy.UNITS:
+            self.error(index, f"Unknown Unit {item.get('Unit')}")
+
+    def resolveNames(self):
+        '''Look up every name used in the batch, one query per table.'''
+        creates = [item for item in self.operations if item.get('op') == 'create']
+        teachers = {item.get('Teacher') for item in creates}
+        rooms = {item.get('Room') for item in self.operations if item.get('op') in ('create', 'move')}
+        classes = {item.get('ClassGroup') for item in creates}
+
+        self.teacherIds = dict(Teacher.objects.filter(name__in=teachers).values_list('name', 'id'))
+        self.roomIds = dict(Room.objects.filter(RoomNumber__in=rooms).values_list('RoomNumber', 'id'))
+        self.classIds = dict(ClassGroup.objects.filter(classCode__in=classes).values_list('classCode', 'id'))
+        # subjects belong to the yeargroup of the class
+        self.classYears = dict(YearGroup.classes.through.objects.filter(
+            classgroup_id__in=self.classIds.values()).values_list('classgroup_id', 'yeargroup_id'))
+        self.subjectIds = {
+            (name, yearGroup): id_ for id_, name, yearGroup in Subject.objects.filter(
+                yearGroup__in=set(self.classYears.values()),
+                name__in={item.get('Subject') for item in creates},
+            ).values_list('id', 'name', 'yearGroup')
+        }
+
+        ids = set()
+        for item in self.operations:
+            ids.update(item.get(key) for key in ('id', 'with') if item.get(key) is not None)
+        self.existing = Timeslot.objects.in_bulk([id_ for id_ in ids if isinstance(id_, int)])
+
+    def lookup(self, index:int, id_):
+        timeslot = self.existing.get(id_)
+        if timeslot is None:
+            self.error(index, f'Timeslot {id_} does not exist')
+        return timeslot
+
+    def plan(self):
+        """Work out the timeslots to create, change and delete.
+        Moves and swaps change the same objects which are later saved with bulk_update.
+        """
+        self.creates, self.deletes, self.updates = {}, {}, {}
+        touched = set()
+        for index, item in enumerate(self.operations):
+            op = item.get('op')
+            if op not in OPERATIONS:
+                self.error(index, f'op must be one of {", ".join(OPERATIONS)}')
+                continue
+
+            if op == 'create':
+                self.checkSlot(index, item)
+                classId = self.classIds.get(item.get('ClassGroup'))
+                values = {
+                    'Teacher_id': self.teacherIds.get(item.get('Teacher')),
+                    'Room_id': self.roomIds.get(item.get('Room')),
+                    'ClassGroup_id': classId,
+                    'Subject_id': self.subjectIds.get((item.get('Subject'), self.classYears.get(classId))),
+                }
+                for field, value in values.items():
+                    if value is None:
+                        name = field[:-3]
+                        self.error(index, f'{name} {item.get(name)} does not exist')
+                if index not in self.errors:
+                    self.creates[index] = Timeslot(Day=item['Day'], Unit=item['Unit'], **values)
+                continue
+
+            timeslot = self.lookup(index, item.get('id'))
+            if timeslot is None:
+                continue
+            if timeslot.id in touched:
+                self.error(index, f'Timeslot {timeslot.id} is changed more than once')
+                continue
+            touched.add(timeslot.id)
+
+            if op == 'delete':
+                self.deletes[index] = timeslot
+            elif op == 'move':
+                self.checkSlot(index, item)
+                room = item.get('Room')
+                if room is not None and room not in self.roomIds:
+                    self.error(index, f'Room {room} does not exist')
+                if index in self.errors:
+                    continue
+                timeslot.Day, timeslot.Unit = item['Day'], item['Unit']
+                if room is not None:
+                    timeslot.Room_id = self.roomIds[room]
+                self.updates[index] = [timeslot]
+            elif op == 'swap':
+                other = self.lookup(index, item.get('with'))
+                if other is None:
+                    continue
+                if other.id in touched:
+                    self.error(index, f'Timeslot {other.id} is changed more than once')
+                    continue
+                touched.add(other.id)
+                timeslot.Day, other.Day = other.Day, timeslot.Day
+                timeslot.Unit, other.Unit = other.Unit, timeslot.Unit
+                self.updates[index] = [timeslot, other]
+
+    def checkClashes(self):
+        """Check the timetable the batch would leave behind. Only the
+        timeslots the batch puts lessons on can get a new clash so only
+        those are read from the database.
+        """
+        changed = {index: timeslots for index, timeslots in self.updates.items()}
+        changed.update({index: [timeslot] for index, timeslot in self.creates.items()})
+        slots = {(timeslot.Day, timeslot.Unit) for timeslots in changed.values() for timeslot in timeslots}
+        if not slots:
+            return
+
+        query = Q(period__in=[periodOf(day, unit) for day, unit in slots])
+        gone = {timeslot.id for timeslot in self.deletes.values()}
+        gone.update(timeslot.id for timeslots in self.updates.values() for timeslot in timeslots)
+        bookings = defaultdict(int)
+        for values in Timeslot.objects.filter(query).exclude(id__in=gone).values_list('Day', 'Unit', 'Teacher', 'Room', 'ClassGroup'):
+            for key in self.bookingKeys(*values):
+                bookings[key] += 1
+        for timeslots in changed.values():
+            for timeslot in timeslots:
+                for key in self.bookingKeys(timeslot.Day, timeslot.Unit, timeslot.Teacher_id, timeslot.Room_id, timeslot.ClassGroup_id):
+                    bookings[key] += 1
+
+        names = {'Teacher': 'Teacher', 'Room': 'Room', 'ClassGroup': 'Class'}
+        for index, timeslots in changed.items():
+            for timeslot in timeslots:
+                keys = self.bookingKeys(timeslot.Day, timeslot.Unit, timeslot.Teacher_id, timeslot.Room_id, timeslot.ClassGroup_id)
+                for key in keys:
+                    if bookings[key] > 1:
+                        self.error(index, f'{names[key[0]]} is already booked on {timeslot.Day} {timeslot.Unit}')
+
+    @staticmethod
+    def bookingKeys(day, unit, teacher, room, classGroup):
+        return [('Teacher', teacher, day, unit), ('Room', room, day, unit), ('ClassGroup', classGroup, day, unit)]
+
+    def results(self, applied:bool) -> list:
+        results = []
+        for index, item in enumerate(self.operations):
+            result = {'index': index, 'op': item.get('op')}
+            if index in self.errors:
+                result.update(status='error', errors=self.errors[index])
+            else:
+                result['status'] = 'ok' if applied else 'not applied'
+                if index in self.creates:
+                    result['id'] = self.creates[index].id
+                elif index in self.updates:
+                    result['id'] = [timeslot.id for timeslot in self.updates[index]]
+                else:
+                    result['id'] = item.get('id')
+            results.append(result)
+        return results
+
+    def validate(self) -> bool:
+        '''Read the names and timeslots the batch uses and check it, True if there are no errors.'''
+        self.errors.clear()
+        self.resolveNames()
+        self.plan()
+        self.checkClashes()
+        return not self.errors
+
+    def apply(self) -> tuple:
+        """Validate the whole batch and write it if there are no errors.
+        If the database refuses it, another request changed the timetable
+        after the checks, conflict is set and the errors are found again
+        from the timetable as it is now.
+
+        Returns:
+            tuple: (True if it was written, per operation results)
+        """
+        try:
+            with transaction.atomic():
+                if not self.validate():
+                    return False, self.results(applied=False)
+                self.write()
+        except IntegrityError:
+            self.conflict = True
+            if self.validate():
+                # nothing clashes now, the other request was undone or only parked rows on the same period
+                for index in range(len(self.operations)):
+                    self.error(index, 'The timetable was changed by another request, try again')
+            return False, self.results(applied=False)
+        return True, self.results(applied=True)
+
+    def write(self):
+        '''Write the checked batch, called in a transaction.'''
+        with versions.collect():
+            if self.deletes:
+                with counters.collect(), changelog.collect():
+                    Timeslot.objects.filter(id__in=[timeslot.id for timeslot in self.deletes.values()]).delete()
+            updated = [timeslot for timeslots in self.updates.values() for timeslot in timeslots]
+            if updated:
+                # The unique constraints are checked row by row, so swapping two
+                # lessons of the same teacher would clash half way through. Park
+                # the rows on made up periods first, then write the real values.
+                for number, timeslot in enumerate(updated):
+                    timeslot.period = PARKED_PERIOD + number
+                Timeslot.objects.bulk_update(updated, ['period'])
+                # sets period from Day and Unit again
+                Timeslot.objects.bulk_update(updated, ['Day', 'Unit', 'Room'])
+                changelog.record('update', updated)
+            if self.creates:
+                Timeslot.objects.bulk_create(self.creates.values())
+                counters.lessonsAdded(self.creates.values())
+                changelog.record('create', self.creates.values())
+            # bulk_update and bulk_create send no signals, the version also has the occupancy index rebuilt,
+            # the deletes' classes were gathered above and join this one bump on leaving collect
+            versions.lessonsChanged({timeslot.ClassGroup_id for timeslot in updated + list(self.creates.values())})
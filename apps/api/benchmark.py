@@ -0,0 +1,419 @@
+import gzip
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup, Block, SubjectGroup
+from .synthetic import createSchool
+from .urls import router
+from .renderers import FastJSONRenderer, MessagePackRenderer
+from . import occupancy, reference, renderers
+
+"""
+Time every route in urls.py and count its SQL queries on synthetic
+schools of growing size. The routes are read from the router so a new
+route shows up in the report, as skipped until it gets a request below.
+Every request runs in a transaction which is rolled back so the POST
+routes leave the school as it was for the next run.
+benchmarkRenderers compares the renderers of renderers.py on the
+timetables of a full school.
+benchmarkServers puts the routes with async views (asyncviews.py) under
+concurrent load on the WSGI and the ASGI deployment of config/gunicorn.py,
+each started as a server of its own on the benchmark's database.
+"""
+
+# The request made to each route, built from the sample values of the school.
+# Keyed by (url name, http method)
+REQUESTS = {
+    ('teachers-list', 'get'): lambda sample: {
+        'params': {'subject': 'Maths', 'day': 'Mon', 'unit': 1}},
+    ('classes-list', 'get'): lambda sample: {},
+    ('classes-detail', 'get'): lambda sample: {'args': [sample['year']]},
+    ('classes-generate', 'post'): lambda sample: {
+        'args': [sample['year']], 'data': {'dryRun': True}},
+    ('subjects-list', 'get'): lambda sample: {},
+    ('subjects-detail', 'get'): lambda sample: {
+        'args': [sample['year']], 'params': {'day': 'Mon', 'unit': 1, 'class': sample['class']}},
+    ('timeslots-list', 'get'): lambda sample: {},
+    ('timeslots-list', 'post'): lambda sample: {'data': {
+        'Day': 'Mon', 'Unit': 'Form', 'Teacher': sample['teacher'], 'Room': sample['room'],
+        'Subject': 'Maths', 'ClassGroup': sample['class']}},
+    ('timeslots-detail', 'get'): lambda sample: {
+        'args': [sample['class']], 'params': {'day': sample['day'], 'unit': sample['unit']}},
+    ('timeslots-changes', 'get'): lambda sample: {'params': {'since': 0}},
+    ('timeslots-batch', 'post'): lambda sample: {'data': {'operations': [
+        {'op': 'move', 'id': sample['lesson'], 'Day': 'Mon', 'Unit': 'Form'}]}},
+    ('rooms-list', 'get'): lambda sample: {'params': {
+        'subject': 'Maths', 'day': 'Mon', 'unit': 1, 'teacher': sample['teacher'], 'class': sample['class']}},
+    ('overview-list', 'get'): lambda sample: {'params': {'day': 'Mon', 'unit': 1, 'subject': 'Maths'}},
+    ('overview-week', 'get'): lambda sample: {'params': {'subject': 'Maths', 'description': 'Maths'}},
+    ('metrics-list', 'get'): lambda sample: {},
+    ('metrics-reset', 'post'): lambda sample: {},
+    ('metrics-occupancy', 'get'): lambda sample: {},
+    ('export-csv', 'get'): lambda sample: {},
+    ('export-ical', 'get'): lambda sample: {'params': {'year': sample['year']}},
+}
+
+
+def routes() -> list:
+    """Every (url name, http method) the router serves which the view implements.
+
+    Returns:
+        list: tuples of (url name, http method)
+    """
+    found = []
+    for _, viewset, basename in router.registry:
+        for route in router.get_routes(viewset):
+            for method, action in route.mapping.items():
+                if hasattr(viewset, action):
+                    found.append((route.name.format(basename=basename), method))
+    return found
+
+
+def clearSchool():
+    '''Delete the school so the next one starts from nothing.'''
+    for model in (Timeslot, Teacher, Room, ClassGroup, Subject, YearGroup, SubjectGroup, Block):
+        model.objects.all().delete()
+    occupancy.index.clear()
+    reference.clear()
+
+
+def sampleValues(year:int) -> dict:
+    '''A class of the yeargroup, one of its lessons and a Maths teacher and room to ask about.
+    The solver leaves Form empty so lessons can always be put there.'''
+    classGroup = ClassGroup.objects.filter(yeargroup__name=f'Yr{year}').order_by('id').first()
+    # a made up one when the timetable is empty, the routes then just report it missing
+    lesson = Timeslot.objects.filter(ClassGroup=classGroup).exclude(Unit='Form').order_by('id').first() \
+        or Timeslot(id=0, Day='Mon', Unit='Unit1')
+    return {
+        'year': year,
+        'class': classGroup.classCode,
+        'teacher': Teacher.objects.filter(SubjectTeach__subjects__name='Maths').order_by('id').first().name,
+        'room': Room.objects.filter(Description='Maths').order_by('id').first().RoomNumber,
+        'day': lesson.Day,
+        'unit': lesson.Unit.replace('Unit', ''),
+        'lesson': lesson.id,
+    }
+
+
+def measure(client:APIClient, method:str, path:str, request:dict, repeat:int) -> dict:
+    """Make the request repeat times after one warm up run, which also
+    builds the occupancy index, and roll back whatever it changed.
+
+    Returns:
+        dict: status code, number of queries and the median and fastest time in ms
+    """
+    timings = []
+    for run in range(repeat + 1):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                if method == 'get':
+                    response = client.get(path, request.get('params', {}))
+                else:
+                    response = getattr(client, method)(path, request.get('data', {}), format='json')
+                if response.streaming:
+                    # the exports read the database as they are sent
+                    b''.join(response.streaming_content)
+                elapsed = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        if run:
+            timings.append(elapsed)
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'medianMs': round(statistics.median(timings), 3),
+        'minMs': round(min(timings), 3),
+    }
+
+
+def benchmarkRoutes(user, sizes=(1, 3, 6), years=(7, 8, 9), fill=0.6, repeat=5, log=None) -> dict:
+    """Build a school for every size and measure every route on it.
+    The database is emptied first, so only run this on a throwaway one.
+
+    Args:
+        user (User): staff user the requests are made as
+        sizes (tuple): classes in each half of a year for each school
+        years (tuple): yeargroups of the schools
+        fill (float): fraction of the timetable filled in
+        repeat (int): timed requests per route and size
+        log (callable): called with a line of progress
+
+    Returns:
+        dict: {'database', 'repeat', 'fill', 'schools': [sizes of each school],
+               'routes': [{'name', 'method', 'results': [one per school], 'queriesGrow', 'latencyGrowth'}],
+               'skipped': [routes with no request]}
+    """
+    client = APIClient()
+    client.force_authenticate(user=user)
+    found = routes()
+    measured = [route for route in found if route in REQUESTS]
+    results = {route: [] for route in measured}
+    schools = []
+
+    for size in sizes:
+        clearSchool()
+        start = time.perf_counter()
+        school = createSchool(years=years, classesPerHalf=size, roomScale=max(1.0, size * len(years) / 18), fill=fill)
+        school['classesPerHalf'] = size
+        school['buildSeconds'] = round(time.perf_counter() - start, 2)
+        schools.append(school)
+        occupancy.index.clear()
+        if log:
+            log(f"Size {size}: {school['classes']} classes, {school['teachers']} teachers, "
+                f"{school['rooms']} rooms, {school['timeslots']} timeslots")
+
+        sample = sampleValues(years[0])
+        for name, method in measured:
+            request = REQUESTS[(name, method)](sample)
+            path = reverse(name, args=request.get('args', []))
+            result = measure(client, method, path, request, repeat)
+            result.update(classesPerHalf=size, path=path)
+            results[(name, method)].append(result)
+
+    report = []
+    for (name, method), runs in results.items():
+        queries = [run['queries'] for run in runs]
+        report.append({
+            'name': name,
+            'method': method.upper(),
+            'results': runs,
+            # the same request on a bigger school should not need more queries
+            'queriesGrow': queries[-1] > queries[0],
+            'latencyGrowth': round(runs[-1]['medianMs'] / max(runs[0]['medianMs'], 0.001), 2),
+        })
+    return {
+        'database': connection.vendor,
+        'repeat': repeat,
+        'fill': fill,
+        'schools': schools,
+        'routes': report,
+        'skipped': [{'name': name, 'method': method.upper()} for name, method in found if (name, method) not in REQUESTS],
+    }
+
+
+def renderTimes(renderer, data, repeat:int) -> tuple:
+    '''The rendered content and the time of each render in ms.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = renderer.render(data, renderer.media_type, {})
+        timings.append((time.perf_counter() - start) * 1000)
+    return content, timings
+
+
+def benchmarkRenderers(user, classesPerHalf=6, years=(7, 8, 9, 10, 11), repeat=20) -> dict:
+    """Render the timetables of a full school with DRF's JSON renderer and
+    the ones in renderers.py and compare their size and time.
+    The database is emptied first, so only run this on a throwaway one.
+
+    Args:
+        user (User): user the payloads are fetched as
+        classesPerHalf (int): size of the school, see createSchool
+        years (tuple): yeargroups of the school
+        repeat (int): renders of each payload per renderer
+
+    Returns:
+        dict: {'school', 'payloads': [{'name', 'renderers': [{'renderer', 'bytes', 'gzipBytes',
+               'medianMs', 'minMs', 'sizeRatio', 'speedup'}]}]} ratios against DRF's JSON
+    """
+    clearSchool()
+    school = createSchool(years=years, classesPerHalf=classesPerHalf,
+                          roomScale=max(1.0, classesPerHalf * len(years) / 18), fill=1.0)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    payloads = {'timeslots-list': client.get(reverse('timeslots-list')).data}
+    for year in years:
+        payloads[f'classes-detail Yr{year}'] = client.get(reverse('classes-detail', args=[year])).data
+
+    candidates = [JSONRenderer(), FastJSONRenderer()]
+    if renderers.msgpack is not None:
+        candidates.append(MessagePackRenderer())
+    report = []
+    for name, data in payloads.items():
+        results = []
+        for renderer in candidates:
+            content, timings = renderTimes(renderer, data, repeat)
+            results.append({
+                'renderer': type(renderer).__name__,
+                'mediaType': renderer.media_type,
+                'bytes': len(content),
+                'gzipBytes': len(gzip.compress(content)),
+                'medianMs': round(statistics.median(timings), 3),
+                'minMs': round(min(timings), 3),
+            })
+        baseline = results[0]
+        for result in results:
+            result['sizeRatio'] = round(result['bytes'] / baseline['bytes'], 3)
+            result['speedup'] = round(baseline['medianMs'] / max(result['medianMs'], 0.001), 2)
+        report.append({'name': name, 'renderers': results})
+    return {'school': school, 'repeat': repeat, 'payloads': report}
+
+
+# the routes served by asyncviews.py under ASGI, requested as in REQUESTS
+SERVER_ROUTES = ('overview-list', 'rooms-list')
+SERVERS = ('wsgi', 'asgi')
+
+
+def freePort() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def server(kind:str, database:str, workers:int, timeout:float=30):
+    """Run gunicorn as the Procfile does with SERVER=kind on a free port.
+
+    Args:
+        kind (str): wsgi or asgi
+        database (str): DATABASE_NAME of the server, see the settings
+        workers (int): gunicorn worker processes
+        timeout (float): seconds to wait for it to listen
+
+    Yields:
+        tuple: (host, port)
+    """
+    host, port = '127.0.0.1', freePort()
+    env = dict(os.environ, SERVER=kind, DATABASE_NAME=database, WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'config/gunicorn.py', '--bind', f'{host}:{port}'],
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'the {kind} server exited with {process.returncode}')
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                break
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f'the {kind} server did not start in {timeout} seconds')
+                time.sleep(0.1)
+        yield host, port
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def fetch(host:str, port:int, path:str, headers:dict) -> tuple:
+    '''GET the path on a new connection, as a browser polling it does. Returns (status, body).'''
+    client = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        client.request('GET', path, headers=headers)
+        response = client.getresponse()
+        return response.status, response.read()
+    finally:
+        client.close()
+
+
+def load(host:str, port:int, path:str, headers:dict, concurrency:int, seconds:float) -> dict:
+    """Keep concurrency clients requesting the path for seconds, each sending
+    its next request once it has the last response.
+
+    Returns:
+        dict: concurrency, requests answered with 200, errors, requests a second and the
+              median and 95th percentile time in ms
+    """
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        timings, errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = fetch(host, port, path, headers)
+            except OSError:
+                status = None
+            if status == 200:
+                timings.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+        return timings, errors
+
+    with ThreadPoolExecutor(concurrency) as clients:
+        results = list(clients.map(lambda _: client(), range(concurrency)))
+    timings = sorted(timing for clientTimings, _ in results for timing in clientTimings)
+    return {
+        'concurrency': concurrency,
+        'requests': len(timings),
+        'errors': sum(errors for _, errors in results),
+        'perSecond': round(len(timings) / seconds, 1),
+        'medianMs': round(statistics.median(timings), 2) if timings else None,
+        'p95Ms': round(statistics.quantiles(timings, n=20)[-1], 2) if len(timings) > 1 else None,
+    }
+
+
+def benchmarkServers(user, token:str, classesPerHalf=6, years=(7, 8, 9, 10, 11), concurrency=(1, 8, 32),
+                     seconds=5.0, workers=1, log=None) -> dict:
+    """Build a school and load the routes of SERVER_ROUTES on a WSGI then an
+    ASGI server with more and more clients at once. The servers are other
+    processes so the database has to be one they can open, not SQLite in memory.
+    The database is emptied first, so only run this on a throwaway one.
+
+    Args:
+        user (User): staff user the token is of
+        token (str): knox token the requests are sent with
+        classesPerHalf (int): size of the school, see createSchool
+        years (tuple): yeargroups of the school
+        concurrency (tuple): clients at once for each run
+        seconds (float): length of each run
+        workers (int): gunicorn worker processes of each server
+        log (callable): called with a line of progress
+
+    Returns:
+        dict: {'school', 'seconds', 'workers', 'routes': [{'name', 'path', 'sameResponse',
+               'wsgi': [load results], 'asgi': [load results], 'speedup': [asgi / wsgi requests a second]}]}
+    """
+    clearSchool()
+    school = createSchool(years=years, classesPerHalf=classesPerHalf,
+                          roomScale=max(1.0, classesPerHalf * len(years) / 18), fill=0.6)
+    sample = sampleValues(years[0])
+    headers = {'Authorization': f'Token {token}', 'Accept': 'application/json'}
+    paths = {name: f"{reverse(name)}?{urlencode(REQUESTS[(name, 'get')](sample).get('params', {}))}"
+             for name in SERVER_ROUTES}
+
+    results = {name: {} for name in SERVER_ROUTES}
+    bodies = {name: {} for name in SERVER_ROUTES}
+    for kind in SERVERS:
+        with server(kind, connection.settings_dict['NAME'], workers) as (host, port):
+            for name, path in paths.items():
+                # also builds the server's occupancy index and the reference cache
+                status, bodies[name][kind] = fetch(host, port, path, headers)
+                if status != 200:
+                    raise RuntimeError(f'{kind} answered {name} with {status}')
+                results[name][kind] = []
+                for clients in concurrency:
+                    results[name][kind].append(load(host, port, path, headers, clients, seconds))
+                    if log:
+                        run = results[name][kind][-1]
+                        log(f"{kind} {name} {clients} clients: {run['perSecond']} requests/s")
+
+    report = []
+    for name, path in paths.items():
+        runs = results[name]
+        report.append({
+            'name': name,
+            'path': path,
+            'sameResponse': len(set(bodies[name].values())) == 1,
+            **runs,
+            'speedup': [round(asgi['perSecond'] / max(wsgi['perSecond'], 0.1), 2)
+                        for wsgi, asgi in zip(runs['wsgi'], runs['asgi'])],
+        })
+    return {'school': school, 'seconds': seconds, 'workers': workers, 'routes': report}
+
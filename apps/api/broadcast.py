@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import splitClassCode
+from . import changelog
+
+"""
+In process broadcaster pushing the timetable's changes to the clients of
+/api/timeslots/stream/ (stream.py), standing in for a channel layer so no
+broker is needed. After a transaction which logged changes commits,
+changelog has publish called, which reads the change log from the
+last change sent (changelog.feed) and hands each change to the asyncio
+queue of every client whose filters it matches. Nothing is read while
+nobody is listening.
+
+A change committed by another server process is not seen on commit, so
+while anyone listens a thread also reads the change log every
+CHANGE_POLL_SECONDS and publishes what the other processes wrote.
+"""
+
+logger = logging.getLogger(__name__)
+
+# changes a slow client can fall behind by before it is told to resync
+QUEUE_SIZE = 1000
+
+
+class Subscriber:
+    def __init__(self, filters:dict):
+        """
+        Args:
+            filters (dict): year (int), teacher (name) and room (number), the ones given must all match
+        """
+        self.filters = {name: value for name, value in filters.items() if value not in (None, '')}
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, change:dict) -> bool:
+        # only the id is left of a deleted lesson so every client is told
+        if change['op'] == 'delete':
+            return True
+        timeslot = change['timeslot']
+        checks = {
+            'year': lambda year: splitClassCode(timeslot['ClassGroup'])[0] == int(year),
+            'teacher': lambda name: timeslot['Teacher'] == name,
+            'room': lambda number: timeslot['Room'] == number,
+        }
+        return all(checks[name](value) for name, value in self.filters.items())
+
+    def view(self, change:dict):
+        """The change as this client sees it, None when it has nothing to do with it.
+        The log only has a lesson as it is now, so an update which does not match
+        may be the lesson moving out of the filters e.g to another teacher. It is
+        sent as a delete, like deletes every client is told and one which never
+        had the lesson ignores it.
+        """
+        if change['op'] == 'resync' or self.matches(change):
+            return change
+        if change['op'] == 'update':
+            return {key: value for key, value in change.items() if key != 'timeslot'} | {'op': 'delete'}
+        return None
+
+    def put(self, change:dict):
+        # runs on the subscriber's event loop, the stream stops once it sees overflowed
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broadcaster:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.subscribers = set()
+        # id of the last change handed out, None while nobody listens
+        self.cursor = None
+        # reads the changes of other processes while anyone listens
+        self.poller = None
+
+    @staticmethod
+    def subscriber(filters:dict) -> Subscriber:
+        '''A subscriber for the running event loop, it hears nothing until it is added.'''
+        return Subscriber(filters)
+
+    def add(self, subscriber:Subscriber):
+        '''Start sending changes to the subscriber. Reads the change log so it is run in a thread.'''
+        with self.lock:
+            if self.cursor is None:
+                self.cursor = changelog.lastCursor()
+            self.subscribers.add(subscriber)
+            if self.poller is None and settings.CHANGE_POLL_SECONDS:
+                self.poller = threading.Thread(target=self.poll, name='change-poller', daemon=True)
+                self.poller.start()
+
+    def unsubscribe(self, subscriber:Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                self.cursor = None
+
+    def publish(self):
+        '''Send the changes committed since the last call to the subscribers, run after a commit.'''
+        with self.lock:
+            if not self.subscribers:
+                return
+            more = True
+            while more:
+                feed = changelog.feed(self.cursor, changelog.MAX_PAGE_SIZE)
+                if feed['resync']:
+                    # the log was compacted past us, which only happens if nothing was sent for days
+                    changes, more = [{'op': 'resync'}], False
+                else:
+                    changes, more = feed['changes'], feed['more']
+                # a client only has the page once it has its last change, one which
+                # reconnects before then is sent the page again from the cursor before it
+                for change in changes:
+                    change['cursor'] = self.cursor
+                if changes:
+                    changes[-1]['cursor'] = feed['cursor']
+                self.cursor = feed['cursor']
+                for subscriber in list(self.subscribers):
+                    wanted = [seen for seen in map(subscriber.view, changes) if seen is not None]
+                    for change in wanted:
+                        try:
+                            subscriber.loop.call_soon_threadsafe(subscriber.put, change)
+                        except RuntimeError:
+                            # its event loop has closed
+                            self.subscribers.discard(subscriber)
+                            break
+
+    def poll(self):
+        '''Publish the changes other processes commit until nobody listens, runs on its own thread.'''
+        while True:
+            time.sleep(settings.CHANGE_POLL_SECONDS)
+            with self.lock:
+                if not self.subscribers:
+                    self.poller = None
+                    break
+            close_old_connections()
+            try:
+                self.publish()
+            except Exception:
+                # the database may be back by the next time
+                logger.exception('Reading the change log failed')
+        close_old_connections()
+
+
+broadcaster = Broadcaster()
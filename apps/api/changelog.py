@@ -0,0 +1,151 @@
+import datetime
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Timeslot, TimeslotChange
+from .serializers import TimeslotDisplaySerializer
+from . import broadcast, versions
+
+"""
+Append only log of the changes to Timeslot so a client can ask what changed
+since it last looked instead of downloading the whole timetable again:
+    GET /api/timeslots/changes/?since=<cursor>
+The cursor is the id of the last change the client has. Rows are written in
+the transaction making the change:
+    save and delete of a Timeslot, bulk and cascade deletes included,
+    through the signals in signals.py
+    bulk_create and bulk_update, which send no signals, by calling record
+A timeslot changed several times since the cursor is sent once, as it is now.
+`manage.py compactchanges` removes old changes, a client whose cursor is
+older than what is left is told to download everything again.
+Ids are handed out when a change is written but seen when it commits. So
+that a change can never commit after a later one, which a client asking in
+between would miss for good, writing to the log first bumps the changelog
+version: its UPDATE holds the row until the transaction ends, so the next
+writer waits and is handed higher ids only once this one is committed.
+Once committed the changes are pushed to /api/timeslots/stream/, see broadcast.py.
+"""
+
+# changes sent per request, the client asks again while more is true
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+local = threading.local()
+
+
+@contextmanager
+def collect():
+    '''Keep the changes made inside and write them in one INSERT at the end.'''
+    if getattr(local, 'pending', None) is not None:
+        # already collecting, the outer one writes them
+        yield
+        return
+    local.pending = pending = []
+    try:
+        yield
+    finally:
+        local.pending = None
+    write(pending)
+
+
+def write(changes:list):
+    if not changes:
+        return
+    # the transaction of the change when there is one, one of its own otherwise
+    with transaction.atomic(savepoint=False):
+        versions.bump(versions.CHANGELOG)
+        TimeslotChange.objects.bulk_create(changes, batch_size=500)
+    if broadcast.broadcaster.subscribers:
+        transaction.on_commit(broadcast.broadcaster.publish)
+
+
+def record(action:str, timeslots):
+    """Log a change of some timeslots.
+
+    Args:
+        action (str): create, update or delete
+        timeslots (iterable): the Timeslot objects
+    """
+    timeslots = list(timeslots)
+    missing = [timeslot for timeslot in timeslots if timeslot.id is None]
+    if missing:
+        # bulk_create only sets the ids on databases which send them back, SQLite
+        # does not on this Django, a class has one lesson per period so that finds them
+        ids = {(classGroup, period): id_ for id_, classGroup, period in Timeslot.objects.filter(
+            ClassGroup_id__in={timeslot.ClassGroup_id for timeslot in missing},
+            period__in={timeslot.period for timeslot in missing},
+        ).values_list('id', 'ClassGroup', 'period')}
+        for timeslot in missing:
+            timeslot.id = ids.get((timeslot.ClassGroup_id, timeslot.period))
+    changes = [TimeslotChange(timeslot=timeslot.id, action=action) for timeslot in timeslots]
+    pending = getattr(local, 'pending', None)
+    if pending is not None:
+        pending.extend(changes)
+    else:
+        write(changes)
+
+
+def lastCursor() -> int:
+    '''The id of the newest change, 0 before the first.'''
+    return TimeslotChange.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def feed(since:int=None, limit:int=PAGE_SIZE) -> dict:
+    """The timeslots changed after the cursor. Three queries.
+
+    Args:
+        since (int): id of the last change the client has, None when it has nothing yet
+        limit (int): how many changes to read at most
+
+    Returns:
+        dict: {'cursor': id to send next time, 'resync': bool, 'more': bool,
+               'changes': [{'op': 'create'|'update', 'id', 'timeslot': {...}} | {'op': 'delete', 'id'}]}
+    """
+    bounds = TimeslotChange.objects.aggregate(first=Min('id'), last=Max('id'))
+    first, last = bounds['first'], bounds['last'] or 0
+    # no cursor, one from another database or one from before the compacted changes
+    if since is None or since > last or (first is not None and since < first - 1):
+        return {'cursor': last, 'resync': True, 'more': False, 'changes': []}
+
+    rows = list(TimeslotChange.objects.filter(id__gt=since).order_by('id')
+                .values_list('id', 'timeslot', 'action')[:limit])
+    cursor = rows[-1][0] if rows else since
+
+    # the first action says if the client can know the timeslot, the last change orders them
+    firstAction, lastChange = {}, {}
+    for id_, timeslot, action in rows:
+        firstAction.setdefault(timeslot, action)
+        lastChange[timeslot] = id_
+    current = Timeslot.objects.filter(id__in=lastChange).select_related('Teacher', 'Room', 'Subject', 'ClassGroup')
+    data = {timeslot['id']: timeslot for timeslot in TimeslotDisplaySerializer(current, many=True).data}
+
+    changes = []
+    for timeslot in sorted(lastChange, key=lastChange.get):
+        if timeslot not in data:
+            changes.append({'op': 'delete', 'id': timeslot})
+        else:
+            op = 'create' if firstAction[timeslot] == 'create' else 'update'
+            changes.append({'op': op, 'id': timeslot, 'timeslot': data[timeslot]})
+    return {'cursor': cursor, 'resync': False, 'more': cursor < last, 'changes': changes}
+
+
+def compact(days:int) -> int:
+    """Remove the changes older than days. The newest change is always kept
+    so a cursor can still be told apart from one older than the log.
+
+    Args:
+        days (int): how long changes are kept
+
+    Returns:
+        int: how many changes were removed
+    """
+    last = TimeslotChange.objects.aggregate(last=Max('id'))['last']
+    if last is None:
+        return 0
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    removed, _ = TimeslotChange.objects.filter(changedAt__lt=cutoff, id__lt=last).delete()
+    return removed
@@ -0,0 +1,161 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, IntegerField, Value, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Teacher, Timeslot, LessonCount
+
+"""
+Lessons booked per teacher (Teacher.bookedLessons) and per class and
+subject (LessonCount) so the routes showing remaining hours and lessons
+read a number instead of counting the timetable on every request.
+They change by UPDATE ... SET x = x + n in the transaction which changes
+the lessons:
+    save and delete of a Timeslot, bulk and cascade deletes included,
+    through the signals in signals.py
+    bulk_create, which sends no signals, by calling lessonsAdded
+Changes of a bulk delete are added up inside collect() and written in a
+few queries at the end instead of one per lesson.
+`manage.py repaircounters` counts everything again if they ever drift.
+"""
+
+local = threading.local()
+
+
+@contextmanager
+def collect():
+    '''Add up the lesson changes made inside and write them once at the end.'''
+    if getattr(local, 'pending', None) is not None:
+        # already collecting, the outer one writes them
+        yield
+        return
+    local.pending = pending = (Counter(), Counter())
+    try:
+        yield
+    finally:
+        local.pending = None
+    write(*pending)
+
+
+def change(timeslots, step:int):
+    teachers, lessons = Counter(), Counter()
+    for timeslot in timeslots:
+        teachers[timeslot.Teacher_id] += step
+        lessons[(timeslot.ClassGroup_id, timeslot.Subject_id)] += step
+    pending = getattr(local, 'pending', None)
+    if pending is not None:
+        pending[0].update(teachers)
+        pending[1].update(lessons)
+    else:
+        write(teachers, lessons)
+
+
+def lessonsAdded(timeslots):
+    '''Count new lessons, for bulk_create. Saved ones are counted by the signals.'''
+    change(timeslots, 1)
+
+
+def lessonsRemoved(timeslots):
+    change(timeslots, -1)
+
+
+def byStep(changes:dict) -> dict:
+    '''Group the keys by how much they change so each step is one UPDATE.'''
+    steps = defaultdict(list)
+    for key, step in changes.items():
+        if step:
+            steps[step].append(key)
+    return steps
+
+
+def write(teachers:Counter, lessons:Counter):
+    """Apply the changes with F() so concurrent changes add up.
+
+    Args:
+        teachers (Counter): teacher id -> change in booked lessons
+        lessons (Counter): (class id, subject id) -> change in lessons
+    """
+    for step, ids in byStep(teachers).items():
+        Teacher.objects.filter(id__in=ids).update(bookedLessons=F('bookedLessons') + step)
+
+    lessons = {pair: step for pair, step in lessons.items() if step}
+    if not lessons:
+        return
+    classes, subjects = {pair[0] for pair in lessons}, {pair[1] for pair in lessons}
+
+    def countIds():
+        return {(classId, subjectId): id_ for id_, classId, subjectId in LessonCount.objects.filter(
+            ClassGroup_id__in=classes, Subject_id__in=subjects).values_list('id', 'ClassGroup_id', 'Subject_id')}
+
+    ids = countIds()
+    # only added lessons need a row, one missing for a removed lesson went with its class or subject
+    missing = [pair for pair, step in lessons.items() if pair not in ids and step > 0]
+    if missing:
+        LessonCount.objects.bulk_create([LessonCount(ClassGroup_id=classId, Subject_id=subjectId)
+                                         for classId, subjectId in missing], ignore_conflicts=True)
+        ids = countIds()
+    for step, pairs in byStep(lessons).items():
+        LessonCount.objects.filter(id__in=[ids[pair] for pair in pairs if pair in ids]) \
+            .update(lessons=F('lessons') + step)
+
+
+def classLessons(classes, subjects) -> 'QuerySet':
+    """The lessons each class has of each subject, read from the counters for ClassRoutes.retrieve:
+    SELECT classCode, name, SUM(lessons) FROM LessonCount
+    WHERE classCode IN (classes) AND name IN (subjects)
+    GROUP BY classCode, name
+    Subjects are matched by name so lessons of any subject with the name are added up.
+
+    Args:
+        classes (iterable): ClassCodes
+        subjects (iterable): subject names
+
+    Returns:
+        QuerySet: (classCode, subject name, lessons) rows, pairs without lessons are left out
+    """
+    return LessonCount.objects.filter(
+        ClassGroup__classCode__in=classes, Subject__name__in=subjects,
+    ).values_list('ClassGroup__classCode', 'Subject__name').annotate(have=Sum('lessons'))
+
+
+def repair(dryRun:bool=False) -> dict:
+    """Count the lessons again and fix the counters which are wrong.
+
+    Args:
+        dryRun (bool): only report the wrong ones
+
+    Returns:
+        dict: {'teachers': [(name, counted, stored)], 'lessonCounts': [(classCode, subject, counted, stored)]}
+    """
+    with transaction.atomic():
+        booked = Coalesce(Subquery(Timeslot.objects.filter(Teacher=OuterRef('pk')).values('Teacher').annotate(
+            booked=Count('id')).values('booked'), output_field=IntegerField()), Value(0))
+        wrongTeachers = list(Teacher.objects.annotate(counted=booked).exclude(
+            counted=F('bookedLessons')).values_list('id', 'name', 'counted', 'bookedLessons'))
+
+        counted, names = {}, {}
+        for classId, subjectId, classCode, subject, lessons in Timeslot.objects.values_list(
+                'ClassGroup_id', 'Subject_id', 'ClassGroup__classCode', 'Subject__name').annotate(lessons=Count('id')):
+            counted[(classId, subjectId)] = lessons
+            names[(classId, subjectId)] = (classCode, subject)
+        stored = {}
+        for count in LessonCount.objects.select_related('ClassGroup', 'Subject'):
+            stored[(count.ClassGroup_id, count.Subject_id)] = count
+            names[(count.ClassGroup_id, count.Subject_id)] = (count.ClassGroup.classCode, count.Subject.name)
+        wrongCounts = [pair for pair in counted.keys() | stored.keys()
+                       if counted.get(pair, 0) != (stored[pair].lessons if pair in stored else 0)]
+
+        if not dryRun:
+            Teacher.objects.filter(id__in=[teacher[0] for teacher in wrongTeachers]).update(bookedLessons=booked)
+            LessonCount.objects.filter(id__in=[stored[pair].id for pair in wrongCounts if pair in stored]).delete()
+            LessonCount.objects.bulk_create([LessonCount(ClassGroup_id=pair[0], Subject_id=pair[1], lessons=counted[pair])
+                                             for pair in wrongCounts if pair in counted], batch_size=500)
+
+    return {
+        'teachers': [teacher[1:] for teacher in wrongTeachers],
+        'lessonCounts': sorted((*names[pair], counted.get(pair, 0), stored[pair].lessons if pair in stored else 0)
+                               for pair in wrongCounts),
+    }
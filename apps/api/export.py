@@ -0,0 +1,141 @@
+import csv
+import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Timeslot
+from . import occupancy
+
+"""
+Timetable export as CSV or iCalendar for the whole school, a yeargroup,
+a class, a teacher or a room. The lessons are read with the names joined
+in the same query and in chunks with .iterator(), and each row is written
+out as soon as it is read, so memory does not grow with the school and
+the first rows are sent before the last ones are read.
+The queries run while the response is sent, after the view and the
+QueryCountMiddleware have returned, so they are not in its counts.
+"""
+
+CHUNK_SIZE = 2000
+
+COLUMNS = ['Day', 'Unit', 'Class', 'Subject', 'Teacher', 'Room']
+FIELDS = ['Day', 'Unit', 'ClassGroup__classCode', 'Subject__name', 'Teacher__name', 'Room__RoomNumber']
+
+# query param -> the Timeslot filter it sets
+SCOPES = {
+    # the class's own indexed year, a join through the yeargroups would repeat a class in two of them
+    'year': lambda year: {'ClassGroup__year': year},
+    'class': lambda classCode: {'ClassGroup__classCode': classCode},
+    'teacher': lambda name: {'Teacher__name': name},
+    'room': lambda roomNumber: {'Room__RoomNumber': roomNumber},
+}
+
+# When each unit is taught, the timetable itself only has the order
+UNIT_TIMES = {
+    'Unit1': ('08:50', '09:50'),
+    'Unit2': ('09:50', '10:50'),
+    'Form': ('11:10', '11:30'),
+    'Unit3': ('11:30', '12:30'),
+    'Unit4': ('13:15', '14:15'),
+    'Unit5': ('14:15', '15:15'),
+}
+
+
+def lessons(scope:dict):
+    """The lessons in the scope, one tuple of id and COLUMNS each, by class then time.
+
+    Args:
+        scope (dict): query params, at most one of SCOPES is used
+
+    Returns:
+        iterator: rows read CHUNK_SIZE at a time
+    """
+    timeslots = Timeslot.objects.all()
+    for name, makeFilter in SCOPES.items():
+        if scope.get(name):
+            timeslots = timeslots.filter(**makeFilter(scope[name]))
+            break
+    return timeslots.order_by(
+        'ClassGroup__classCode', 'period', 'id',
+    ).values_list('id', *FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def scopeName(scope:dict) -> str:
+    '''Name of the exported file e.g timetable-class-7A1'''
+    for name in SCOPES:
+        if scope.get(name):
+            return f'timetable-{name}-' + ''.join(c for c in str(scope[name]) if c.isalnum())
+    return 'timetable'
+
+
+class Echo:
+    '''File like object which hands back what is written so csv.writer makes strings to stream.'''
+    def write(self, value):
+        return value
+
+
+def csvRows(scope:dict):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in lessons(scope):
+        yield writer.writerow(row[1:])
+
+
+def icalText(value:str) -> str:
+    '''Escape a TEXT value (RFC 5545 3.3.11).'''
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def icalLine(line:str) -> str:
+    """End a content line, folding it so no line is over 75 octets (RFC 5545 3.1).
+    Each piece is at most 74 octets of UTF-8, the space starting a folded line
+    is the 75th, and a character is never split between two lines.
+    """
+    parts, part, size = [], [], 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > 74:
+            parts.append(''.join(part))
+            part, size = [], 0
+        part.append(char)
+        size += width
+    parts.append(''.join(part))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def icalEvents(scope:dict, monday:datetime.date):
+    """A weekly repeating event per lesson, starting the week of monday.
+    Times are local to the school so no time zone is given.
+
+    Args:
+        scope (dict): query params, see SCOPES
+        monday (date): first week of the calendar
+    """
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%SZ')
+    yield icalLine('BEGIN:VCALENDAR')
+    yield icalLine('VERSION:2.0')
+    yield icalLine('PRODID:-//Timetable//Export//EN')
+    yield icalLine(f'X-WR-CALNAME:{icalText(scopeName(scope))}')
+    for id_, day, unit, classCode, subject, teacher, room in lessons(scope):
+        date = monday + datetime.timedelta(days=occupancy.DAYS.index(day))
+        start, end = (time.replace(':', '') for time in UNIT_TIMES[unit])
+        yield ''.join([
+            icalLine('BEGIN:VEVENT'),
+            icalLine(f'UID:timeslot-{id_}@timetable'),
+            icalLine(f'DTSTAMP:{stamp}'),
+            icalLine(f'DTSTART:{date:%Y%m%d}T{start}00'),
+            icalLine(f'DTEND:{date:%Y%m%d}T{end}00'),
+            icalLine('RRULE:FREQ=WEEKLY'),
+            icalLine(f'SUMMARY:{icalText(f"{subject} {classCode}")}'),
+            icalLine(f'LOCATION:{icalText(room)}'),
+            icalLine(f'DESCRIPTION:{icalText(f"{teacher}, {unit}")}'),
+            icalLine('END:VEVENT'),
+        ])
+    yield icalLine('END:VCALENDAR')
+
+
+def exportResponse(rows, contentType:str, filename:str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(rows, content_type=contentType)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
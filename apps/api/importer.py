@@ -0,0 +1,391 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup, Block, SubjectGroup
+from . import occupancy, reference, versions, counters, changelog
+
+"""
+Import a school from JSON or CSV. Every section refers to the others by
+name like the api does, not by id:
+    {"blocks": [{"name": 1}],
+     "rooms": [{"RoomNumber": "S4", "Description": "Science", "Capacity": 30,
+                "RoomType": "ClassRoom", "Block": 1}],
+     "yeargroups": [{"name": "Yr7", "classes": ["7A1", "7A2"]}],
+     "subjects": [{"name": "Maths", "yearGroup": "Yr7", "Count": 4, "block": 1}],
+     "classes": [{"classCode": "7A1", "NumOfPupils": 25, "Subjects": ["Maths"]}],
+     "subjectgroups": [{"name": "Maths", "subjects": ["Maths", "Art - Yr9"]}],
+     "teachers": [{"name": "Mrs Jones", "LessonsWeekly": 22, "Room": ["S4"], "SubjectTeach": ["Maths"]}],
+     "timeslots": [{"Day": "Mon", "Unit": "Unit1", "Class": "7A1", "Subject": "Maths",
+                    "Teacher": "Mrs Jones", "Room": "S4"}]}
+A CSV file holds one section, named after the file e.g teachers.csv, with
+lists separated by ; and timeslots.csv has the columns of the CSV export.
+A subject is "Maths - Yr7", or just "Maths" for the class's yeargroup or,
+in a subject group, the subject of every yeargroup. Django fixtures such
+as db.json are read too.
+
+Rows are made with bulk_create in batches and the many to many relations
+are written straight to their through tables, names are looked up with one
+query per table. Rows which already exist (same name) are not changed but
+the relations listed for them are added. Everything is one transaction:
+with any error nothing is written.
+"""
+
+SECTIONS = ['blocks', 'rooms', 'yeargroups', 'subjects', 'classes', 'subjectgroups', 'teachers', 'timeslots']
+# columns of a CSV file which hold a list
+LISTS = {
+    'yeargroups': ['classes'],
+    'classes': ['Subjects'],
+    'subjectgroups': ['subjects'],
+    'teachers': ['Room', 'SubjectTeach'],
+}
+LIST_SEPARATOR = ';'
+
+
+def readText(path:str) -> str:
+    with open(path, 'rb') as file:
+        raw = file.read()
+    # dumpdata on Windows PowerShell writes UTF-16
+    if raw[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        return raw.decode('utf-16')
+    return raw.decode('utf-8-sig')
+
+
+def readFiles(paths:list) -> dict:
+    """Read the sections from JSON, CSV and fixture files.
+
+    Args:
+        paths (list): file paths, a CSV file is named after its section
+
+    Returns:
+        dict: section -> rows
+    """
+    data = defaultdict(list)
+    for path in paths:
+        text = readText(path)
+        if path.lower().endswith('.csv'):
+            section = os.path.splitext(os.path.basename(path))[0].lower()
+            rows = list(csv.DictReader(io.StringIO(text)))
+            for row in rows:
+                for column in LISTS.get(section, []):
+                    row[column] = [item.strip() for item in (row.get(column) or '').split(LIST_SEPARATOR) if item.strip()]
+            data[section].extend(rows)
+        else:
+            loaded = json.loads(text)
+            for section, rows in (fromFixture(loaded) if isinstance(loaded, list) else loaded).items():
+                data[section].extend(rows)
+    return dict(data)
+
+
+def fromFixture(records:list) -> dict:
+    """Turn a dumpdata fixture into sections, the ids become names.
+    Fixtures made before subject groups existed have subject ids in
+    Teacher.SubjectTeach, a group is made for each subject name then.
+
+    Args:
+        records (list): the fixture, models outside the api are left out
+
+    Returns:
+        dict: section -> rows
+    """
+    tables = defaultdict(dict)
+    for record in records:
+        if record.get('model', '').startswith('api.'):
+            tables[record['model'][4:]][record['pk']] = record['fields']
+
+    def name(table, pk, field='name'):
+        fields = tables[table].get(pk)
+        return fields[field] if fields else f'{table} #{pk}'
+
+    def subjectName(pk):
+        fields = tables['subject'].get(pk)
+        return f"{fields['name']} - {name('yeargroup', fields['yearGroup'])}" if fields else f'subject #{pk}'
+
+    legacyTeach = 'subjectgroup' not in tables
+    data = {
+        'blocks': [{'name': fields['name']} for fields in tables['block'].values()],
+        'rooms': [dict(fields, Block=fields['Block'] and name('block', fields['Block']))
+                  for fields in tables['room'].values()],
+        'yeargroups': [dict(fields, classes=[name('classgroup', pk, 'classCode') for pk in fields['classes']])
+                       for fields in tables['yeargroup'].values()],
+        'subjects': [dict(fields, block=fields['block'] and name('block', fields['block']),
+                          yearGroup=name('yeargroup', fields['yearGroup']))
+                     for fields in tables['subject'].values()],
+        'classes': [dict(fields, Subjects=[subjectName(pk) for pk in fields['Subjects']])
+                    for fields in tables['classgroup'].values()],
+        'subjectgroups': [dict(fields, subjects=[subjectName(pk) for pk in fields['subjects']])
+                          for fields in tables['subjectgroup'].values()],
+        'teachers': [dict(fields, Room=[name('room', pk, 'RoomNumber') for pk in fields['Room']],
+                          SubjectTeach=[name('subject' if legacyTeach else 'subjectgroup', pk)
+                                        for pk in fields['SubjectTeach']])
+                     for fields in tables['teacher'].values()],
+        'timeslots': [{'Day': fields['Day'], 'Unit': fields['Unit'],
+                       'Class': name('classgroup', fields['ClassGroup'], 'classCode'),
+                       'Subject': name('subject', fields['Subject']),
+                       'Teacher': name('teacher', fields['Teacher']),
+                       'Room': name('room', fields['Room'], 'RoomNumber')}
+                      for fields in tables['timeslot'].values()],
+    }
+    if legacyTeach:
+        names = sorted({fields['name'] for fields in tables['subject'].values()})
+        data['subjectgroups'] = [{'name': subject, 'subjects': [subject]} for subject in names]
+    return data
+
+
+class SchoolImport:
+    def __init__(self, data:dict, batchSize:int=1000):
+        self.data = {section: list(data.get(section) or []) for section in SECTIONS}
+        self.batchSize = batchSize
+        self.errors = []
+        self.created = Counter()
+        self.existing = Counter()
+        for section in set(data) - set(SECTIONS):
+            self.errors.append(f'Unknown section {section}, expected one of {", ".join(SECTIONS)}')
+
+    def error(self, section:str, index:int, message:str):
+        self.errors.append(f'{section} row {index + 1}: {message}')
+
+    def rows(self, section:str):
+        for index, row in enumerate(self.data[section]):
+            if isinstance(row, dict):
+                yield index, row
+            else:
+                self.error(section, index, 'not an object')
+
+    def clean(self, section:str, index:int, model, name:str, value, required=False):
+        '''The value as the model field stores it, None and an error if it is not valid.'''
+        if value in ('', None):
+            if required:
+                self.error(section, index, f'{name} is missing')
+            return None
+        try:
+            return model._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            self.error(section, index, f"{name} {value!r}: {' '.join(error.messages)}")
+            return None
+
+    def fields(self, section:str, index:int, model, row:dict, names:list) -> dict:
+        '''The plain fields given in the row, the rest keep the model defaults.'''
+        values = {}
+        for name in names:
+            if name in row:
+                value = self.clean(section, index, model, name, row[name])
+                if value is not None:
+                    values[name] = value
+        return values
+
+    def lookup(self, section:str, index:int, ids:dict, key, label:str):
+        if key not in ids:
+            self.error(section, index, f'Unknown {label} {key}')
+        return ids.get(key)
+
+    def insert(self, section:str, model, objects:dict):
+        '''Create the new rows of a section, keyed by their name.'''
+        model.objects.bulk_create(objects.values(), batch_size=self.batchSize)
+        self.created[model._meta.db_table] += len(objects)
+
+    def link(self, through, rows:set):
+        '''Add the many to many relations which are not there yet.'''
+        fields = [field.attname for field in through._meta.fields if field.is_relation]
+        # names which were not found are already errors
+        rows = {pair for pair in rows if None not in pair} - set(through.objects.values_list(*fields))
+        through.objects.bulk_create([through(**dict(zip(fields, pair))) for pair in rows],
+                                    batch_size=self.batchSize, ignore_conflicts=True)
+        self.created[through._meta.db_table] += len(rows)
+
+    def rowsOf(self, section:str, model, keyField:str, build) -> dict:
+        """Build the rows of a section which do not exist yet.
+
+        Args:
+            keyField (str): the field naming a row
+            build (callable): (index, row, name) -> unsaved object, None if it is invalid
+
+        Returns:
+            dict: name -> object, existing and repeated names are skipped
+        """
+        existing = set(model.objects.values_list(keyField, flat=True))
+        objects = {}
+        for index, row in self.rows(section):
+            name = self.clean(section, index, model, keyField, row.get(keyField), required=True)
+            if name is None:
+                continue
+            if name in existing or name in objects:
+                self.existing[section] += 1
+                continue
+            obj = build(index, row, name)
+            if obj is not None:
+                objects[name] = obj
+        return objects
+
+    def importSchool(self):
+        blocks = self.rowsOf('blocks', Block, 'name', lambda index, row, name: Block(name=name))
+        self.insert('blocks', Block, blocks)
+        blockIds = dict(Block.objects.values_list('name', 'id'))
+
+        def blockOf(section, index, row, field):
+            name = self.clean(section, index, Block, 'name', row.get(field))
+            return None if name is None else self.lookup(section, index, blockIds, name, 'block')
+
+        rooms = self.rowsOf('rooms', Room, 'RoomNumber', lambda index, row, name: Room(
+            RoomNumber=name, Block_id=blockOf('rooms', index, row, 'Block'),
+            **self.fields('rooms', index, Room, row, ['Description', 'Capacity', 'RoomType'])))
+        self.insert('rooms', Room, rooms)
+        roomIds = dict(Room.objects.values_list('RoomNumber', 'id'))
+
+        yearGroups = self.rowsOf('yeargroups', YearGroup, 'name', lambda index, row, name: YearGroup(name=name))
+        self.insert('yeargroups', YearGroup, yearGroups)
+        yearIds = dict(YearGroup.objects.values_list('name', 'id'))
+
+        existingSubjects = set(Subject.objects.values_list('name', 'yearGroup__name'))
+        subjects = {}
+        for index, row in self.rows('subjects'):
+            name = self.clean('subjects', index, Subject, 'name', row.get('name'), required=True)
+            year = self.clean('subjects', index, YearGroup, 'name', row.get('yearGroup'), required=True)
+            if name is None or year is None:
+                continue
+            if (name, year) in existingSubjects or (name, year) in subjects:
+                self.existing['subjects'] += 1
+                continue
+            subjects[(name, year)] = Subject(
+                name=name, yearGroup_id=self.lookup('subjects', index, yearIds, year, 'yeargroup'),
+                block_id=blockOf('subjects', index, row, 'block'),
+                **self.fields('subjects', index, Subject, row, ['Count']))
+        self.insert('subjects', Subject, subjects)
+        subjectIds = {(name, year): id_ for id_, name, year in Subject.objects.values_list('id', 'name', 'yearGroup__name')}
+        subjectsByName = defaultdict(list)
+        for (name, year), id_ in subjectIds.items():
+            subjectsByName[name].append(id_)
+
+        classes = self.rowsOf('classes', ClassGroup, 'classCode', lambda index, row, name: ClassGroup(
+            classCode=name, **self.fields('classes', index, ClassGroup, row, ['NumOfPupils'])))
+        # bulk_create does not call save
+        for classGroup in classes.values():
+            classGroup.setYearHalf()
+        self.insert('classes', ClassGroup, classes)
+        classIds = dict(ClassGroup.objects.values_list('classCode', 'id'))
+
+        groups = self.rowsOf('subjectgroups', SubjectGroup, 'name', lambda index, row, name: SubjectGroup(name=name))
+        self.insert('subjectgroups', SubjectGroup, groups)
+        groupIds = dict(SubjectGroup.objects.values_list('name', 'id'))
+
+        teachers = self.rowsOf('teachers', Teacher, 'name', lambda index, row, name: Teacher(
+            name=name, **self.fields('teachers', index, Teacher, row, ['LessonsWeekly'])))
+        self.insert('teachers', Teacher, teachers)
+        teacherIds = dict(Teacher.objects.values_list('name', 'id'))
+        if self.errors:
+            return
+
+        # the relations, now every row has an id
+        yearClasses = set()
+        for index, row in self.rows('yeargroups'):
+            yearId = yearIds.get(str(row.get('name')))
+            for classCode in row.get('classes') or []:
+                yearClasses.add((yearId, self.lookup('yeargroups', index, classIds, classCode, 'class')))
+        self.link(YearGroup.classes.through, yearClasses)
+        classYears = dict(YearGroup.classes.through.objects.values_list('classgroup_id', 'yeargroup__name'))
+
+        def subjectsOf(section, index, value, year=None) -> list:
+            # "Maths - Yr7", or "Maths" in the yeargroup or in every yeargroup
+            name, _, ofYear = str(value).rpartition(' - ') if ' - ' in str(value) else (str(value), '', year)
+            if ofYear:
+                return [self.lookup(section, index, subjectIds, (name, ofYear), 'subject')]
+            return subjectsByName.get(name) or [self.lookup(section, index, {}, name, 'subject')]
+
+        classSubjects = set()
+        for index, row in self.rows('classes'):
+            classId = classIds.get(str(row.get('classCode')))
+            for value in row.get('Subjects') or []:
+                classSubjects.update((classId, id_) for id_ in subjectsOf('classes', index, value, classYears.get(classId)))
+        self.link(ClassGroup.Subjects.through, classSubjects)
+
+        groupSubjects = set()
+        for index, row in self.rows('subjectgroups'):
+            groupId = groupIds.get(str(row.get('name')))
+            for value in row.get('subjects') or []:
+                groupSubjects.update((groupId, id_) for id_ in subjectsOf('subjectgroups', index, value))
+        self.link(SubjectGroup.subjects.through, groupSubjects)
+
+        teacherRooms, teacherGroups = set(), set()
+        for index, row in self.rows('teachers'):
+            teacherId = teacherIds.get(str(row.get('name')))
+            for roomNumber in row.get('Room') or []:
+                teacherRooms.add((teacherId, self.lookup('teachers', index, roomIds, str(roomNumber), 'room')))
+            for group in row.get('SubjectTeach') or []:
+                teacherGroups.add((teacherId, self.lookup('teachers', index, groupIds, str(group), 'subject group')))
+        self.link(Teacher.Room.through, teacherRooms)
+        self.link(Teacher.SubjectTeach.through, teacherGroups)
+
+        self.importTimeslots(classIds, classYears, subjectIds, teacherIds, roomIds)
+
+    def importTimeslots(self, classIds, classYears, subjectIds, teacherIds, roomIds):
+        # who is busy when, so a clash is reported on its row instead of failing the insert
+        busy = set()
+        for classId, teacherId, roomId, day, unit in Timeslot.objects.values_list(
+                'ClassGroup', 'Teacher', 'Room', 'Day', 'Unit'):
+            busy.update({('class', classId, day, unit), ('teacher', teacherId, day, unit), ('room', roomId, day, unit)})
+
+        timeslots = []
+        for index, row in self.rows('timeslots'):
+            day, unit = row.get('Day'), row.get('Unit')
+            if day not in occupancy.DAYS or unit not in occupancy.UNITS:
+                self.error('timeslots', index, f'Unknown Day {day} or Unit {unit}')
+                continue
+            classId = self.lookup('timeslots', index, classIds, str(row.get('Class')), 'class')
+            if ('class', classId, day, unit) in busy:
+                self.existing['timeslots'] += 1
+                continue
+            timeslot = Timeslot(
+                Day=day, Unit=unit, ClassGroup_id=classId,
+                Subject_id=self.lookup('timeslots', index, subjectIds,
+                                       (str(row.get('Subject')), classYears.get(classId)), 'subject'),
+                Teacher_id=self.lookup('timeslots', index, teacherIds, str(row.get('Teacher')), 'teacher'),
+                Room_id=self.lookup('timeslots', index, roomIds, str(row.get('Room')), 'room'),
+            )
+            slots = [('class', timeslot.ClassGroup_id), ('teacher', timeslot.Teacher_id), ('room', timeslot.Room_id)]
+            for kind, id_ in slots[1:]:
+                if (kind, id_, day, unit) in busy:
+                    self.error('timeslots', index, f"The {kind} {row.get(kind.title())} is already booked on {day} {unit}")
+            busy.update((kind, id_, day, unit) for kind, id_ in slots)
+            timeslots.append(timeslot)
+        if not self.errors:
+            Timeslot.objects.bulk_create(timeslots, batch_size=self.batchSize)
+            counters.lessonsAdded(timeslots)
+            changelog.record('create', timeslots)
+            self.created[Timeslot._meta.db_table] += len(timeslots)
+            versions.lessonsChanged({timeslot.ClassGroup_id for timeslot in timeslots})
+
+    def run(self, dryRun:bool=False) -> dict:
+        """Import everything in one transaction, rolled back if there is an
+        error or it is a dry run.
+
+        Returns:
+            dict: {'written', 'errors', 'created': rows per table, 'existing': rows skipped
+                   per section, 'rows', 'seconds', 'rowsPerSecond'}
+        """
+        start = time.perf_counter()
+        if not self.errors:
+            with transaction.atomic():
+                self.importSchool()
+                if self.errors or dryRun:
+                    transaction.set_rollback(True)
+                else:
+                    # bulk_create sends no signals, so the caches are told here
+                    versions.referenceChanged()
+                    reference.invalidate(reference.BUILDERS)
+        seconds = time.perf_counter() - start
+        rows = sum(self.created.values())
+        return {
+            'written': not self.errors and not dryRun,
+            'errors': self.errors,
+            'created': dict(self.created),
+            'existing': dict(self.existing),
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rowsPerSecond': round(rows / seconds) if seconds else 0,
+        }
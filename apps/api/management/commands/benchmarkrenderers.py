@@ -0,0 +1,45 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.api.benchmark import benchmarkRenderers
+from .benchmarkroutes import numbers
+
+
+class Command(BaseCommand):
+    help = ('Compare the size and render time of the JSON, fast JSON and MessagePack renderers on the '
+            'timetables of a full synthetic school. Runs on a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=6, help='classes in each half of a year')
+        parser.add_argument('--years', type=numbers, default=(7, 8, 9, 10, 11), help='yeargroups e.g 7,8,9')
+        parser.add_argument('--repeat', type=int, default=20, help='renders of each payload per renderer')
+        parser.add_argument('--output', default='renderers.json', help='where to write the report')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        oldName = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user(username='benchmark', is_staff=True)
+            report = benchmarkRenderers(user, classesPerHalf=options['size'], years=options['years'],
+                                        repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        self.stdout.write(f"{report['school']['classes']} classes, {report['school']['timeslots']} timeslots")
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'payload':<26}{'renderer':<22}{'bytes':>10}{'gzip':>9}{'median ms':>11}{'size':>7}{'speedup':>9}"))
+        for payload in report['payloads']:
+            for result in payload['renderers']:
+                self.stdout.write(
+                    f"{payload['name']:<26}{result['renderer']:<22}{result['bytes']:>10}{result['gzipBytes']:>9}"
+                    f"{result['medianMs']:>11.3f}{result['sizeRatio']:>7.2f}{result['speedup']:>8.2f}x")
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,52 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.api.benchmark import benchmarkRoutes
+
+
+def numbers(value:str) -> tuple:
+    return tuple(int(number) for number in value.split(','))
+
+
+class Command(BaseCommand):
+    help = ('Measure the time and SQL queries of every api route on synthetic schools of growing size '
+            'and write a JSON report. Runs on a throwaway test database, use SQLITE=1 to run it offline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=numbers, default=(1, 3, 6),
+                            help='classes in each half of a year for each school e.g 1,3,6')
+        parser.add_argument('--years', type=numbers, default=(7, 8, 9), help='yeargroups e.g 7,8,9')
+        parser.add_argument('--fill', type=float, default=0.6, help='fraction of the timetable filled in')
+        parser.add_argument('--repeat', type=int, default=5, help='timed requests per route and size')
+        parser.add_argument('--output', default='benchmark.json', help='where to write the report')
+
+    def handle(self, *args, **options):
+        # the schools are made up so they go in a test database, never the real one
+        setup_test_environment()
+        oldName = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user(username='benchmark', is_staff=True)
+            report = benchmarkRoutes(user, sizes=options['sizes'], years=options['years'],
+                                     fill=options['fill'], repeat=options['repeat'], log=self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        # a column per school, queries and median time, routes with growing queries are highlighted
+        header = ''.join(f"{str(school['classes']) + ' classes':>18}" for school in report['schools'])
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{'route':<28}{header}"))
+        for route in report['routes']:
+            cells = ''.join(f"{run['queries']:>5}q {run['medianMs']:>9.2f}ms " for run in route['results'])
+            line = f"{route['method'] + ' ' + route['name']:<28}{cells}"
+            self.stdout.write(self.style.WARNING(line) if route['queriesGrow'] else line)
+        for route in report['skipped']:
+            self.stdout.write(f"{route['method'] + ' ' + route['name']:<28}skipped, no request for it in benchmark.py")
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
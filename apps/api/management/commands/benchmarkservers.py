@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from knox.models import AuthToken
+
+from apps.api.benchmark import benchmarkServers
+from .benchmarkroutes import numbers
+
+
+class Command(BaseCommand):
+    help = ('Load /api/overview/ and /api/rooms/ with concurrent clients on the WSGI and the ASGI '
+            'deployment (config/gunicorn.py) and compare them. Starts both servers with gunicorn on a '
+            'throwaway test database, with SQLITE=1 it is a file in a temporary directory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=6, help='classes in each half of a year')
+        parser.add_argument('--years', type=numbers, default=(7, 8, 9, 10, 11), help='yeargroups e.g 7,8,9')
+        parser.add_argument('--concurrency', type=numbers, default=(1, 8, 32),
+                            help='clients at once for each run e.g 1,8,32')
+        parser.add_argument('--seconds', type=float, default=5, help='length of each run')
+        parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes of each server')
+        parser.add_argument('--output', default='servers.json', help='where to write the report')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        oldName = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            # the servers can not open a database in memory
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user(username='benchmark', is_staff=True)
+            _, token = AuthToken.objects.create(user)
+            report = benchmarkServers(user, token, classesPerHalf=options['size'], years=options['years'],
+                                      concurrency=options['concurrency'], seconds=options['seconds'],
+                                      workers=options['workers'], log=self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        self.stdout.write(f"{report['school']['classes']} classes, {report['school']['timeslots']} timeslots, "
+                          f"{report['workers']} worker(s) a server, {report['seconds']}s a run")
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'route':<16}{'server':<8}{'clients':>8}{'req/s':>10}{'median ms':>11}{'p95 ms':>10}{'errors':>8}"))
+        for route in report['routes']:
+            for kind in ('wsgi', 'asgi'):
+                for run in route[kind]:
+                    self.stdout.write(
+                        f"{route['name']:<16}{kind:<8}{run['concurrency']:>8}{run['perSecond']:>10.1f}"
+                        f"{run['medianMs'] or 0:>11.2f}{run['p95Ms'] or 0:>10.2f}{run['errors']:>8}")
+            speedups = ', '.join(f'{speedup}x' for speedup in route['speedup'])
+            line = f"{route['name']}: ASGI against WSGI {speedups}"
+            self.stdout.write(self.style.SUCCESS(line) if route['sameResponse'] else
+                              self.style.ERROR(line + ', the responses differ'))
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.api.changelog import compact
+
+
+class Command(BaseCommand):
+    help = ('Remove the Timeslot changes older than CHANGE_LOG_DAYS from the change log. Clients which '
+            'last synced before then are told to download the timetable again. Run it every day e.g from the scheduler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='keep this many days instead of CHANGE_LOG_DAYS')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.CHANGE_LOG_DAYS
+        removed = compact(days)
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} changes older than {days} days'))
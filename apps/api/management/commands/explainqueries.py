@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from apps.api.models import Teacher, Timeslot, Subject, ClassGroup, splitClassCode
+from apps.api.availability import freeTeachers, freeRoomsQuery
+from apps.api.counters import classLessons
+from apps.api.suggestions import subjectsWithLessons
+from apps.api.synthetic import createSchool
+
+
+class Command(BaseCommand):
+    help = ('Print the EXPLAIN plan of the queries each endpoint runs, without the Timeslot '
+            'indexes and constraints and then with them, so the table scans can be compared. '
+            'Runs on a throwaway test database with a synthetic school unless --real-database is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', default='Mon')
+        parser.add_argument('--unit', default='Unit1')
+        parser.add_argument('--class', dest='class_', help='class code, defaults to the first class')
+        parser.add_argument('--classes', type=int, default=6, help='classes in each half of a year of the synthetic school')
+        parser.add_argument('--real-database', action='store_true',
+                            help='explain on the configured database, its Timeslot indexes and constraints '
+                                 'are dropped in a transaction which is rolled back')
+
+    def queries(self, day, unit, classCode):
+        """The querysets behind each route for one timeslot and class."""
+        year, half = splitClassCode(classCode)
+        teacher = Teacher.objects.values_list('name', flat=True).first() or ''
+        # the route reads the names first and passes them in
+        subjects = set(Subject.objects.filter(yearGroup__name=f'Yr{year}').values_list('name', flat=True))
+        # the database paths, not the occupancy index
+        with override_settings(OCCUPANCY_INDEX=False):
+            teachers = freeTeachers(day, unit)
+            rooms = freeRoomsQuery(day, unit, classCode, teacher, 'Maths')
+        return [
+            ('timeslots list', Timeslot.objects.select_related('Teacher', 'Room', 'Subject', 'ClassGroup')),
+            ('timeslots retrieve', Timeslot.objects.at(day, unit).filter(ClassGroup__classCode=classCode)),
+            ('year retrieve: timeslots', Timeslot.objects.filter(ClassGroup__year=year)),
+            ('year retrieve: lessons remaining', classLessons([classCode], subjects)),
+            ('subjects retrieve: year half', Timeslot.objects.at(day, unit).filter(
+                ClassGroup__year=year, ClassGroup__half=half,
+            ).values_list('Subject__name', flat=True).distinct()),
+            ('subjects retrieve: lessons of each subject', subjectsWithLessons(year, classCode)),
+            ('teachers list / overview', teachers),
+            ('rooms list', rooms),
+            ('overview: used rooms', Timeslot.objects.at(day, unit).values_list('Room', flat=True)),
+        ]
+
+    def explain(self, day, unit, classCode):
+        for name, queryset in self.queries(day, unit, classCode):
+            self.stdout.write(self.style.MIGRATE_LABEL(f'  {name}'))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f'    {line}')
+
+    def handle(self, *args, **options):
+        if options['real_database']:
+            return self.compare(options)
+        # dropping indexes takes locks and rebuilds tables, so by default it is a test database
+        setup_test_environment()
+        oldName = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            createSchool(classesPerHalf=options['classes'], fill=0.6)
+            self.compare(options)
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+            teardown_test_environment()
+
+    def compare(self, options):
+        '''Explain the queries without the Timeslot indexes and constraints, then with them.'''
+        classCode = options['class_'] or ClassGroup.objects.values_list('classCode', flat=True).first()
+        if classCode is None:
+            raise CommandError('There are no classes to explain the queries for')
+        day, unit = options['day'], options['unit']
+
+        meta = Timeslot._meta
+        indexes, constraints = meta.indexes, meta.constraints
+        self.stdout.write(self.style.MIGRATE_HEADING('Before: without the Timeslot indexes and constraints'))
+        # Drop them in a transaction which is rolled back so the schema is left as it was.
+        # SQLite rebuilds the table from the model to drop a constraint, so the model must
+        # not list them while that happens, and foreign key checks have to be off first.
+        checksDisabled = connection.disable_constraint_checking()
+        try:
+            with transaction.atomic():
+                meta.indexes, meta.constraints = [], []
+                try:
+                    with connection.schema_editor(atomic=False) as editor:
+                        for index in indexes:
+                            editor.remove_index(Timeslot, index)
+                        for constraint in constraints:
+                            editor.remove_constraint(Timeslot, constraint)
+                finally:
+                    meta.indexes, meta.constraints = indexes, constraints
+                self.explain(day, unit, classCode)
+                transaction.set_rollback(True)
+        finally:
+            if checksDisabled:
+                connection.enable_constraint_checking()
+
+        self.stdout.write(self.style.MIGRATE_HEADING('After: with the Timeslot indexes and constraints'))
+        self.explain(day, unit, classCode)
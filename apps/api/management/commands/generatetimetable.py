@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.models import YearGroup
+from apps.api.solver import generateTimetable
+
+
+class Command(BaseCommand):
+    help = 'Fill the timetable of every class in a yeargroup e.g generatetimetable 7'
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int)
+        parser.add_argument('--replace', action='store_true',
+                            help='delete the lessons the classes already have first')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='work out the timetable without saving it')
+
+    def handle(self, *args, **options):
+        try:
+            yearGroup = YearGroup.objects.get(name=f"Yr{options['year']}")
+        except YearGroup.DoesNotExist:
+            raise CommandError(f"Yeargroup Yr{options['year']} does not exist")
+
+        start = time.perf_counter()
+        report = generateTimetable(yearGroup, replace=options['replace'], dryRun=options['dry_run'])
+        seconds = time.perf_counter() - start
+
+        for lesson in report['unplaced']:
+            self.stdout.write(self.style.ERROR(
+                f"{lesson['class']} {lesson['subject']}: {lesson['missing']} lessons missing - {lesson['constraint']}"))
+        for warning in report['warnings']:
+            self.stdout.write(self.style.WARNING(
+                f"{warning['class']} {warning['subject']} {warning['day']} {warning['unit']}: {warning['constraint']}"))
+        action = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(f"{action} {report['created']} lessons for {yearGroup.name} in {seconds:.2f}s"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.importer import SchoolImport, readFiles
+
+
+class Command(BaseCommand):
+    help = ('Import teachers, rooms, blocks, yeargroups, classes, subjects, subject groups and timetables '
+            'from JSON, CSV or fixture files in one transaction e.g importschool school.json timeslots.csv')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='JSON or fixture files, or CSV files named after their section')
+        parser.add_argument('--dry-run', action='store_true', help='check and import everything then roll it back')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+
+    def handle(self, *args, **options):
+        try:
+            data = readFiles(options['files'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Could not read the files: {error}')
+
+        report = SchoolImport(data, batchSize=options['batch_size']).run(dryRun=options['dry_run'])
+        if report['errors']:
+            for message in report['errors'][:50]:
+                self.stdout.write(self.style.ERROR(message))
+            raise CommandError(f"{len(report['errors'])} errors, nothing was imported")
+
+        for table, rows in report['created'].items():
+            self.stdout.write(f'{table:<28}{rows:>8} rows')
+        for section, rows in report['existing'].items():
+            self.stdout.write(self.style.WARNING(f'{section:<28}{rows:>8} already there, left as they were'))
+        action = 'Checked' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {report['rows']} rows in {report['seconds']:.2f}s ({report['rowsPerSecond']} rows/s)"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.api.counters import repair
+
+
+class Command(BaseCommand):
+    help = ('Count the lessons of every teacher and of every class and subject again and fix the stored '
+            'counters which are wrong, e.g after changing Timeslot rows by hand in the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the wrong counters')
+
+    def handle(self, *args, **options):
+        report = repair(dryRun=options['dry_run'])
+        for name, counted, stored in report['teachers']:
+            self.stdout.write(self.style.WARNING(f'{name}: {counted} lessons booked, counter said {stored}'))
+        for classCode, subject, counted, stored in report['lessonCounts']:
+            self.stdout.write(self.style.WARNING(f'{classCode} {subject}: {counted} lessons, counter said {stored}'))
+        wrong = len(report['teachers']) + len(report['lessonCounts'])
+        if not wrong:
+            self.stdout.write(self.style.SUCCESS('All counters are right'))
+        elif options['dry_run']:
+            self.stdout.write(f'{wrong} counters are wrong')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {wrong} counters'))
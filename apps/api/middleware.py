@@ -0,0 +1,124 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+"""
+Count the SQL queries and the time spent in the database for every
+request. Turned on with QUERY_METRICS in the settings. The numbers are
+sent back in the X-DB-Queries and X-DB-Time-Ms headers, requests over
+QUERY_BUDGET queries or QUERY_TIME_BUDGET_MS are logged with the
+statements they repeat most (the sign of an N+1), and totals are kept
+per route for /api/metrics/.
+"""
+
+logger = logging.getLogger(__name__)
+
+# IN lists of different lengths are the same statement
+IN_LIST = re.compile(r'(%s, )+%s')
+
+
+class QueryRecorder:
+    '''Execute wrapper which records every statement run on a connection.'''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            # the sql still has the placeholders so the same query with other values counts once
+            self.statements[IN_LIST.sub('%s...', sql)] += 1
+
+
+class RouteStats:
+    '''Totals per route for the life of the process, like the occupancy index.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.routes = {}
+
+    def add(self, route:str, queries:int, dbMs:float, ms:float, overBudget:bool):
+        with self.lock:
+            stats = self.routes.setdefault(route, {
+                'requests': 0, 'queries': 0, 'maxQueries': 0,
+                'dbMs': 0.0, 'maxDbMs': 0.0, 'ms': 0.0, 'overBudget': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['maxQueries'] = max(stats['maxQueries'], queries)
+            stats['dbMs'] += dbMs
+            stats['maxDbMs'] = max(stats['maxDbMs'], dbMs)
+            stats['ms'] += ms
+            stats['overBudget'] += overBudget
+
+    def report(self) -> list:
+        """The totals of every route with the averages, most time in the database first.
+
+        Returns:
+            list: one dict per route
+        """
+        with self.lock:
+            routes = [dict(stats, route=route) for route, stats in self.routes.items()]
+        for stats in routes:
+            stats['meanQueries'] = round(stats['queries'] / stats['requests'], 2)
+            stats['meanDbMs'] = round(stats['dbMs'] / stats['requests'], 3)
+            stats['meanMs'] = round(stats['ms'] / stats['requests'], 3)
+            for key in ('dbMs', 'maxDbMs', 'ms'):
+                stats[key] = round(stats[key], 3)
+        return sorted(routes, key=lambda stats: stats['dbMs'], reverse=True)
+
+
+stats = RouteStats()
+
+
+class QueryCountMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        ms = (time.perf_counter() - start) * 1000
+        dbMs = recorder.seconds * 1000
+
+        response['X-DB-Queries'] = str(recorder.count)
+        response['X-DB-Time-Ms'] = f'{dbMs:.2f}'
+
+        match = request.resolver_match
+        # unresolved paths share one bucket so made up URLs can not grow the stats forever,
+        # routes without a name go by their pattern
+        if match is None:
+            route = f'{request.method} <unresolved>'
+        else:
+            route = f'{request.method} {match.url_name or match.route}'
+        overBudget = (recorder.count > getattr(settings, 'QUERY_BUDGET', 20)
+                      or dbMs > getattr(settings, 'QUERY_TIME_BUDGET_MS', 200))
+        if overBudget:
+            repeated = '\n'.join(f'  {times}x {sql}' for sql, times in recorder.statements.most_common(3))
+            logger.warning('%s %s ran %d queries in %.1fms, most repeated:\n%s',
+                           request.method, request.get_full_path(), recorder.count, dbMs, repeated)
+        stats.add(route, recorder.count, dbMs, ms, overBudget)
+        return response
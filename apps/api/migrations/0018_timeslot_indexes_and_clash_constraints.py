@@ -0,0 +1,48 @@
+# Generated by Django 3.2 on 2026-10-18 12:47
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_clashes(apps, schema_editor):
+    """Stop with a readable list of clashes instead of an IntegrityError
+    if the timetable already has someone in two places at once."""
+    Timeslot = apps.get_model('api', 'Timeslot')
+    clashes = []
+    for field in ['Teacher', 'Room', 'ClassGroup']:
+        duplicates = Timeslot.objects.values(field, 'Day', 'Unit').annotate(
+            lessons=Count('id')).filter(lessons__gt=1)
+        clashes += [f"{field} {row[field]} on {row['Day']} {row['Unit']}" for row in duplicates]
+    if clashes:
+        raise RuntimeError('Remove these double bookings before migrating: ' + ', '.join(clashes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_auto_20220502_1640'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_clashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['Day', 'Unit'], name='timeslot_day_unit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['ClassGroup', 'Subject'], name='timeslot_class_subject_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('Teacher', 'Day', 'Unit'), name='unique_teacher_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('Room', 'Day', 'Unit'), name='unique_room_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('ClassGroup', 'Day', 'Unit'), name='unique_class_timeslot'),
+        ),
+    ]
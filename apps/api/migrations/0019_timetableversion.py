@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_timeslot_indexes_and_clash_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimetableVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
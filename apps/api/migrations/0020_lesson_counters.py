@@ -0,0 +1,49 @@
+# Generated by Django 3.2 on 2026-10-18 13:16
+
+from django.db import migrations, models
+import django.db.models.functions
+import django.db.models.deletion
+
+
+def countLessons(apps, schema_editor):
+    '''Fill the counters from the lessons already on the timetable.'''
+    Teacher = apps.get_model('api', 'Teacher')
+    Timeslot = apps.get_model('api', 'Timeslot')
+    LessonCount = apps.get_model('api', 'LessonCount')
+    booked = models.Subquery(Timeslot.objects.filter(Teacher=models.OuterRef('pk')).values('Teacher').annotate(
+        booked=models.Count('id')).values('booked'), output_field=models.IntegerField())
+    Teacher.objects.update(bookedLessons=models.functions.Coalesce(booked, models.Value(0)))
+    LessonCount.objects.bulk_create([
+        LessonCount(ClassGroup_id=classId, Subject_id=subjectId, lessons=lessons)
+        for classId, subjectId, lessons in Timeslot.objects.values_list(
+            'ClassGroup_id', 'Subject_id').annotate(lessons=models.Count('id')).order_by()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_timetableversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teacher',
+            name='bookedLessons',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='LessonCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lessons', models.IntegerField(default=0)),
+                ('ClassGroup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.classgroup')),
+                ('Subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.subject')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lessoncount',
+            constraint=models.UniqueConstraint(fields=('ClassGroup', 'Subject'), name='unique_lesson_count'),
+        ),
+        migrations.RunPython(countLessons, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2 on 2026-10-18 13:19
+
+import re
+
+from django.db import migrations, models
+
+
+def splitClassCodes(apps, schema_editor):
+    '''Fill year and half from the codes of the classes there already are, as models.splitClassCode does.'''
+    ClassGroup = apps.get_model('api', 'ClassGroup')
+    classes = list(ClassGroup.objects.all())
+    for classGroup in classes:
+        match = re.match(r'\s*(\d+)([A-Za-z]?)', classGroup.classCode or '')
+        if match is not None:
+            classGroup.year, classGroup.half = int(match.group(1)), match.group(2).upper()
+    ClassGroup.objects.bulk_update(classes, ['year', 'half'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_lesson_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classgroup',
+            name='half',
+            field=models.CharField(blank=True, editable=False, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='classgroup',
+            name='year',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='classgroup',
+            index=models.Index(fields=['year', 'half'], name='classgroup_year_half_idx'),
+        ),
+        migrations.RunPython(splitClassCodes, migrations.RunPython.noop),
+    ]
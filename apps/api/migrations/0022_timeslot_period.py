@@ -0,0 +1,63 @@
+# Generated by Django 3.2 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri']
+UNITS = ['Unit1', 'Unit2', 'Form', 'Unit3', 'Unit4', 'Unit5']
+
+
+def fill_periods(apps, schema_editor):
+    '''Set period for the lessons there already are, as models.periodOf does. One UPDATE per period.'''
+    Timeslot = apps.get_model('api', 'Timeslot')
+    for dayNumber, day in enumerate(DAYS):
+        for unitNumber, unit in enumerate(UNITS):
+            Timeslot.objects.filter(Day=day, Unit=unit).update(period=dayNumber * len(UNITS) + unitNumber)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_classgroup_year_half'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='period',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_periods, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='timeslot',
+            name='timeslot_day_unit_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='timeslot',
+            name='unique_teacher_timeslot',
+        ),
+        migrations.RemoveConstraint(
+            model_name='timeslot',
+            name='unique_room_timeslot',
+        ),
+        migrations.RemoveConstraint(
+            model_name='timeslot',
+            name='unique_class_timeslot',
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['period'], name='timeslot_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('Teacher', 'period'), name='unique_teacher_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('Room', 'period'), name='unique_room_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('ClassGroup', 'period'), name='unique_class_timeslot'),
+        ),
+    ]
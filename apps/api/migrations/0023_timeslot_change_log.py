@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_timeslot_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeslotChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timeslot', models.IntegerField()),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('changedAt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
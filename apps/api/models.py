@@ -1,4 +1,53 @@
-from django.db import models
+import re
+
+from django.db import models, transaction
+
+
+def splitClassCode(classCode:str) -> tuple:
+    '''The year and half of a class from its code, 10B2 -> (10, 'B'). (None, '') when it has no year.'''
+    match = re.match(r'\s*(\d+)([A-Za-z]?)', classCode or '')
+    if match is None:
+        return None, ''
+    return int(match.group(1)), match.group(2).upper()
+
+
+# Subjects a year half is taught together, see solver.py and suggestions.py
+BLOCKED_SUBJECTS = ['Maths','English','PE','PSHE']
+
+
+def periodOf(day:str, unit:str):
+    '''The period of a Day and Unit, Mon Unit1 is 0 and Fri Unit5 is 29. None if there is no such timeslot.'''
+    return PERIODS.get((day, unit))
+
+
+class TimeslotQuerySet(models.QuerySet):
+    '''Timeslot.objects, keeps period in step with Day and Unit in bulk writes too.'''
+
+    def at(self, day:str, unit:str):
+        '''The lessons on a Day and Unit, an exact lookup on the indexed period.'''
+        return self.filter(period=periodOf(day, unit))
+
+    def onDay(self, day:str):
+        '''All the lessons of a day, a range of periods.'''
+        first = periodOf(day, UNITS[0])
+        if first is None:
+            return self.none()
+        return self.filter(period__range=(first, first + len(UNITS) - 1))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for timeslot in objs:
+            timeslot.setPeriod()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'Day' in fields or 'Unit' in fields:
+            objs = list(objs)
+            for timeslot in objs:
+                timeslot.setPeriod()
+            fields = [*fields, 'period']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
 
 class Timeslot(models.Model):
     # ENUM Choices
@@ -24,10 +73,52 @@ class Timeslot(models.Model):
     Room = models.ForeignKey('Room', on_delete=models.CASCADE)
     Subject = models.ForeignKey('Subject', on_delete=models.CASCADE)
     ClassGroup = models.ForeignKey('ClassGroup',on_delete=models.CASCADE)
+    # Day x Unit as one number in week order, see periodOf. Set from Day and Unit
+    # before every save, loaddata's raw ones too (signals.py), and by
+    # Timeslot.objects.bulk_create / bulk_update, QuerySet.update of Day or Unit
+    # has to set it too.
+    period = models.PositiveSmallIntegerField(editable=False)
+
+    objects = TimeslotQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # every "who is busy now" query filters on the timeslot, a day is a range of it
+            models.Index(fields=['period'], name='timeslot_period_idx'),
+            # lessons a class has of a subject
+            models.Index(fields=['ClassGroup','Subject'], name='timeslot_class_subject_idx'),
+        ]
+        # Nobody can be in two places at once. Blocked subjects do not need
+        # an exception: the classes of a half share the subject but each
+        # class still has its own teacher and room.
+        constraints = [
+            models.UniqueConstraint(fields=['Teacher','period'], name='unique_teacher_timeslot'),
+            models.UniqueConstraint(fields=['Room','period'], name='unique_room_timeslot'),
+            models.UniqueConstraint(fields=['ClassGroup','period'], name='unique_class_timeslot'),
+        ]
+
+    def setPeriod(self):
+        self.period = periodOf(self.Day, self.Unit)
+
+    def save(self, *args, **kwargs):
+        # the pre_save receiver sets period, it only has to be written too
+        updateFields = kwargs.get('update_fields')
+        if updateFields is not None and ('Day' in updateFields or 'Unit' in updateFields):
+            kwargs['update_fields'] = {*updateFields, 'period'}
+        # the post_save receivers log and count the lesson, they commit with it or not at all
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+DAYS = [day for day, _ in Timeslot.DayChoices]
+UNITS = [unit for unit, _ in Timeslot.UnitChoices]
+PERIODS = {(day, unit): dayNumber * len(UNITS) + unitNumber
+           for dayNumber, day in enumerate(DAYS) for unitNumber, unit in enumerate(UNITS)}
 
 class Teacher(models.Model):
     name = models.CharField(max_length=50,default="Mrs Jones")
     LessonsWeekly = models.IntegerField(default=0)
+    # lessons on the timetable, kept up to date by counters.py
+    bookedLessons = models.IntegerField(default=0)
     Room = models.ManyToManyField("Room", blank=True)
     SubjectTeach = models.ManyToManyField("SubjectGroup", blank=True)
 
@@ -86,6 +177,27 @@ class ClassGroup(models.Model):
     classCode = models.CharField(max_length=10)
     NumOfPupils = models.IntegerField(default=0)
     Subjects = models.ManyToManyField('Subject',blank=True)
+    # split out of classCode before every save, loaddata's raw ones too (signals.py),
+    # so a year or half is an exact indexed lookup instead of classCode LIKE '%7A%',
+    # bulk_create callers have to call setYearHalf
+    year = models.IntegerField(null=True, blank=True, editable=False)
+    half = models.CharField(max_length=1, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # the year on its own uses the same index
+            models.Index(fields=['year','half'], name='classgroup_year_half_idx'),
+        ]
+
+    def setYearHalf(self):
+        self.year, self.half = splitClassCode(self.classCode)
+
+    def save(self, *args, **kwargs):
+        # the pre_save receiver sets year and half, they only have to be written too
+        updateFields = kwargs.get('update_fields')
+        if updateFields is not None and 'classCode' in updateFields:
+            kwargs['update_fields'] = {*updateFields, 'year', 'half'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.classCode
@@ -107,4 +219,42 @@ class SubjectGroup(models.Model):
     subjects = models.ManyToManyField('Subject',blank=True)
 
     def __str__(self):
-        return f'{self.name}'
\ No newline at end of file
+        return f'{self.name}'
+
+class TimetableVersion(models.Model):
+    # 'global', 'shared' or a yeargroup e.g Yr7, bumped by versions.py
+    key = models.CharField(max_length=10, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key} v{self.version}'
+
+class LessonCount(models.Model):
+    # lessons a class has of a subject, kept up to date by counters.py
+    ClassGroup = models.ForeignKey('ClassGroup', on_delete=models.CASCADE)
+    Subject = models.ForeignKey('Subject', on_delete=models.CASCADE)
+    lessons = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ClassGroup','Subject'], name='unique_lesson_count'),
+        ]
+
+    def __str__(self):
+        return f'{self.ClassGroup} {self.Subject}: {self.lessons}'
+
+class TimeslotChange(models.Model):
+    # A create, update or delete of a Timeslot, written by changelog.py in the
+    # transaction making it. The id is the cursor of /api/timeslots/changes/.
+    ActionChoices = [
+        ('create','Create'),
+        ('update','Update'),
+        ('delete','Delete'),
+    ]
+    # not a foreign key, the log outlives deleted lessons
+    timeslot = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ActionChoices)
+    changedAt = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.id}: {self.action} timeslot {self.timeslot}'
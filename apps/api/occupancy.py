@@ -0,0 +1,152 @@
+import threading
+
+from django.conf import settings
+
+from .models import Timeslot, DAYS, UNITS, PERIODS
+from . import versions
+
+"""
+Process local index of who is busy on the timetable.
+Each teacher, room and class group has a 30 bit mask, one bit for
+every Day x Unit of the week (5 days x 6 units), so checking if
+something is free on a timeslot is a bit operation instead of a query.
+
+The index is built from the Timeslot table and keyed to the lessons
+version (versions.py) it was built at. Every change to the lessons bumps
+that version in the database, whichever server process made it, and
+nothing else does, so a renamed room or teacher leaves the index alone.
+The version, one indexed row, is read once per request and the index is
+rebuilt when it has moved. Bulk writes which skip the signals have to
+bump it through versions.lessonsChanged, as they already do for the ETags.
+GET /api/metrics/occupancy/ compares the index of the process answering
+with the Timeslot table.
+"""
+
+KINDS = ('teacher', 'room', 'class')
+
+
+def slotBit(day:str, unit:str) -> int:
+    """Get the mask bit for a Day and Unit pair, bit n is Timeslot.period n.
+    Mon Unit1 is bit 0 and Fri Unit5 is bit 29.
+
+    Args:
+        day (str): the week day e.g Mon
+        unit (str): the unit of the day e.g Unit3
+
+    Returns:
+        int: a mask with the single bit for the timeslot set
+    """
+    return 1 << PERIODS[(day, unit)]
+
+
+def isEnabled() -> bool:
+    """The routes use the index unless OCCUPANCY_INDEX is turned off in
+    the settings, in which case they go back to querying Timeslot.
+    """
+    return getattr(settings, 'OCCUPANCY_INDEX', True)
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        '''Forget everything, the index is rebuilt the next time it is used.'''
+        with self.lock:
+            self.built = False
+            # lessons version the masks were built at
+            self.version = None
+            self.masks = {kind: {} for kind in KINDS}
+            self.timeslots = 0
+
+    def build(self, version:str=None):
+        '''Read every timeslot and fill in the masks. Two queries.'''
+        # the version is read first, a change committed while reading moves it again
+        version = version or versions.lessonsVersion()
+        with self.lock:
+            self.clear()
+            rows = Timeslot.objects.values_list('period', 'Teacher', 'Room', 'ClassGroup')
+            for period, teacher, room, classGroup in rows.iterator():
+                bit = 1 << period
+                for kind, key in (('teacher', teacher), ('room', room), ('class', classGroup)):
+                    self.masks[kind][key] = self.masks[kind].get(key, 0) | bit
+                self.timeslots += 1
+            self.version = version
+            self.built = True
+
+    def ensureCurrent(self):
+        '''Rebuild the index if the timetable changed since it was built, in any process.'''
+        version = versions.lessonsVersion()
+        with self.lock:
+            if not self.built or self.version != version:
+                self.build(version)
+
+    def isFree(self, kind:str, key:int, day:str, unit:str) -> bool:
+        """Check if a teacher, room or class has nothing on a timeslot.
+
+        Args:
+            kind (str): teacher, room or class
+            key (int): id of the teacher, room or class group
+            day (str): the week day e.g Mon
+            unit (str): the unit of the day e.g Unit3
+
+        Returns:
+            bool: True if there is no lesson for it on the timeslot
+        """
+        self.ensureCurrent()
+        with self.lock:
+            return not self.masks[kind].get(key, 0) & slotBit(day, unit)
+
+    def busy(self, kind:str, day:str, unit:str) -> set:
+        """Get the ids of all the teachers, rooms or classes which have a
+        lesson on a timeslot.
+
+        Args:
+            kind (str): teacher, room or class
+            day (str): the week day e.g Mon
+            unit (str): the unit of the day e.g Unit3
+
+        Returns:
+            set: ids of the busy entities
+        """
+        self.ensureCurrent()
+        with self.lock:
+            bit = slotBit(day, unit)
+            return {key for key, mask in self.masks[kind].items() if mask & bit}
+
+    def free(self, kind:str, keys, day:str, unit:str) -> set:
+        '''Filter ids down to the ones with nothing on the timeslot.'''
+        return set(keys) - self.busy(kind, day, unit)
+
+    def snapshot(self) -> dict:
+        '''Copy of the non empty masks, used to compare two indexes.'''
+        self.ensureCurrent()
+        with self.lock:
+            return {kind: {key: mask for key, mask in masks.items() if mask}
+                    for kind, masks in self.masks.items()}
+
+    def check(self) -> list:
+        """Compare the index with one built from the Timeslot table now and
+        rebuild it when they differ, which only happens if a write did not
+        bump the version.
+
+        Returns:
+            list: {'kind', 'id', 'index', 'database'} for each mask which differed, as 30 bit strings
+        """
+        actual = self.snapshot()
+        rebuilt = OccupancyIndex()
+        rebuilt.build()
+        expected = rebuilt.snapshot()
+        differences = []
+        for kind in KINDS:
+            for key in sorted(expected[kind].keys() | actual[kind].keys()):
+                want, have = expected[kind].get(key, 0), actual[kind].get(key, 0)
+                if want != have:
+                    differences.append({'kind': kind, 'id': key, 'index': f'{have:030b}', 'database': f'{want:030b}'})
+        if differences:
+            self.build()
+        return differences
+
+
+index = OccupancyIndex()
@@ -0,0 +1,95 @@
+from django.db.models import Prefetch
+from rest_framework import status
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+"""
+Cursor pagination and sparse fieldsets for the list routes, both opt in so
+clients which want everything keep getting a plain list:
+    /api/timeslots/?fields=Day,Unit,Teacher&page_size=100
+    then follow "next" which has the cursor
+The cursor holds the id the page stopped at rather than an offset, so rows
+added or deleted while a client pages through do not shift the pages.
+Only the columns of the fields asked for are selected and related tables
+are only joined when one of their fields is asked for.
+"""
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+def wantsPage(request) -> bool:
+    return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+
+def requestedFields(request, serializerClass):
+    """The fields= query param checked against the fields the serializer has.
+
+    Returns:
+        tuple: (list of fields or None for all of them, error message or None)
+    """
+    available = list(serializerClass().fields)
+    param = request.query_params.get('fields')
+    if not param:
+        return None, None
+    fields = [field.strip() for field in param.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        return None, f"Unknown fields {', '.join(unknown)}, choose from {', '.join(available)}"
+    return fields, None
+
+
+def sparseQueryset(queryset, serializerClass, fields:list):
+    """Select the columns the fields need: only() for plain ones, a join
+    for the slug of a foreign key and a prefetch of the slugs of a many to many.
+    """
+    serializer = serializerClass()
+    columns, joins = [], []
+    for name in fields:
+        field = serializer.fields[name]
+        slug = getattr(getattr(field, 'child_relation', field), 'slug_field', None)
+        modelField = queryset.model._meta.get_field(field.source)
+        if modelField.many_to_many and slug:
+            queryset = queryset.prefetch_related(Prefetch(
+                field.source, queryset=modelField.related_model.objects.only(slug)))
+        elif modelField.is_relation and slug:
+            columns.append(f'{field.source}__{slug}')
+            joins.append(field.source)
+        elif not modelField.many_to_many:
+            columns.append(field.source)
+    if joins:
+        queryset = queryset.select_related(*joins)
+    return queryset.only(*columns)
+
+
+def sparseList(request, view, queryset, serializerClass, prepare=None) -> Response:
+    """The serialized list with only the fields= asked for, a page of it when
+    a cursor or page_size is given.
+
+    Args:
+        request (Request): the list request
+        view (ViewSet): the view, for the pagination links
+        queryset (QuerySet): everything the list can have
+        serializerClass (class): a serializer with SparseFieldsMixin
+        prepare (callable): adds the joins every field needs when all of them are sent
+
+    Returns:
+        Response: the rows, or {next, previous, results} when paginated
+    """
+    fields, error = requestedFields(request, serializerClass)
+    if error:
+        return Response({'msg': error}, status=status.HTTP_400_BAD_REQUEST)
+    if fields is None:
+        queryset = prepare(queryset) if prepare else queryset
+    else:
+        queryset = sparseQueryset(queryset, serializerClass, fields)
+
+    if not wantsPage(request):
+        return Response(serializerClass(queryset, many=True, fields=fields).data)
+    paginator = IdCursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(serializerClass(page, many=True, fields=fields).data)
@@ -0,0 +1,123 @@
+import threading
+from collections import Counter
+
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from .models import Teacher, YearGroup, Room, Subject, ClassGroup, Block, SubjectGroup
+from .serializers import TeacherSerializer, YeargroupSerializer, RoomSerializer, SubjectSerializer, BlockSerializer
+
+"""
+Cache of the serialized reference data: rooms, teachers, subjects,
+yeargroups and blocks. They change a few times a term but most routes
+send some of them, so they are read and serialized once and kept in the
+'reference' cache (see CACHES in the settings) until one of the models
+they are made from is saved, deleted or has a relation changed.
+Every process on the machine shares the cache, so the keys name the
+database: a benchmark or test database never reads or clears the real
+one's data.
+Hits and misses are counted per process and shown on /api/metrics/.
+"""
+
+CACHE = 'reference'
+
+# name -> function making the serialized data
+BUILDERS = {
+    # keyed by id so routes which work out which rooms or teachers to send
+    # only need their ids from the database
+    'rooms': lambda: {room['id']: dict(room) for room in RoomSerializer(
+        Room.objects.order_by('id'), many=True).data},
+    'teachers': lambda: {teacher['id']: dict(teacher) for teacher in TeacherSerializer(
+        Teacher.objects.prefetch_related('Room').order_by('id'), many=True).data},
+    'subjects': lambda: [dict(subject) for subject in SubjectSerializer(
+        Subject.objects.select_related('yearGroup').order_by('id'), many=True).data],
+    'yeargroups': lambda: [dict(yearGroup) for yearGroup in YeargroupSerializer(
+        YearGroup.objects.prefetch_related('classes').order_by('id'), many=True).data],
+    'blocks': lambda: [dict(block) for block in BlockSerializer(Block.objects.order_by('id'), many=True).data],
+}
+
+# model or m2m table -> the cached data made from it
+DEPENDS = {
+    Room: ['rooms', 'teachers'],
+    Teacher: ['teachers'],
+    Teacher.Room.through: ['teachers'],
+    Teacher.SubjectTeach.through: ['teachers'],
+    Subject: ['subjects'],
+    SubjectGroup.subjects.through: ['subjects'],
+    Block: ['blocks', 'subjects'],
+    YearGroup: ['yeargroups', 'subjects'],
+    YearGroup.classes.through: ['yeargroups'],
+    ClassGroup: ['yeargroups'],
+    ClassGroup.Subjects.through: ['yeargroups'],
+}
+
+lock = threading.Lock()
+counts = Counter()
+
+
+def key(name:str) -> str:
+    # the test database's name once the test runner or a benchmark has made one
+    return f"reference:{connection.settings_dict['NAME']}:{name}"
+
+
+def get(name:str):
+    """Get the serialized data, building and caching it on a miss.
+
+    Args:
+        name (str): one of BUILDERS e.g rooms
+
+    Returns:
+        dict|list: rooms and teachers by id, lists for the rest
+    """
+    cache = caches[CACHE]
+    data = cache.get(key(name))
+    with lock:
+        counts[(name, 'hits' if data is not None else 'misses')] += 1
+    if data is None:
+        data = BUILDERS[name]()
+        cache.set(key(name), data, None)
+    return data
+
+
+def byId(name:str, ids) -> list:
+    """The serialized rooms or teachers with the ids, in the same order.
+    Built again if one is missing, e.g it was added in a transaction
+    which had not committed when the cache was filled.
+
+    Args:
+        name (str): rooms or teachers
+        ids (iterable): ids in the order to return them
+
+    Returns:
+        list: serialized objects
+    """
+    ids = list(ids)
+    data = get(name)
+    if any(id_ not in data for id_ in ids):
+        invalidate([name])
+        data = get(name)
+    return [data[id_] for id_ in ids]
+
+
+def invalidate(names):
+    """Forget cached data. It is deleted now and again after the commit,
+    so a request which read the old rows while the change was being
+    made cannot leave them cached.
+    """
+    keys = [key(name) for name in set(names)]
+    caches[CACHE].delete_many(keys)
+    transaction.on_commit(lambda: caches[CACHE].delete_many(keys))
+
+
+def clear():
+    '''Forget everything and reset the counts.'''
+    caches[CACHE].delete_many([key(name) for name in BUILDERS])
+    with lock:
+        counts.clear()
+
+
+def stats() -> dict:
+    '''Hits and misses of each cached name in this process.'''
+    with lock:
+        return {name: {'hits': counts[(name, 'hits')], 'misses': counts[(name, 'misses')]}
+                for name in BUILDERS}
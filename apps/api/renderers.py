@@ -0,0 +1,51 @@
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+"""
+Renderers picked by the Accept header, see DEFAULT_RENDERER_CLASSES in
+the settings:
+    application/json         FastJSONRenderer, the same JSON as DRF's
+                             renderer made by orjson
+    application/msgpack      MessagePackRenderer, smaller and quicker to
+                             decode for clients with a MessagePack library
+Values neither library knows, like sets, dates and decimals, are turned
+into JSON types the way DRF's encoder does it.
+`manage.py benchmarkrenderers` compares their size and speed.
+"""
+
+encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # pretty printing for the browsable api and ?indent= is left to DRF
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        # json.dumps turns keys like ids into strings, orjson only does it when asked
+        ret = orjson.dumps(data, default=encoder.default, option=orjson.OPT_NON_STR_KEYS)
+        # like DRF, keep the JSON a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encoder.default)
@@ -2,12 +2,33 @@ from rest_framework import serializers
 from .models import Teacher, Timeslot, Block, YearGroup, Room, Subject, ClassGroup
 
 
+class SparseFieldsMixin:
+    # Serializer(..., fields=['Day', 'Unit']) only sends those fields, see pagination.sparseList
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class TimeslotSerializer(serializers.ModelSerializer):
     class Meta:
         model = Timeslot
         fields = '__all__'
 
 
+class TimeslotDisplaySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Read only version of the timeslot with the names of the related rows
+    # instead of their ids. Use it with select_related so it does not query per row.
+    Teacher = serializers.SlugRelatedField(read_only=True, slug_field="name")
+    Room = serializers.SlugRelatedField(read_only=True, slug_field="RoomNumber")
+    Subject = serializers.SlugRelatedField(read_only=True, slug_field="name")
+    ClassGroup = serializers.SlugRelatedField(read_only=True, slug_field="classCode")
+    class Meta:
+        model = Timeslot
+        fields = ('id','Day','Unit','Teacher','Room','Subject','ClassGroup')
+
+
 class TeacherSerializer(serializers.ModelSerializer):
     # Slugs replace the id you would get normally 
     Room = serializers.SlugRelatedField(read_only=True, many=True, slug_field="RoomNumber")
@@ -20,7 +41,7 @@ class BlockSerializer(serializers.ModelSerializer):
         model = Block
         fields = '__all__'
 
-class YeargroupSerializer(serializers.ModelSerializer):
+class YeargroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     classes = serializers.SlugRelatedField(read_only=True, many=True, slug_field="classCode")
     class Meta:
         model = YearGroup
@@ -31,7 +52,7 @@ class RoomSerializer(serializers.ModelSerializer):
         model = Room
         fields = ('id','RoomNumber','RoomType')
 
-class SubjectSerializer(serializers.ModelSerializer):
+class SubjectSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     yearGroup = serializers.SlugRelatedField(read_only=True, slug_field='name')
     class Meta:
         model = Subject
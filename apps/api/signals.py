@@ -0,0 +1,92 @@
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup, SubjectGroup
+from . import versions, reference, counters, changelog
+
+
+# the versions a request reads are kept until it ends
+request_started.connect(versions.requestStarted)
+request_finished.connect(versions.requestFinished)
+
+
+@receiver(pre_save, sender=Timeslot)
+def set_period(sender, instance, **kwargs):
+    # a receiver rather than Timeslot.save so the raw saves of loaddata set it too
+    instance.setPeriod()
+
+
+@receiver(pre_save, sender=ClassGroup)
+def set_year_half(sender, instance, **kwargs):
+    # like set_period, a class loaded from a fixture would be left out of /api/year/<n>/
+    instance.setYearHalf()
+
+
+@receiver([post_save, post_delete], sender=Timeslot)
+def bump_lesson_version(sender, instance, **kwargs):
+    versions.lessonsChanged([instance.ClassGroup_id])
+
+
+@receiver(post_save, sender=Timeslot)
+def log_saved_lesson(sender, instance, created, **kwargs):
+    changelog.record('create' if created else 'update', [instance])
+
+
+@receiver(post_delete, sender=Timeslot)
+def log_deleted_lesson(sender, instance, **kwargs):
+    changelog.record('delete', [instance])
+
+
+@receiver(pre_save, sender=Timeslot)
+def remember_counted_lesson(sender, instance, **kwargs):
+    # a saved lesson may have moved to another teacher, class or subject
+    instance._counted = None
+    if instance.pk is not None:
+        instance._counted = Timeslot.objects.filter(pk=instance.pk).only('Teacher', 'ClassGroup', 'Subject').first()
+
+
+@receiver(post_save, sender=Timeslot)
+def count_saved_lesson(sender, instance, **kwargs):
+    old = getattr(instance, '_counted', None)
+    if old is not None:
+        if (old.Teacher_id, old.ClassGroup_id, old.Subject_id) == \
+                (instance.Teacher_id, instance.ClassGroup_id, instance.Subject_id):
+            return
+        counters.lessonsRemoved([old])
+    counters.lessonsAdded([instance])
+
+
+@receiver(post_delete, sender=Timeslot)
+def count_deleted_lesson(sender, instance, **kwargs):
+    counters.lessonsRemoved([instance])
+
+
+@receiver([post_save, post_delete], sender=Teacher)
+@receiver([post_save, post_delete], sender=Room)
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=ClassGroup)
+@receiver([post_save, post_delete], sender=YearGroup)
+def bump_reference_version(sender, instance, **kwargs):
+    versions.referenceChanged()
+
+
+@receiver(m2m_changed, sender=Teacher.Room.through)
+@receiver(m2m_changed, sender=Teacher.SubjectTeach.through)
+@receiver(m2m_changed, sender=YearGroup.classes.through)
+@receiver(m2m_changed, sender=ClassGroup.Subjects.through)
+@receiver(m2m_changed, sender=SubjectGroup.subjects.through)
+def bump_relation_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        versions.referenceChanged()
+
+
+@receiver([post_save, post_delete])
+def invalidate_reference(sender, **kwargs):
+    if sender in reference.DEPENDS:
+        reference.invalidate(reference.DEPENDS[sender])
+
+
+@receiver(m2m_changed)
+def invalidate_reference_relation(sender, action, **kwargs):
+    if sender in reference.DEPENDS and action in ('post_add', 'post_remove', 'post_clear'):
+        reference.invalidate(reference.DEPENDS[sender])
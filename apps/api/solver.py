@@ -0,0 +1,359 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, splitClassCode, BLOCKED_SUBJECTS
+from . import occupancy, versions, counters, changelog
+
+"""
+Automatic timetable generation for a yeargroup.
+
+Every class needs Subject.Count lessons of each subject of its yeargroup.
+A lesson needs a teacher who teaches the subject (Teacher.SubjectTeach) and
+still has hours left (Teacher.LessonsWeekly), and a room with space for the
+class, preferably one for the subject (Room.Description) and preferably one
+of the teacher's rooms. Nobody can be in two places at once.
+
+Maths, English, PE and PSHE run in blocks across a year half: when a class
+has one of them on a timeslot the other classes of the half can only have
+the same subject then, and when a class has any other subject the half
+cannot have a blocked subject then.
+
+The solver is greedy with a most constrained first order: the lesson with
+the fewest timeslots it could still go in is placed next. Who is busy is
+kept as one 30 bit mask per teacher, room and class like the occupancy
+index, so checking a timeslot is a bit operation. Lessons it cannot place
+are reported instead of failing the whole run.
+"""
+
+# Form time is not used for lessons
+TEACHING_UNITS = [unit for unit in occupancy.UNITS if unit != 'Form']
+TEACHING_SLOTS = [(day, unit) for day in occupancy.DAYS for unit in TEACHING_UNITS]
+UNITS_PER_DAY = len(occupancy.UNITS)
+
+
+def yearHalf(classCode:str) -> str:
+    '''The half of the year a class is in, 7B2 -> 7B, 10A1 -> 10A'''
+    year, half = splitClassCode(classCode)
+    return f'{year}{half}'
+
+
+def roomDescriptions(subject:str) -> set:
+    # Computing and ICT rooms are shared between the two subjects
+    if subject in ('ICT', 'Computing'):
+        return {'ICT', 'Computing'}
+    return {subject}
+
+
+def popCount(mask:int) -> int:
+    return bin(mask).count('1')
+
+
+class TimetableSolver:
+    def __init__(self, yearGroup:YearGroup):
+        self.yearGroup = yearGroup
+        self.lessons = []
+        self.unplaced = []
+        self.warnings = []
+        self.slotBits = [(occupancy.slotBit(day, unit), day, unit) for day, unit in TEACHING_SLOTS]
+
+    def load(self):
+        '''Read everything the solver needs in a fixed number of queries.'''
+        self.classes = {classGroup.id: classGroup for classGroup in self.yearGroup.classes.all()}
+        self.subjects = {subject.id: subject for subject in Subject.objects.filter(yearGroup=self.yearGroup)}
+
+        teachers = Teacher.objects.values_list('id', 'LessonsWeekly', 'bookedLessons')
+        self.teacherHours = {id_: weekly - booked for id_, weekly, booked in teachers}
+
+        self.subjectTeachers = defaultdict(list)
+        qualified = Teacher.objects.filter(
+            SubjectTeach__subjects__in=self.subjects.keys()
+        ).values_list('SubjectTeach__subjects', 'id').distinct()
+        for subjectId, teacherId in qualified:
+            self.subjectTeachers[subjectId].append(teacherId)
+
+        self.teacherRooms = defaultdict(set)
+        for teacherId, roomId in Teacher.Room.through.objects.values_list('teacher_id', 'room_id'):
+            self.teacherRooms[teacherId].add(roomId)
+
+        self.rooms = {id_: (number, description, capacity)
+                      for id_, number, description, capacity
+                      in Room.objects.values_list('id', 'RoomNumber', 'Description', 'Capacity')}
+
+        self.masks = {kind: defaultdict(int) for kind in occupancy.KINDS}
+        # per year half, the timeslots holding a blocked subject and the ones holding any other subject
+        self.halfBlocked = defaultdict(dict)
+        self.halfOpen = defaultdict(int)
+        # (class, subject name) -> mask of the timeslots it already has, to spread lessons over the week
+        self.subjectSlots = defaultdict(int)
+        # (class, subject name) -> teachers already teaching it, to keep the same teacher
+        self.classTeachers = defaultdict(set)
+        have = defaultdict(int)
+
+        existing = Timeslot.objects.values_list('period', 'Teacher', 'Room', 'ClassGroup',
+                                                'ClassGroup__classCode', 'Subject__name')
+        for period, teacher, room, classGroup, classCode, subject in existing.iterator():
+            bit = 1 << period
+            self.masks['teacher'][teacher] |= bit
+            self.masks['room'][room] |= bit
+            self.masks['class'][classGroup] |= bit
+            self.markHalf(yearHalf(classCode), subject, bit)
+            if classGroup in self.classes:
+                have[(classGroup, subject)] += 1
+                self.subjectSlots[(classGroup, subject)] |= bit
+                self.classTeachers[(classGroup, subject)].add(teacher)
+
+        # how many lessons of each subject every class still needs
+        self.demand = {}
+        for classGroup in self.classes.values():
+            for subject in self.subjects.values():
+                need = subject.Count - have[(classGroup.id, subject.name)]
+                if need > 0:
+                    self.demand[(classGroup.id, subject.id)] = need
+
+    def markHalf(self, half:str, subject:str, bit:int):
+        if subject in BLOCKED_SUBJECTS:
+            self.halfBlocked[half][bit] = subject
+        else:
+            self.halfOpen[half] |= bit
+
+    def blockedMask(self, half:str) -> int:
+        mask = 0
+        for bit in self.halfBlocked[half]:
+            mask |= bit
+        return mask
+
+    def dayPenalty(self, classId:int, subject:str, bit:int) -> int:
+        '''How many lessons of the subject the class already has on that day.'''
+        index = bit.bit_length() - 1
+        dayMask = ((1 << UNITS_PER_DAY) - 1) << (index - index % UNITS_PER_DAY)
+        return popCount(self.subjectSlots[(classId, subject)] & dayMask)
+
+    def freeTeachers(self, subjectId:int, bit:int) -> list:
+        '''Teachers of the subject free on the timeslot with hours left.'''
+        return [teacher for teacher in self.subjectTeachers[subjectId]
+                if self.teacherHours[teacher] > 0 and not self.masks['teacher'][teacher] & bit]
+
+    def pickTeacher(self, classId:int, subject:Subject, bit:int, taken=()):
+        teachers = [teacher for teacher in self.freeTeachers(subject.id, bit) if teacher not in taken]
+        if not teachers:
+            return None
+        usual = self.classTeachers[(classId, subject.name)]
+        return max(teachers, key=lambda teacher: (teacher in usual, self.teacherHours[teacher], -teacher))
+
+    def pickRoom(self, classId:int, subject:Subject, teacher:int, bit:int, taken=()):
+        """Find a free room with space for the class. The teacher's rooms for
+        the subject come first, then any room for the subject, then any room.
+
+        Returns:
+            tuple: (room id, True if the room is not one for the subject) or None
+        """
+        pupils = self.classes[classId].NumOfPupils
+        descriptions = roomDescriptions(subject.name)
+        subjectRooms = [id_ for id_, (_, description, _) in self.rooms.items() if description in descriptions]
+        free = [id_ for id_, (_, _, capacity) in self.rooms.items()
+                if capacity >= pupils and not self.masks['room'][id_] & bit and id_ not in taken]
+        if not free:
+            return None
+        matching = [id_ for id_ in free if self.rooms[id_][1] in descriptions]
+        own = self.teacherRooms[teacher]
+        # smallest room that fits so big rooms stay free for big classes
+        bySize = lambda id_: (id_ not in own, self.rooms[id_][2], id_)
+        if matching:
+            return min(matching, key=bySize), False
+        return min(free, key=bySize), bool(subjectRooms)
+
+    def place(self, classId:int, subject:Subject, teacher:int, room:int, bit:int, day:str, unit:str, wrongRoom:bool):
+        classCode = self.classes[classId].classCode
+        self.masks['teacher'][teacher] |= bit
+        self.masks['room'][room] |= bit
+        self.masks['class'][classId] |= bit
+        self.teacherHours[teacher] -= 1
+        self.subjectSlots[(classId, subject.name)] |= bit
+        self.classTeachers[(classId, subject.name)].add(teacher)
+        self.markHalf(yearHalf(classCode), subject.name, bit)
+        self.demand[(classId, subject.id)] -= 1
+        if self.demand[(classId, subject.id)] == 0:
+            del self.demand[(classId, subject.id)]
+        self.lessons.append(Timeslot(Day=day, Unit=unit, Teacher_id=teacher, Room_id=room,
+                                     Subject_id=subject.id, ClassGroup_id=classId))
+        if wrongRoom:
+            self.warnings.append({
+                'class': classCode, 'subject': subject.name, 'day': day, 'unit': unit,
+                'constraint': f'No free {subject.name} room, put in {self.rooms[room][0]}',
+            })
+
+    def unplace(self, classId:int, subject:Subject):
+        """Give up on the rest of a class's lessons for a subject and say why."""
+        missing = self.demand.pop((classId, subject.id))
+        pupils = self.classes[classId].NumOfPupils
+        teachers = self.subjectTeachers[subject.id]
+        if not teachers:
+            reason = 'No teacher teaches this subject'
+        elif all(self.teacherHours[teacher] <= 0 for teacher in teachers):
+            reason = 'All teachers of this subject have no hours left'
+        elif not any(capacity >= pupils for _, _, capacity in self.rooms.values()):
+            reason = 'No room is big enough for the class'
+        else:
+            reason = 'No timeslot where the class, a teacher and a room are all free'
+        self.unplaced.append({'class': self.classes[classId].classCode, 'subject': subject.name,
+                              'missing': missing, 'constraint': reason})
+
+    def solveBlocked(self):
+        '''Blocked subjects are placed first, the whole half at once.'''
+        halves = defaultdict(list)
+        for classId, classGroup in sorted(self.classes.items(), key=lambda item: item[1].classCode):
+            halves[yearHalf(classGroup.classCode)].append(classId)
+
+        blocked = [subject for subject in self.subjects.values() if subject.name in BLOCKED_SUBJECTS]
+        blocked.sort(key=lambda subject: -subject.Count)
+        for half, classIds in sorted(halves.items()):
+            for subject in blocked:
+                while True:
+                    needing = [classId for classId in classIds if (classId, subject.id) in self.demand]
+                    if not needing:
+                        break
+                    best = None
+                    for bit, day, unit in self.slotBits:
+                        if self.halfOpen[half] & bit or self.halfBlocked[half].get(bit, subject.name) != subject.name:
+                            continue
+                        assignment = self.assignBlock(needing, subject, bit)
+                        penalty = sum(self.dayPenalty(classId, subject.name, bit) for classId, _, _, _ in assignment)
+                        wrongRooms = sum(wrongRoom for _, _, _, wrongRoom in assignment)
+                        score = (len(assignment), -wrongRooms, -penalty)
+                        if assignment and (best is None or score > best[0]):
+                            best = (score, bit, day, unit, assignment)
+                    if best is None:
+                        for classId in needing:
+                            self.unplace(classId, subject)
+                        break
+                    _, bit, day, unit, assignment = best
+                    for classId, teacher, room, wrongRoom in assignment:
+                        self.place(classId, subject, teacher, room, bit, day, unit, wrongRoom)
+
+    def assignBlock(self, classIds:list, subject:Subject, bit:int) -> list:
+        '''Give every free class a different teacher and room on the timeslot.'''
+        assignment = []
+        teachersTaken, roomsTaken = set(), set()
+        for classId in classIds:
+            if self.masks['class'][classId] & bit:
+                continue
+            teacher = self.pickTeacher(classId, subject, bit, teachersTaken)
+            if teacher is None:
+                continue
+            room = self.pickRoom(classId, subject, teacher, bit, roomsTaken)
+            if room is None:
+                continue
+            teachersTaken.add(teacher)
+            roomsTaken.add(room[0])
+            assignment.append((classId, teacher, room[0], room[1]))
+        return assignment
+
+    def feasibleMask(self, classId:int, subject:Subject, cache:dict) -> int:
+        '''Timeslots where the class, a teacher of the subject and a big enough room are all free.'''
+        half = yearHalf(self.classes[classId].classCode)
+        mask = ~self.masks['class'][classId] & ~self.blockedMask(half)
+
+        key = ('teacher', subject.id)
+        if key not in cache:
+            teacherMask = 0
+            for teacher in self.subjectTeachers[subject.id]:
+                if self.teacherHours[teacher] > 0:
+                    teacherMask |= ~self.masks['teacher'][teacher]
+            cache[key] = teacherMask
+        pupils = self.classes[classId].NumOfPupils
+        key = ('room', pupils)
+        if key not in cache:
+            roomMask = 0
+            for id_, (_, _, capacity) in self.rooms.items():
+                if capacity >= pupils:
+                    roomMask |= ~self.masks['room'][id_]
+            cache[key] = roomMask
+        return mask & cache[('teacher', subject.id)] & cache[key] & self.allSlots
+
+    def solveOpen(self):
+        '''Place the rest of the lessons, most constrained first.'''
+        self.allSlots = 0
+        for bit, _, _ in self.slotBits:
+            self.allSlots |= bit
+        while self.demand:
+            cache = {}
+            choice = None
+            for (classId, subjectId), need in self.demand.items():
+                subject = self.subjects[subjectId]
+                mask = self.feasibleMask(classId, subject, cache)
+                options = popCount(mask)
+                key = (options, -need, self.classes[classId].classCode, subject.name)
+                if choice is None or key < choice[0]:
+                    choice = (key, classId, subject, mask)
+                if options == 0:
+                    break
+            _, classId, subject, mask = choice
+            if not mask:
+                self.unplace(classId, subject)
+                continue
+
+            best = None
+            for bit, day, unit in self.slotBits:
+                if not mask & bit:
+                    continue
+                teacher = self.pickTeacher(classId, subject, bit)
+                room = self.pickRoom(classId, subject, teacher, bit) if teacher is not None else None
+                if room is None:
+                    continue
+                usual = teacher in self.classTeachers[(classId, subject.name)]
+                dayLoad = self.dayPenalty(classId, subject.name, bit)
+                score = (dayLoad, room[1], not usual)
+                if best is None or score < best[0]:
+                    best = (score, bit, day, unit, teacher, room)
+            if best is None:
+                self.unplace(classId, subject)
+                continue
+            _, bit, day, unit, teacher, room = best
+            self.place(classId, subject, teacher, room[0], bit, day, unit, room[1])
+
+    def solve(self):
+        self.load()
+        self.solveBlocked()
+        self.solveOpen()
+        return self
+
+    def save(self):
+        '''Write the new lessons in one transaction.'''
+        with transaction.atomic():
+            Timeslot.objects.bulk_create(self.lessons, batch_size=500)
+            counters.lessonsAdded(self.lessons)
+            changelog.record('create', self.lessons)
+            # bulk_create sends no signals, the version also has the occupancy index rebuilt
+            versions.lessonsChanged({lesson.ClassGroup_id for lesson in self.lessons})
+
+    def report(self) -> dict:
+        return {
+            'yearGroup': self.yearGroup.name,
+            'created': len(self.lessons),
+            'unplaced': self.unplaced,
+            'warnings': self.warnings,
+        }
+
+
+def generateTimetable(yearGroup:YearGroup, replace:bool=False, dryRun:bool=False) -> dict:
+    """Fill the week of every class in a yeargroup.
+
+    Args:
+        yearGroup (YearGroup): the yeargroup to fill
+        replace (bool): delete the lessons the classes already have first
+        dryRun (bool): work out the timetable without saving it
+
+    Returns:
+        dict: how many lessons were created and which could not be placed
+    """
+    with transaction.atomic():
+        if replace:
+            with counters.collect(), changelog.collect(), versions.collect():
+                Timeslot.objects.filter(ClassGroup__in=yearGroup.classes.all()).delete()
+        solver = TimetableSolver(yearGroup).solve()
+        if not dryRun:
+            solver.save()
+        else:
+            transaction.set_rollback(True)
+    return solver.report()
@@ -0,0 +1,149 @@
+import asyncio
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import orjson
+from asgiref.sync import sync_to_async
+from corsheaders.middleware import CorsMiddleware
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from rest_framework import exceptions
+
+from apps.users.auth import CachedTokenAuthentication
+from apps.users import tickets
+from .broadcast import broadcaster
+from . import changelog
+
+"""
+GET /api/timeslots/stream/?ticket=<stream ticket>&year=7&teacher=Mrs Jones&room=S4
+Server-sent events of the timetable's changes as they are committed, so
+the frontend can stop polling /api/overview/ and /api/year/<n>/. Every
+filter is optional, a lesson moving out of them is sent as a delete. Each
+event is one change of /api/timeslots/changes/:
+    id: <cursor>
+    event: create | update | delete | resync
+    data: {"op": ..., "id": ..., "timeslot": {...}, "cursor": ...}
+A client reconnecting sends its cursor as ?since= or Last-Event-ID and is
+sent what it missed first. A ticket opens one stream, so the browser's own
+reconnect is refused and the client opens a new EventSource with a new
+ticket. resync means it fell too far behind and has to download the
+timetable again.
+
+This is a plain ASGI app which config/asgi.py puts in front of Django, a
+Django 3.2 view can not stream without holding a thread per client. It
+skips Django's middleware so the CORS headers CorsMiddleware would add are
+added here. EventSource can not set the Authorization header, so instead
+of the knox token, which would end up in the access logs, the query has a
+single use ticket from POST /api/auth/streamticket (apps/users/tickets.py).
+"""
+
+PATH = '/api/timeslots/stream/'
+# a comment line is sent when nothing happened for this long so proxies keep the connection
+KEEPALIVE_SECONDS = 15
+
+
+def authenticate(headers:dict, params:dict):
+    '''The user of the token in the Authorization header or of ?ticket=, None if it is not valid.'''
+    header = headers.get(b'authorization', b'').decode().split()
+    if len(header) == 2 and header[0] == 'Token':
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(header[1].encode())
+        except exceptions.AuthenticationFailed:
+            return None
+        return user
+    if params.get('ticket'):
+        return tickets.redeem(params['ticket'])
+    return None
+
+
+def corsHeaders(scope) -> tuple:
+    """Run CorsMiddleware on the request as Django would.
+
+    Returns:
+        tuple: (True for a preflight request, the headers it adds)
+    """
+    request = ASGIRequest(scope, BytesIO())
+    middleware = CorsMiddleware(lambda request: None)
+    preflight = middleware.process_request(request)
+    response = middleware.process_response(request, preflight or HttpResponse())
+    headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.items()
+               if name.lower().startswith('access-control-') or name == 'Vary']
+    return preflight is not None, headers
+
+
+def event(change:dict) -> bytes:
+    lines = f"id: {change['cursor']}\nevent: {change['op']}\n" if 'cursor' in change else f"event: {change['op']}\n"
+    return lines.encode() + b'data: ' + orjson.dumps(change) + b'\n\n'
+
+
+async def respond(send, status:int, body:dict, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': orjson.dumps(body)})
+
+
+async def timeslotStream(scope, receive, send):
+    '''The ASGI app, see the module docstring.'''
+    params = {name: values[-1] for name, values in parse_qs(scope['query_string'].decode()).items()}
+    headers = dict(scope['headers'])
+    preflight, cors = corsHeaders(scope)
+    if preflight:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-length', b'0'), *cors]})
+        return await send({'type': 'http.response.body', 'body': b''})
+    if scope['method'] != 'GET':
+        return await respond(send, 405, {'msg': 'Only GET is allowed'}, cors)
+    if await sync_to_async(authenticate)(headers, params) is None:
+        return await respond(send, 401, {'detail': 'Invalid token or ticket.'}, cors)
+    since = params.get('since') or headers.get(b'last-event-id', b'').decode()
+    if not params.get('year', '0').isdigit() or not (since or '0').isdigit():
+        return await respond(send, 400, {'msg': 'year and since must be numbers',
+                                         'PreferredFormat': PATH + '?ticket=...&year=7'}, cors)
+
+    # the request has no body but it is read so the next message is the disconnect
+    message = await receive()
+    while message['type'] == 'http.request' and message.get('more_body'):
+        message = await receive()
+    if message['type'] == 'http.disconnect':
+        return
+
+    # listen before catching up so nothing committed in between is lost, it may come twice
+    subscriber = broadcaster.subscriber({name: params.get(name) for name in ('year', 'teacher', 'room')})
+    await sync_to_async(broadcaster.add)(subscriber)
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx would hold the events back otherwise
+            (b'x-accel-buffering', b'no'),
+            *cors,
+        ]})
+        if since:
+            feed = await sync_to_async(changelog.feed)(int(since), changelog.MAX_PAGE_SIZE)
+            missed = [{'op': 'resync', 'cursor': feed['cursor']}] if feed['resync'] or feed['more'] else \
+                [seen for seen in map(subscriber.view, feed['changes']) if seen is not None]
+            for change in missed:
+                change.setdefault('cursor', feed['cursor'])
+                await send({'type': 'http.response.body', 'body': event(change), 'more_body': True})
+
+        while True:
+            waiting = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({waiting, disconnected}, timeout=KEEPALIVE_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                waiting.cancel()
+                return
+            if waiting not in done:
+                waiting.cancel()
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            change = waiting.result()
+            if subscriber.overflowed:
+                change = {'op': 'resync'}
+            await send({'type': 'http.response.body', 'body': event(change), 'more_body': True})
+            if change['op'] == 'resync':
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        disconnected.cancel()
@@ -0,0 +1,84 @@
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Timeslot, Subject, LessonCount, splitClassCode, BLOCKED_SUBJECTS
+from .serializers import SubjectSerializer
+
+"""
+Which subject to put in a class's empty timeslot, for SubjectRoutes.retrieve.
+Two queries whatever the size of the yeargroup: the subjects the year half
+already has on the timeslot, then the yeargroup's subjects with how many
+lessons of each the class has from the counters (counters.py).
+"""
+
+
+def halfSubjects(day:str, unit:str, classCode:str) -> set:
+    """Names of the subjects the class's half of the year has on a timeslot:
+    SELECT DISTINCT Subject.name FROM Timeslot ... WHERE period = (day, unit)
+    AND ClassGroup.year = 7 AND ClassGroup.half = 'A'
+
+    Args:
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+        classCode (str): the class, its year and half e.g 7A come from the code
+
+    Returns:
+        set: subject names
+    """
+    year, half = splitClassCode(classCode)
+    return set(Timeslot.objects.at(day, unit).filter(
+        ClassGroup__year=year, ClassGroup__half=half,
+    ).values_list('Subject__name', flat=True).distinct())
+
+
+def subjectsWithLessons(year:int, classCode:str) -> 'QuerySet[Subject]':
+    """The yeargroup's subjects with how many lessons the class has of each
+    from the counters, as have. Subjects are matched by name, lessons the
+    class has of any subject with the name are counted.
+
+    Args:
+        year (int): the yeargroup e.g 7
+        classCode (str): the class the lessons are counted for
+
+    Returns:
+        QuerySet: subjects annotated with have, in id order
+    """
+    lessonsHave = LessonCount.objects.filter(
+        ClassGroup__classCode=classCode, Subject__name=OuterRef('name'),
+    ).values('Subject__name').annotate(have=Sum('lessons')).values('have')
+    return Subject.objects.filter(yearGroup__name=f'Yr{year}').select_related('yearGroup').annotate(
+        have=Coalesce(Subquery(lessonsHave, output_field=IntegerField()), Value(0)),
+    ).order_by('id')
+
+
+def suggestSubjects(year:int, day:str, unit:str, classCode:str):
+    """Suggest the subjects for a class on a timeslot.
+        - if the half already has a blocked subject on it the class must have the same one
+        - otherwise the subjects the class is missing lessons of, most missing first,
+          without blocked subjects if the half already has other lessons then
+
+    Args:
+        year (int): the yeargroup e.g 7
+        day (str): the week day on the timetable
+        unit (str): the unit of the day e.g Unit3
+        classCode (str): the class to suggest subjects for
+
+    Returns:
+        dict|list: the blocked subject or the list of subjects, serialized
+    """
+    taken = halfSubjects(day, unit, classCode)
+    blocked = next((name for name in BLOCKED_SUBJECTS if name in taken), None)
+    if blocked is not None:
+        subjects = Subject.objects.filter(yearGroup__name=f'Yr{year}').select_related('yearGroup')
+        return SubjectSerializer(subjects.get(name=blocked)).data
+
+    subjects = subjectsWithLessons(year, classCode)
+
+    # subjects with exactly the right number are left out, ones with too many are kept at the end
+    missing = [subject for subject in subjects if subject.Count - subject.have != 0]
+    # the half already has a lesson which is not blocked so blocked subjects can not go here
+    if taken:
+        missing = [subject for subject in missing if subject.name not in BLOCKED_SUBJECTS]
+    # stable so subjects missing the same amount keep their order
+    missing.sort(key=lambda subject: subject.Count - subject.have, reverse=True)
+    return SubjectSerializer(missing, many=True).data
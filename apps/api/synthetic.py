@@ -0,0 +1,100 @@
+import math
+import random
+
+from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup, SubjectGroup, BLOCKED_SUBJECTS
+from .solver import generateTimetable
+from . import counters, changelog, versions
+
+"""
+Make up a whole school to test and benchmark against: yeargroups split
+into two halves of classes, subjects with their lessons per week, rooms
+for each subject, and enough teachers (with some spare) for every class
+to get all its lessons. The timetable can be left empty or partly filled
+by running the solver and removing some of what it placed.
+"""
+
+# lessons a week of each subject, 22 in total
+LESSONS = {'Maths': 4, 'English': 4, 'PE': 2, 'PSHE': 1, 'Science': 3, 'Art': 1,
+           'Music': 1, 'Hums': 2, 'MFL': 2, 'Computing': 1, 'Food': 1}
+# rooms for each Room.Description, None is a plain classroom
+ROOMS = {'Maths': 10, 'English': 10, 'PE': 6, 'Science': 10, 'Art': 4, 'Music': 3,
+         'Hums': 8, 'MFL': 6, 'Computing': 5, 'ICT': 3, 'Food': 3, None: 12}
+
+
+def createSchool(years=(7, 8, 9), classesPerHalf=6, seed=1, lessons=None,
+                 roomScale=1.0, spareTeachers=0.2, teacherHours=22, fill=0.0) -> dict:
+    """Create a school with subject rooms and teachers for every lesson.
+
+    Args:
+        years (tuple): yeargroup numbers
+        classesPerHalf (int): how many classes each half of a year has
+        seed (int): seed for the class and room sizes and which lessons are kept
+        lessons (dict): lessons a week of each subject, defaults to LESSONS
+        roomScale (float): multiply the number of rooms of each kind
+        spareTeachers (float): fraction of teachers on top of the ones needed
+        teacherHours (int): LessonsWeekly of every teacher
+        fill (float): fraction of the timetable to fill in, 0 leaves it empty
+
+    Returns:
+        dict: how many of each thing was created
+    """
+    rnd = random.Random(seed)
+    lessons = lessons or LESSONS
+
+    descriptions = [description for description, count in ROOMS.items()
+                    for _ in range(max(1, round(count * roomScale)))]
+    Room.objects.bulk_create([
+        Room(RoomNumber=str(number), Description=description,
+             Capacity=rnd.choice([28, 30, 32]), RoomType='ClassRoom')
+        for number, description in enumerate(descriptions, start=1)
+    ])
+    roomsFor = {}
+    for room in Room.objects.order_by('id'):
+        roomsFor.setdefault(room.Description, []).append(room)
+
+    groups = {name: SubjectGroup.objects.create(name=name) for name in lessons}
+    yearGroups = []
+    for year in years:
+        yearGroup = YearGroup.objects.create(name=f'Yr{year}')
+        yearGroups.append(yearGroup)
+        for name, count in lessons.items():
+            groups[name].subjects.add(Subject.objects.create(name=name, yearGroup=yearGroup, Count=count))
+        for half in 'AB':
+            for number in range(classesPerHalf):
+                yearGroup.classes.add(ClassGroup.objects.create(
+                    classCode=f'{year}{half}{number}', NumOfPupils=rnd.randint(22, 28)))
+
+    teacherCount = 0
+    for name, count in lessons.items():
+        needed = count * len(years) * 2 * classesPerHalf
+        teachers = math.ceil(needed / (teacherHours - 2) * (1 + spareTeachers))
+        if name in BLOCKED_SUBJECTS:
+            # blocked subjects are taught to a whole half at once, let two halves run together
+            teachers = max(teachers, 2 * classesPerHalf)
+        # teachers have one of the subject's rooms as their own, shared round the department
+        ownRooms = roomsFor.get(name) or []
+        for number in range(teachers):
+            teacher = Teacher.objects.create(name=f'{name} {number}', LessonsWeekly=teacherHours)
+            teacher.SubjectTeach.add(groups[name])
+            if ownRooms:
+                teacher.Room.add(ownRooms[number % len(ownRooms)])
+        teacherCount += teachers
+
+    if fill > 0:
+        for yearGroup in yearGroups:
+            generateTimetable(yearGroup)
+        placed = list(Timeslot.objects.values_list('id', flat=True))
+        removed = rnd.sample(placed, len(placed) - round(len(placed) * fill))
+        # in chunks to stay under the SQLite limit on query parameters
+        with counters.collect(), changelog.collect(), versions.collect():
+            for start in range(0, len(removed), 500):
+                Timeslot.objects.filter(id__in=removed[start:start + 500]).delete()
+
+    return {
+        'yearGroups': len(years),
+        'classes': len(years) * 2 * classesPerHalf,
+        'subjects': len(years) * len(lessons),
+        'teachers': teacherCount,
+        'rooms': len(descriptions),
+        'timeslots': Timeslot.objects.count(),
+    }
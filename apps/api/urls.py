@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path,include
 from rest_framework.routers import DefaultRouter
-from .views import TeacherRoutes, ClassRoutes, SubjectRoutes, TimeslotRoutes, RoomRoutes, OverviewRoute
+from .views import TeacherRoutes, ClassRoutes, SubjectRoutes, TimeslotRoutes, RoomRoutes, OverviewRoute, MetricsRoutes, ExportRoutes
+from .views import streamNeedsAsgi
 
 router = DefaultRouter() 
 
@@ -10,7 +12,18 @@ router.register("subjects",SubjectRoutes, basename="subjects")
 router.register("timeslots",TimeslotRoutes, basename="timeslots")
 router.register("rooms",RoomRoutes, basename="rooms")
 router.register("overview", OverviewRoute, basename="overview")
+router.register("metrics", MetricsRoutes, basename="metrics")
+router.register("export", ExportRoutes, basename="export")
 
 urlpatterns = [
+    # served by config/asgi.py, before the router so it is not a timeslot retrieve
+    path("api/timeslots/stream/", streamNeedsAsgi, name="timeslots-stream"),
     path("api/",include(router.urls)),
-]
\ No newline at end of file
+]
+if settings.ASYNC_VIEWS:
+    from .asyncviews import overview, rooms
+    # in front of the router, with the names of the viewset routes they stand in for
+    urlpatterns = [
+        path("api/overview/", overview, name="overview-list"),
+        path("api/rooms/", rooms, name="rooms-list"),
+    ] + urlpatterns
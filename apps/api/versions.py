@@ -0,0 +1,126 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from .models import TimetableVersion, YearGroup
+
+"""
+Version numbers of the timetable, stored in the database so every server
+process agrees on them. They are used as the ETag of the read routes so
+a client sending If-None-Match gets a 304 before the view does any work.
+    global: bumped by every change, for routes which show the whole school
+    shared: bumped when teachers, rooms, subjects, classes or yeargroups
+            change, as every yeargroup's timetable shows them
+    Yr7 etc: bumped when a lesson of one of the yeargroup's classes changes
+    lessons: bumped when any lesson changes, for the occupancy index
+    changelog: bumped before each write to the change log, the UPDATE's row
+            lock puts the writers in commit order (changelog.py)
+The bump is an UPDATE inside the transaction making the change, so a
+rolled back change does not move the version.
+lessonsVersion reads the lessons version once per request, the signals in
+signals.py mark where a request starts and ends on its thread.
+The lessons of a bulk delete are gathered inside collect() and bumped once
+at the end instead of once per deleted lesson.
+"""
+
+GLOBAL = 'global'
+SHARED = 'shared'
+CHANGELOG = 'changelog'
+LESSONS = 'lessons'
+
+# the lessons version read by the request running on the thread
+local = threading.local()
+
+
+def requestStarted(**kwargs):
+    local.inRequest, local.lessons = True, None
+
+
+def requestFinished(**kwargs):
+    local.inRequest, local.lessons = False, None
+
+
+def lessonsVersion() -> str:
+    '''The lessons version, read once per request and on every call outside one.'''
+    if not getattr(local, 'inRequest', False):
+        return current(LESSONS)
+    if local.lessons is None:
+        local.lessons = current(LESSONS)
+    return local.lessons
+
+
+def bump(*keys:str):
+    '''Add one to the versions, creating the ones which do not exist yet.'''
+    keys = set(keys)
+    # the request reads the versions it moved again
+    local.lessons = None
+    updated = TimetableVersion.objects.filter(key__in=keys).update(version=F('version') + 1)
+    if updated < len(keys):
+        existing = set(TimetableVersion.objects.filter(key__in=keys).values_list('key', flat=True))
+        TimetableVersion.objects.bulk_create([TimetableVersion(key=key, version=1) for key in keys - existing],
+                                             ignore_conflicts=True)
+
+
+def referenceChanged():
+    '''Something every yeargroup shows changed e.g a teacher was renamed.'''
+    bump(GLOBAL, SHARED)
+
+
+@contextmanager
+def collect():
+    '''Gather the lesson changes made inside and bump their versions once at the end.'''
+    if getattr(local, 'pending', None) is not None:
+        # already collecting, the outer one bumps them
+        yield
+        return
+    local.pending = pending = []
+    try:
+        yield
+    finally:
+        local.pending = None
+    if pending:
+        lessonsChanged(set().union(*pending))
+
+
+def lessonsChanged(classIds):
+    """Lessons of some classes were created, changed or deleted.
+
+    Args:
+        classIds (iterable): ids of the classes whose lessons changed
+    """
+    if getattr(local, 'pending', None) is not None:
+        local.pending.append(set(classIds))
+        return
+    years = YearGroup.classes.through.objects.filter(
+        classgroup_id__in=set(classIds)).values_list('yeargroup__name', flat=True)
+    bump(GLOBAL, LESSONS, *years)
+
+
+def current(*keys:str) -> str:
+    """The versions joined into one string, 0 for one never bumped.
+
+    Returns:
+        str: e.g 4.2.7 for current('global', 'shared', 'Yr7')
+    """
+    versions = dict(TimetableVersion.objects.filter(key__in=keys).values_list('key', 'version'))
+    return '.'.join(str(versions.get(key, 0)) for key in keys)
+
+
+def tag(request, *keys:str) -> str:
+    '''The ETag of the versions for a DRF request, the renderer is part of it
+    as the browsable api is different HTML.'''
+    renderer = getattr(getattr(request, 'accepted_renderer', None), 'format', '')
+    return f'{renderer}-{current(*keys)}'
+
+
+def etag(*keys):
+    """Decorator for a viewset route to send the versions as the ETag and
+    answer 304 Not Modified when the client already has them. Each key
+    is a string or a function of the route's kwargs e.g the year from pk.
+    """
+    def versionTag(request, *args, **kwargs):
+        return tag(request, *(key(**kwargs) if callable(key) else key for key in keys))
+    return method_decorator(condition(etag_func=versionTag))
@@ -1,61 +1,47 @@
 from rest_framework.response import Response
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from django.db.models.query import QuerySet
-from django.http import  HttpRequest
-from django.db.models import Q, Case, When
+from django.http import  HttpRequest, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.db import transaction, IntegrityError
+from django.conf import settings
+from django.utils import timezone
+import datetime
 
 from .serializers import *
 from .models import Teacher, Timeslot, YearGroup, Room, Subject, ClassGroup
+from .availability import freeTeachers, splitBySubject, freeRooms, weekAvailability
+from .availability import freeComputerRooms, freeSubjectTeachers, teacherHours
+from .solver import generateTimetable
+from .batch import TimeslotBatch
+from .suggestions import suggestSubjects
+from .pagination import sparseList, wantsPage
+from . import middleware, versions, reference, export, changelog, occupancy, counters
         
 
 
 class SharedMethods:
     @staticmethod
-    def ExtractValuesById(DataCollection):
+    def ExtractTimeslotValues(queryset, many=True):
         '''Without SlugRelatedFields on Serializer IDs are returned in
         ForeignKey field.
         This makes it hard for POST Routes and so...
-        To make it more readable this method takes these 
-        IDs makes a query and gets the name/title of the Field. 
+        To make it more readable this method joins the related tables in
+        the same query and returns the name/title of each Field.
 
         Args:
-            DataCollection (OrderedDict): serialized data from db
+            queryset (QuerySet|Timeslot): timeslots to format
+            many (bool): False when formatting a single timeslot
 
         Returns:
-            dict: returns a formatted response object
+            list|dict: formatted response object(s)
         '''
-        TeacherVal = Teacher.objects.get(id=DataCollection['Teacher']).name
-        RoomVal = Room.objects.get(id=DataCollection['Room']).RoomNumber
-        SubjectVal = Subject.objects.get(id=DataCollection['Subject']).name
-        ClassGroupVal = ClassGroup.objects.get(id=DataCollection['ClassGroup']).classCode
-        data = {
-                'id': DataCollection['id'],
-                'Day': DataCollection['Day'],
-                'Unit': DataCollection['Unit'],
-                'Teacher': TeacherVal,
-                'Room': RoomVal,
-                'Subject': SubjectVal,
-                'ClassGroup': ClassGroupVal
-            }
-        return data
-
-    @staticmethod
-    def convertQuerySetToIds(query):
-        """Convert a set of entities returned from db
-        to a list of ids for easier comparison.
-
-        Args:
-            query (QuerySet): result from db query
+        if many:
+            queryset = queryset.select_related('Teacher','Room','Subject','ClassGroup')
+        return TimeslotDisplaySerializer(queryset, many=many).data
 
-        Returns:
-            list: ids of entities in the queryset
-        """
-        if len(query) == 0:
-            return []
-        else:
-            return [query[0].id] + SharedMethods.convertQuerySetToIds(query[1:])
 
 
   
@@ -67,17 +53,20 @@ class SharedMethods:
 class TimeslotRoutes(viewsets.ViewSet,SharedMethods):
     permission_classes = [IsAuthenticated]
 
+    @versions.etag(versions.GLOBAL)
     def list(self, request:HttpRequest) -> 'QuerySet[Timeslot]':
         '''Performs a SELECT * getting all the timeslots which
         exist in the database.
 
+        Query Params (optional, see pagination.py):
+            - fields: e.g Day,Unit,Teacher only sends and selects those
+            - page_size / cursor: a page of the timeslots by id
+
         Returns:
             QuerySet: A list of all the rows returned from database
         '''
-        queryset = Timeslot.objects.all()
-        serializer = TimeslotSerializer(queryset,many=True)
-        res = [self.ExtractValuesById(data) for data in serializer.data]
-        return Response(res)
+        return sparseList(request, self, Timeslot.objects.all(), TimeslotDisplaySerializer,
+                          prepare=lambda queryset: queryset.select_related('Teacher','Room','Subject','ClassGroup'))
 
     def create(self,request:HttpRequest) -> 'Response':
         '''POST Route to create an entry in the Timeslots table
@@ -89,22 +78,27 @@ class TimeslotRoutes(viewsets.ViewSet,SharedMethods):
         Returns:
             Response: return the created entry or any errors
         '''
-        yearGroup = 'Yr'+request.data['ClassGroup'][0]
+        classGroup = ClassGroup.objects.get(classCode=request.data['ClassGroup'])
         # Convert Passed in Strings to Ids 
         RequestData = {
             'Day': request.data['Day'],
             'Unit': request.data['Unit'],
             'Teacher' : Teacher.objects.get(name=request.data['Teacher']).id,
             'Room': Room.objects.get(RoomNumber=request.data['Room']).id,
-            'Subject': Subject.objects.get(name=request.data['Subject'], yearGroup__name=yearGroup).id,
-            'ClassGroup': ClassGroup.objects.get(classCode=request.data['ClassGroup']).id,
+            'Subject': Subject.objects.get(name=request.data['Subject'], yearGroup__name=f'Yr{classGroup.year}').id,
+            'ClassGroup': classGroup.id,
         }
         if not request.user.is_staff:
             return Response({'msg':'UNAUTHORISED'})
 
         serializer = TimeslotSerializer(data=RequestData)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                return Response({'msg':'The teacher, room or class is already booked on this timeslot'},
+                                status=status.HTTP_400_BAD_REQUEST)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -124,15 +118,72 @@ class TimeslotRoutes(viewsets.ViewSet,SharedMethods):
             unit = request.query_params.get('unit')
             day = request.query_params.get('day')
             unitName = f'Unit{unit}'
-            queryset = get_object_or_404(Timeslot, ClassGroup__classCode=pk, Day=day, Unit=unitName)
-            serializer = TimeslotSerializer(queryset)
-            data = self.ExtractValuesById(serializer.data)
+            timeslots = Timeslot.objects.select_related('Teacher','Room','Subject','ClassGroup')
+            queryset = get_object_or_404(timeslots.at(day, unitName), ClassGroup__classCode=pk)
+            data = self.ExtractTimeslotValues(queryset, many=False)
             return Response(data)
         else:
             return Response({'msg':'Missing Parameters for Day and Unit',
                              'PreferredFormat':'/api/timeslots/7B2/?unit=2&day=Mon'
                             },status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request:HttpRequest) -> 'Response':
+        '''POST /api/timeslots/batch/
+        Create, delete, move and swap many timeslots in one transaction.
+        {"operations": [{"op": "create", "Day": "Mon", "Unit": "Unit1", "Teacher": ...,
+                         "Room": ..., "Subject": ..., "ClassGroup": ...},
+                        {"op": "delete", "id": 1},
+                        {"op": "move", "id": 2, "Day": "Tue", "Unit": "Unit3"},
+                        {"op": "swap", "id": 3, "with": 4}]}
+
+        Returns:
+            Response: the result of every operation, nothing is saved if one fails,
+                409 if another request booked the same teacher, room or class meanwhile
+        '''
+        if not request.user.is_staff:
+            return Response({'msg':'UNAUTHORISED'})
+
+        operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+        if not isinstance(operations, list):
+            return Response({'msg':'Expected a list of operations',
+                             'PreferredFormat':{'operations':[{'op':'delete','id':1}]}},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        batch = TimeslotBatch(operations)
+        applied, results = batch.apply()
+        if not applied:
+            # 409 when another request changed the timetable while the batch was written
+            code = status.HTTP_409_CONFLICT if batch.conflict else status.HTTP_400_BAD_REQUEST
+            return Response({'applied': False, 'results': results}, status=code)
+        return Response({'applied': True, 'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False)
+    def changes(self, request:HttpRequest) -> 'Response':
+        '''GET /api/timeslots/changes/?since=41
+        The timeslots created, changed or deleted since the client's cursor,
+        see changelog.py. Without since, or with one older than the kept changes,
+        resync is true and the client downloads the timetable again first.
+
+        Query Params:
+            - since (int): the cursor from the last response
+            - limit (int, optional): how many changes to read, more is true if there are others
+
+        Returns:
+            Response: {'cursor', 'resync', 'more', 'changes': [{'op', 'id', 'timeslot'}]}
+        '''
+        try:
+            since = request.query_params.get('since')
+            since = int(since) if since not in (None, '') else None
+            limit = min(int(request.query_params.get('limit', changelog.PAGE_SIZE)), changelog.MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'msg':'since and limit must be numbers',
+                             'PreferredFormat':'/api/timeslots/changes/?since=41'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'msg':'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changelog.feed(since, limit))
+
     def delete(self, req, pk):
         if not req.user.is_staff:
             return Response({'msg':'UNAUTHORISED'})
@@ -145,6 +196,13 @@ class TimeslotRoutes(viewsets.ViewSet,SharedMethods):
 
 
 
+def streamNeedsAsgi(request:HttpRequest) -> JsonResponse:
+    '''/api/timeslots/stream/ is served by config/asgi.py in front of Django,
+    this only answers when the site runs under WSGI instead.'''
+    return JsonResponse({'msg': 'The timetable stream needs the ASGI server (config.asgi), '
+                                'poll /api/timeslots/changes/ instead'}, status=503)
+
+
 # ============= SUBJECT API ROUTE LOGIC =============
 
 
@@ -153,99 +211,27 @@ class TimeslotRoutes(viewsets.ViewSet,SharedMethods):
 class SubjectRoutes(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
-    @staticmethod
-    def __CheckBlockedSubjects(day:str, unit:str, class_:str)->str:
-        '''Check the yeargroup the user chose, of a class has a blocked subject
-        return it and allow only that to be chosen as they should all have  the 
-        same if it is blocked.
-
-        Args:
-            day (str): Day on which to check block subject
-            unit (str): The unit of the day to check
-            class_ (str): The you are filtering for
-
-        Returns:
-            [str|None]: return the subject of there is one.  
-        '''
-        yearHalf = class_[:2]
-        blockedSubjects = ['Maths','English','PE','PSHE']
-        # get all the subjects of the yeargroup half
-        yearSubjects = Timeslot.objects.filter(Day=day,Unit=unit,ClassGroup__classCode__contains=yearHalf)
-        serializer = TimeslotSerializer(yearSubjects,many=True)
-        # get ids of all subjects
-        subjectIds = {timeslot['Subject'] for timeslot in serializer.data}
-        # check if it should be a blocked/grouped subject
-        for id_ in subjectIds:
-            qs = Subject.objects.get(id=id_)
-            subject = SubjectSerializer(qs).data['name']
-            if subject in blockedSubjects:
-                return subject
-            else: 
-                return None
-
-    @staticmethod
-    def __getCurrentSubjectTotals(class_:str, allSubjects:'QuerySet[Subject]')->dict:
-        """Create a hash map of the totals of subjects the class has currently
-        on their timetable
-
-        Args:
-            class_ (str): ClassCode
-            allSubjects (querySet): a list of all subjects for the yeargroup
-
-        Returns:
-            [dict]: a dictionary holding the subject and amount the class has
-       """
-        currentAmounts = dict()
-        for subject in allSubjects:
-            subjectName = subject['name']
-            amountHave = Timeslot.objects.filter(
-                 ClassGroup__classCode=class_,
-                 Subject__name = subjectName).count()
-            currentAmounts[subjectName] = amountHave
-        return currentAmounts
-
-    @staticmethod
-    def __getMissingSubjectAmounts(currentAmounts:dict, yearGroup:int)->list:
-        """Create a list of id of all the subjects a yeargroup is missing on their 
-        timetable.
-
-        Args:
-            currentAmounts (dict): the number of each lessons they already have on the timetable
-            yearGroup (int): the yeargroup the the class
-
-        Returns:
-            list: a list of ids of all the database entries which match the filter
-        """
-        subjectsMissingWeights = dict()
-        for subject in currentAmounts.keys():
-            queryset = Subject.objects.get(yearGroup__name = f'Yr{yearGroup}',name=subject)
-            subjectData = SubjectSerializer(queryset).data
-            amountMissing =subjectData['Count'] - currentAmounts[subject]
-            if amountMissing != 0:
-                subjectsMissingWeights[queryset.id] = amountMissing
-        
-        # Sort by how much they are missing so the one they are missing most is on top.
-        subjectMissingIds = sorted(subjectsMissingWeights,
-                                    key=lambda k: subjectsMissingWeights[k],
-                                    reverse=True
-                                    )
-        return subjectMissingIds
-
     def list(self , request:HttpRequest) -> 'QuerySet[Subject]':
         '''Get the names of all the unique subjects which exist:
         SELECT DISTINCT name FROM Subjects
 
+        With fields= or page_size / cursor the subjects themselves are sent
+        instead, e.g /api/subjects/?fields=name,yearGroup&page_size=50
+
         Returns:
             [JSON Response]: a set of subjects converted to JSON
         '''
-        qs = Subject.objects.all()
-        data = SubjectSerializer(qs, many=True).data
+        if 'fields' in request.query_params or wantsPage(request):
+            return sparseList(request, self, Subject.objects.all(), SubjectSerializer,
+                              prepare=lambda queryset: queryset.select_related('yearGroup'))
+        data = reference.get('subjects')
         return Response(set([subject['name'] for subject in data]))
     
 
     def retrieve(self, request:HttpRequest, pk:int) -> 'QuerySet[Subject]':
         '''
         GET /api/subjects/7/?day=Mon&unit=5&class=7B2
+        Return the subjects the class is missing lessons of, most missing first.
         Otherwise return any block based subject if the class should have a 
         subject which should run in blocks.
 
@@ -261,51 +247,7 @@ class SubjectRoutes(viewsets.ViewSet):
             return Response({'msg':'Missing Query for Unit, Day and Class',
                              'format':'/api/subjects/7/?day=Mon&unit=5&class=7B2'})
 
-        # Check for group and return the grouped if any
-        blockedSubject = self.__CheckBlockedSubjects(day,f'Unit{unit}',class_)
-        if blockedSubject != None: # if there is a blocked subject
-            queryset = Subject.objects.get(yearGroup__name = f'Yr{pk}',name=blockedSubject)
-            serializer = SubjectSerializer(queryset)
-            return Response(serializer.data)
-       
-        # get all the subjects for a year group
-        queryset = Subject.objects.filter(yearGroup__name = f'Yr{pk}')
-        serializer = SubjectSerializer(queryset, many=True)
-        allSubjects = serializer.data
-        removeBlocked = False
-
-        # Remove blocked subjects if a class already has a non blocked subject
-        if blockedSubject == None:
-            yearHalf = class_[:2]
-            yearSubjects = Timeslot.objects.filter(Day=day,Unit=f'Unit{unit}', ClassGroup__classCode__contains=yearHalf)
-            classSubjectData = TimeslotSerializer(yearSubjects,many=True).data
-            blockedSubjects = ['Maths','English','PE','PSHE']
-            subjectNames = [Subject.objects.get(id=item['Subject']).name for item in classSubjectData]
-
-            if any(not subject in blockedSubjects for subject in subjectNames):
-                removeBlocked = True
-                
-        # find current amount of each subject a yeargroup has on their timetable
-        currentAmounts = self.__getCurrentSubjectTotals(class_, allSubjects)
-        # the subjects the yeargroup is missing most of in their timetable
-        subjectMissingIds = self.__getMissingSubjectAmounts(currentAmounts, pk)
-
-        preserveOrder = Case(*[When(pk=pk, then=pos) for pos,pk in enumerate(subjectMissingIds)])
-
-        if removeBlocked:
-            subjectFrequencyQueryset = Subject.objects.filter(
-                yearGroup__name = f'Yr{pk}',
-                id__in=subjectMissingIds,
-            ).exclude(
-                name__in=['Maths','PSHE','PE','English']
-            ).order_by(preserveOrder)
-        else:
-            subjectFrequencyQueryset = Subject.objects.filter(
-                yearGroup__name = f'Yr{pk}',
-                id__in=subjectMissingIds).order_by(preserveOrder)
-        
-        serializedSubjects = SubjectSerializer(subjectFrequencyQueryset, many=True)
-        return Response(serializedSubjects.data)
+        return Response(suggestSubjects(pk, day, f'Unit{unit}', class_))
 
 
 
@@ -322,19 +264,53 @@ class SubjectRoutes(viewsets.ViewSet):
 
 class ClassRoutes(viewsets.ViewSet,SharedMethods):
     permission_classes = [IsAuthenticated]
+
+    @staticmethod
+    def __getLessonsRemaining(classes:list, allSubjects:'QuerySet[Subject]')->dict:
+        """Build the class x subject matrix of lessons each class still needs.
+        The lessons already on the timetable come from the counters in one query,
+        see counters.classLessons.
+
+        Args:
+            classes (list): ClassCodes of the yeargroup
+            allSubjects (querySet): all subjects for the yeargroup
+
+        Returns:
+            dict: {classCode: {subject: lessons left}}
+        """
+        subjects = list(allSubjects)
+        lessonsHave = counters.classLessons(classes, {subject.name for subject in subjects})
+        lessonCounts = {(class_, subject): have for class_, subject, have in lessonsHave}
+
+        lessonsRemaining = {}
+        for class_ in classes:
+            lessonRemainData = {}
+            for subject in subjects:
+                # subjects without lessons are not in the counts so they need all of them
+                lessonsLeft = subject.Count - lessonCounts.get((class_, subject.name), 0)
+                lessonRemainData[subject.name] = lessonsLeft
+            lessonsRemaining[class_] = lessonRemainData
+        return lessonsRemaining
     # API Routes for the ClassGroups
     def list(self , request:HttpRequest) -> 'QuerySet[YearGroup]':
         '''Performs a: 
         SELECT ClassName from YearGroup
         This will return all the classes for the specified yeargroup.
 
+        With fields= or page_size / cursor the yeargroups themselves are sent
+        instead, e.g /api/year/?fields=name,classes
+
         Returns:
             [JSON Response]: Sends back JSON for the YearGroup Objects.
         '''
-        queryset = YearGroup.objects.all()
-        return Response([ClassObject.name for ClassObject in queryset])
+        if 'fields' in request.query_params or wantsPage(request):
+            return sparseList(request, self, YearGroup.objects.all(), YeargroupSerializer,
+                              prepare=lambda queryset: queryset.prefetch_related('classes'))
+        yearGroups = reference.get('yeargroups')
+        return Response([yearGroup['name'] for yearGroup in yearGroups])
 
 
+    @versions.etag(versions.SHARED, lambda pk: f'Yr{pk}')
     def retrieve(self, request:HttpRequest, pk:int) -> 'QuerySet[YearGroup]':
         '''Perform:
         SELECT * FROM YearGroup WHERE name = Yr{pk}
@@ -351,28 +327,15 @@ class ClassRoutes(viewsets.ViewSet,SharedMethods):
             serializer = YeargroupSerializer(queryset)
             yearGroupData = serializer.data
 
-            classTimeslots = Timeslot.objects.filter(ClassGroup__classCode__contains = pk)
-            serializedTimeslots = TimeslotSerializer(classTimeslots,many=True)
-
-            lessonsRemaining = {}
+            classTimeslots = Timeslot.objects.filter(ClassGroup__year = pk)
 
             allSubjects = Subject.objects.filter(yearGroup__name = f'Yr{pk}')
-            
-            for class_ in yearGroupData['classes']:
-                lessonRemainData = {}
-                for subject in allSubjects:
-                    lessonsNeed = subject.Count
-                    lessonsHave = Timeslot.objects.filter(ClassGroup__classCode = class_, Subject__name = subject.name).count()
-                    lessonsLeft = lessonsNeed - lessonsHave
-                    lessonRemainData[subject.name] = lessonsLeft
-                
-                lessonsRemaining[class_] = lessonRemainData
-
+            lessonsRemaining = self.__getLessonsRemaining(yearGroupData['classes'], allSubjects)
 
             returnObject = {
                 'name': yearGroupData['name'],
                 'classes': yearGroupData['classes'],
-                'timeslots': [self.ExtractValuesById(data) for data in serializedTimeslots.data],
+                'timeslots': self.ExtractTimeslotValues(classTimeslots),
                 'lessonsRemaining': lessonsRemaining
             }
             # print(returnObject)
@@ -380,6 +343,32 @@ class ClassRoutes(viewsets.ViewSet,SharedMethods):
             return Response('No Classes Found', status=status.HTTP_204_NO_CONTENT)
         return Response(returnObject)
 
+    @action(detail=True, methods=['post'])
+    def generate(self, request:HttpRequest, pk:int) -> 'Response':
+        '''POST /api/year/7/generate/
+        Fill the timetable of every class in the yeargroup.
+
+        Body:
+            - replace (bool): remove the lessons the classes already have first
+            - dryRun (bool): only report what would be created
+
+        Returns:
+            Response: how many lessons were created and the ones which could not be placed,
+                200 for a dry run which saves nothing, 409 if another request booked a
+                teacher, room or class the solver used meanwhile
+        '''
+        if not request.user.is_staff:
+            return Response({'msg':'UNAUTHORISED'})
+
+        yearGroup = get_object_or_404(YearGroup, name=f'Yr{pk}')
+        dryRun = bool(request.data.get('dryRun', False))
+        try:
+            report = generateTimetable(yearGroup, replace=bool(request.data.get('replace', False)), dryRun=dryRun)
+        except IntegrityError:
+            return Response({'msg':'The timetable was changed by another request while it was generated, try again'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(report, status=status.HTTP_200_OK if dryRun else status.HTTP_201_CREATED)
+
 
 
 
@@ -420,59 +409,13 @@ class TeacherRoutes(viewsets.ViewSet, SharedMethods):
                             'params':['subject','day','unit','class']},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Get Ids of all teachers who are busy on the selected timeslot
-        currentOccupiedTeachers = Timeslot.objects.filter(Day=day, Unit=f'Unit{unit}')
-        currentTeacherData = TimeslotSerializer(currentOccupiedTeachers,many=True).data
-        occupiedTeacherIds = set([timeslot['Teacher'] for timeslot in currentTeacherData])
-
-        # Get Ids of all teachers
-        allTeachers = Teacher.objects.all()
-        allTeacherData = TeacherSerializer(allTeachers, many=True).data
-        allTeacherIds = set([teacher['id'] for teacher in allTeacherData])
-
-        # Find the difference between the two sets to get all the free teachers
-        freeTeachers = allTeacherIds - occupiedTeacherIds
-        
-        # Hash table of teacher hours missing
-        teacherHours = dict()
-        # calculate missing hours
-        for teacherId in freeTeachers:
-            teacherCurrentHours = Timeslot.objects.filter(Teacher=teacherId).count()
-            teacher = Teacher.objects.get(id=teacherId)
-            weeklyLessons = teacher.LessonsWeekly
-            remainingHours = weeklyLessons - teacherCurrentHours
-            teacherHours[teacherId] = remainingHours
-        # Filter out teachers who have no free hours
-        teachersWithFreeHours = list(filter(lambda id_: teacherHours[id_] != 0, teacherHours))
-        # Order by from most missing hours to least
-        teachersWithFreeHours.sort(reverse=True)
-        
-      
-        #NOTE: pk and index of the sorted teachersWithFreeHours 
-        '''
-        SELECT DISTINCT id, name, LessonsWeekly
-        FROM api_teacher
-        INNER JOIN teacher_SubjectTeach
-        ON teacher.id = teacher_SubjectTeach.teacher_id
-        INNER JOIN subject
-        ON teacher_SubjectTeach.subject_id = subject.id
-        WHERE subject.name IN (subject) AND teacher.id IN (teacherWithFreeHours)
-        ORDER BY CASE WHEN api_teacher.id = pk THEN index ELSE NULL END ASC
-        '''
-        # make sure the order of the original array stays when I return.
-        preserveOrder = Case(*[When(pk=pk, then=pos) for pos,pk in enumerate(teachersWithFreeHours)])
-
-        freeTeachersQuery = Teacher.objects.filter(
-                        id__in=teachersWithFreeHours,
-                         SubjectTeach__subjects__name__in=[subject]
-                        ).distinct().order_by(preserveOrder)
-        freeTeachersData = TeacherSerializer(freeTeachersQuery, many=True).data
-
-        freeTeachersSet = set(self.convertQuerySetToIds(freeTeachersQuery))
-        restTeachersIds = set(teachersWithFreeHours) - freeTeachersSet
+        # Free teachers with hours left, ordered from most missing hours to least
+        teachers = freeTeachers(day, f'Unit{unit}')
+        subjectTeachers, restTeachers = splitBySubject(teachers, subject)
 
-        restTeachersQuery = Teacher.objects.filter(id__in=restTeachersIds)
-        restTeachersData = TeacherSerializer(restTeachersQuery, many=True).data
+        # the database works out who and in which order, the cache has them serialized
+        freeTeachersData = reference.byId('teachers', subjectTeachers.values_list('id', flat=True))
+        restTeachersData = reference.byId('teachers', restTeachers.values_list('id', flat=True))
 
         response = {
             'teachers': freeTeachersData,
@@ -522,75 +465,10 @@ class RoomRoutes(viewsets.ViewSet, SharedMethods):
                             'params':['subject','day','unit','teacher','class']},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Get ids of all rooms being used on a specific day
-        currentLessons = Timeslot.objects.filter(Day=day, Unit=f'Unit{unit}')
-        currentLessonsData = TimeslotSerializer(currentLessons,many=True).data
-        usedRoomIds = set([timeslot['Room'] for timeslot in currentLessonsData])
+        # Free rooms big enough for the class: the teacher's and the subject's rooms first
+        queryset = freeRooms(day, f'Unit{unit}', class_, teacher, subject)
 
-        # Get the number of pupils in the class
-        PupilsInClass = ClassGroup.objects.get(classCode=class_).NumOfPupils
-        
-        # Get ids of all rooms making sure there is enough space in the room
-        allRooms = Room.objects.filter(Capacity__gte=PupilsInClass)
-        allRoomIds = set(self.convertQuerySetToIds(allRooms))
- 
-        # Set Difference for all free rooms - remove used rooms from all rooms set
-        freeRooms = allRoomIds - usedRoomIds
-
-        try:
-            # Get all the rooms a teacher usually teaches in
-            teacherSubjects = Teacher.objects.get(name=teacher)
-            teacherData = TeacherSerializer(teacherSubjects).data
-            teacherRooms = teacherData['Room']
-        except:
-            teacherRooms = []
-
-        # get all the ids of rooms of the teacher from query so that we can
-        # prioritize the room of the teacher if it's free
-        RoomDataOfTeacher = Room.objects.filter(RoomNumber__in=teacherRooms)
-        teacherRoomIds = set(self.convertQuerySetToIds(RoomDataOfTeacher))
-        
-        # Filter rooms and only return the teacher rooms which are free
-        prioritizeRooms = list(filter(lambda roomId: roomId in teacherRoomIds, freeRooms))
-
-        outPutFilteredRooms = None
-        # check of there are any rooms of teachers free and return them of yes
-        # AP is excluded as there are no specific rooms for that.
-        if len(prioritizeRooms) >= 1 and subject != "AP":
-            outPutFilteredRooms = prioritizeRooms
-        else:
-            # return all of not
-            outPutFilteredRooms = freeRooms
-
-        # Allow to return both computing and ICT rooms because they are
-        # Differentiated. This is because some rooms are for IT and Computer Science
-        # Others are just there available for booking 
-        if subject == "ICT" or subject == "Computing":
-            # Q gives me the ability to perform or operations: Computing OR ICT Room
-            query = Q(Description='ICT') | Q(Description='Computing')
-            queryset = Room.objects.filter(query, id__in=outPutFilteredRooms)
-        else:
-            # get all free rooms which have that subject in them
-            queryset = Room.objects.filter(Description=subject, id__in=outPutFilteredRooms)
-            # if we prioritize the teacher rooms, then we need to return the other rooms as well
-            # so the user has an option, but we don't want to return the teacher rooms twice therefore
-            # we use a set difference to remove the teacher rooms from the queryset
-            # convert the queryset to a set of unique ids
-            currentFilteredData = set(self.convertQuerySetToIds(queryset))
-            # remove the prioritized room from the free rooms.
-            allRoomsUnique = set(freeRooms) - currentFilteredData
-            # Append the rest of the rooms on the list to make the prioritized rooms be on top
-            querysetIds =  list(currentFilteredData) + list(allRoomsUnique)
-            
-            preserveOrder = Case(*[When(pk=pk, then=pos) for pos,pk in enumerate(querysetIds)])
-            queryset = Room.objects.filter(id__in=querysetIds).order_by(preserveOrder)
-  
-        # Return all if no filtered rooms are found
-        if len(queryset) == 0:
-            queryset = Room.objects.filter(id__in=outPutFilteredRooms)
-        
-        serializer = RoomSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(reference.byId('rooms', [room.id for room in queryset]))
 
 
 
@@ -606,6 +484,7 @@ class RoomRoutes(viewsets.ViewSet, SharedMethods):
 class OverviewRoute(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
+    @versions.etag(versions.GLOBAL)
     def list(self, request):
         day = request.query_params.get('day')
         unit = request.query_params.get('unit')
@@ -618,64 +497,172 @@ class OverviewRoute(viewsets.ViewSet):
                             status=status.HTTP_400_BAD_REQUEST)
 
         # similar DB queries as for the filtering however this time we return it all in one route.
-        currentLessons = Timeslot.objects.filter(Day=day, Unit=f'Unit{unit}')
-        currentLessonsData = TimeslotSerializer(currentLessons,many=True).data
-        usedRoomIds = set([timeslot['Room'] for timeslot in currentLessonsData])
+        roomIds = freeComputerRooms(day, f'Unit{unit}')
 
-        allRooms = Room.objects.all()
-        allRoomData = RoomSerializer(allRooms, many=True).data
-        allRoomIds = set([room['id'] for room in allRoomData])
-
-        freeRooms = allRoomIds - usedRoomIds
-
-        query = Q(Description='ICT') | Q(Description='Computing')
-        queryset = Room.objects.filter(query, id__in=freeRooms)
-        
-        teacherOutput = {}
-        teacherHours = {}
+        teacherIds = []
+        hours = {}
 
         if subject:
-            currentOccupiedTeachers = Timeslot.objects.filter(Day=day, Unit=f'Unit{unit}')
-            currentTeacherData = TimeslotSerializer(currentOccupiedTeachers,many=True).data
-            occupiedTeacherIds = set([timeslot['Teacher'] for timeslot in currentTeacherData])
-
-            allTeachers = Teacher.objects.all()
-            allTeacherData = TeacherSerializer(allTeachers, many=True).data
-            allTeacherIds = set([teacher['id'] for teacher in allTeacherData])
-
-            freeTeachers = allTeacherIds - occupiedTeacherIds
-                           
-            teacherFreeHours = dict()
-            # calculate missing hours
-            for teacherId in freeTeachers:
-                teacherCurrentHours = Timeslot.objects.filter(Teacher=teacherId).count()
-                teacher = Teacher.objects.get(id=teacherId)
-                weeklyLessons = teacher.LessonsWeekly
-                remainingHours = weeklyLessons - teacherCurrentHours
-                teacherFreeHours[teacherId] = remainingHours
-            # Filter out teachers who have no free hours
-            teachersWithFreeHours = list(filter(lambda id_: teacherFreeHours[id_] != 0, teacherFreeHours))
-            # Order by from most missing hours to least
-            
-            teacherQuery = Teacher.objects.filter(id__in=teachersWithFreeHours, SubjectTeach__subjects__name__in=[subject]).distinct()
-            teacherOutput = TeacherSerializer(teacherQuery, many=True).data
+            # free teachers with hours left, ordered from most missing hours to least
+            teacherIds = freeSubjectTeachers(day, f'Unit{unit}', subject)
+            hours = teacherHours(day, f'Unit{unit}')
 
-        
-            # Hash table of teacher hours missing
-            teacherHours = dict()
-            # calculate missing hours
-            for teacherId in teachersWithFreeHours:
-                teacherCurrentHours = Timeslot.objects.filter(Teacher=teacherId).count()
-                teacher = Teacher.objects.get(id=teacherId)
-                weeklyLessons = teacher.LessonsWeekly
-                remainingHours = weeklyLessons - teacherCurrentHours
-                teacherHours[teacher.name] = remainingHours
-
-
-        roomsOutput = RoomSerializer(queryset, many=True).data
         response = {
-            'rooms': roomsOutput,
-            'teachers': teacherOutput,
-            'teacherHours': teacherHours
+            'rooms': reference.byId('rooms', roomIds),
+            'teachers': reference.byId('teachers', teacherIds) if subject else {},
+            'teacherHours': hours
         }
         return Response(response)
+
+    @action(detail=False)
+    @versions.etag(versions.GLOBAL)
+    def week(self, request:HttpRequest) -> 'Response':
+        '''GET /api/overview/week/?subject=Maths&description=Maths
+        The free rooms and teachers for every day and unit of the week at once
+        instead of asking for each timeslot.
+
+        Query Params:
+            - subject (optional): return the free teachers of this subject
+            - description (optional): only return rooms for this subject
+
+        Returns:
+            Response: ids of free rooms and teachers per Day and Unit with a lookup for their names
+        '''
+        subject = request.query_params.get('subject')
+        description = request.query_params.get('description')
+        return Response(weekAvailability(subject, description))
+
+
+
+
+
+
+# ============= Export route logic =============
+
+
+
+
+
+
+class ExportRoutes(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    @staticmethod
+    def scope(request:HttpRequest):
+        '''The export scope from the query params, None when the year is not a number.'''
+        scope = {name: request.query_params.get(name) for name in export.SCOPES}
+        if scope['year'] and not scope['year'].isdigit():
+            return None
+        return scope
+
+    @action(detail=False)
+    def csv(self, request:HttpRequest) -> 'StreamingHttpResponse':
+        '''GET /api/export/csv/?class=7A1
+        The lessons as CSV, streamed as they are read.
+
+        Query Params (optional, the whole school without one):
+            - year: e.g 7
+            - class: e.g 7A1
+            - teacher: the teacher's name
+            - room: the room number
+
+        Returns:
+            StreamingHttpResponse: Day, Unit, Class, Subject, Teacher, Room rows
+        '''
+        scope = self.scope(request)
+        if scope is None:
+            return Response({'msg':'year must be a number e.g 7'}, status=status.HTTP_400_BAD_REQUEST)
+        return export.exportResponse(export.csvRows(scope), 'text/csv', f'{export.scopeName(scope)}.csv')
+
+    @action(detail=False)
+    def ical(self, request:HttpRequest) -> 'StreamingHttpResponse':
+        '''GET /api/export/ical/?teacher=Mrs Jones&start=2024-09-02
+        The lessons as an iCalendar file of weekly events, streamed as they are read.
+
+        Query Params (optional):
+            - year, class, teacher, room: as for the CSV
+            - start: a date in the first week of the calendar, this week without it
+
+        Returns:
+            StreamingHttpResponse: text/calendar
+        '''
+        scope = self.scope(request)
+        try:
+            start = datetime.date.fromisoformat(request.query_params.get('start') or timezone.localdate().isoformat())
+        except ValueError:
+            scope = None
+        if scope is None:
+            return Response({'msg':'year must be a number and start a date',
+                             'PreferredFormat':'/api/export/ical/?year=7&start=2024-09-02'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        monday = start - datetime.timedelta(days=start.weekday())
+        return export.exportResponse(export.icalEvents(scope, monday), 'text/calendar',
+                                     f'{export.scopeName(scope)}.ics')
+
+
+
+
+
+
+# ============= Metrics route logic =============
+
+
+
+
+
+
+class MetricsRoutes(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request:HttpRequest) -> 'Response':
+        '''GET /api/metrics/
+        The SQL queries and database time of every route since the server
+        started (or the last reset), counted by the QueryCountMiddleware.
+        Each server process keeps its own totals.
+
+        Returns:
+            Response: the budgets and the totals per route, most database time first
+        '''
+        if not request.user.is_staff:
+            return Response({'msg':'UNAUTHORISED'})
+
+        return Response({
+            'enabled': getattr(settings, 'QUERY_METRICS', False),
+            'queryBudget': getattr(settings, 'QUERY_BUDGET', 20),
+            'timeBudgetMs': getattr(settings, 'QUERY_TIME_BUDGET_MS', 200),
+            'routes': middleware.stats.report(),
+            'referenceCache': reference.stats(),
+        })
+
+    @action(detail=False, methods=['post'])
+    def reset(self, request:HttpRequest) -> 'Response':
+        '''POST /api/metrics/reset/
+        Start counting again from nothing.
+        '''
+        if not request.user.is_staff:
+            return Response({'msg':'UNAUTHORISED'})
+
+        middleware.stats.clear()
+        return Response({'routes': []})
+
+    @action(detail=False)
+    def occupancy(self, request:HttpRequest) -> 'Response':
+        '''GET /api/metrics/occupancy/
+        Compare the occupancy index of the server process answering with the
+        Timeslot table, it is rebuilt when they differ. Each process keeps its
+        own index so this only checks the one which got the request.
+
+        Returns:
+            Response: the version the index was built at, how many timeslots it has
+                      and the masks which differed
+        '''
+        if not request.user.is_staff:
+            return Response({'msg':'UNAUTHORISED'})
+
+        differences = occupancy.index.check()
+        return Response({
+            'enabled': occupancy.isEnabled(),
+            'version': occupancy.index.version,
+            'timeslots': occupancy.index.timeslots,
+            'differences': differences,
+        })
@@ -0,0 +1,73 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from knox.auth import TokenAuthentication
+from knox.models import AuthToken
+
+"""
+Knox token authentication which remembers the tokens it has checked.
+Knox looks the token up, loads its user and the user's other tokens and
+hashes the token on every request. Here the token and its user are kept
+in the process's memory for AUTH_TOKEN_CACHE_TTL seconds (never past the
+token's expiry), so a request with a remembered token makes one query,
+checking its row is still in the database and reading its user's
+is_active, is_staff and is_superuser again. A token deleted by any process
+(logout, logout all, the cleartokens command) or whose user was made
+inactive is refused straight away, and a user given or losing staff rights
+has them from the next request in every process.
+Deleting a token or saving its user also forgets it in this process.
+"""
+
+CACHE = 'default'
+
+
+def tokenKey(token:bytes) -> str:
+    '''The cache key of a token, the token itself is never stored.'''
+    return 'knox:' + hashlib.sha256(token).hexdigest()
+
+
+def digestKey(digest:str) -> str:
+    '''The cache key pointing from a token's digest in the database to tokenKey.'''
+    return f'knox-digest:{digest}'
+
+
+def forget(digests):
+    """Forget cached tokens.
+
+    Args:
+        digests (iterable): the AuthToken digests
+    """
+    cache = caches[CACHE]
+    digestKeys = [digestKey(digest) for digest in digests]
+    keys = list(cache.get_many(digestKeys).values())
+    cache.delete_many(digestKeys + keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, token:bytes):
+        ttl = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60)
+        if ttl <= 0:
+            return super().authenticate_credentials(token)
+
+        cache = caches[CACHE]
+        key = tokenKey(token)
+        authToken = cache.get(key)
+        if authToken is not None:
+            current = authToken.expiry is None or authToken.expiry > timezone.now()
+            # the cache is per process, another one may have logged the token out or changed the user
+            flags = current and AuthToken.objects.filter(digest=authToken.digest).values_list(
+                'user__is_active', 'user__is_staff', 'user__is_superuser').first()
+            if flags and flags[0]:
+                user = authToken.user
+                user.is_active, user.is_staff, user.is_superuser = flags
+                return user, authToken
+            forget([authToken.digest])
+
+        user, authToken = super().authenticate_credentials(token)
+        if authToken.expiry is not None:
+            ttl = min(ttl, (authToken.expiry - timezone.now()).total_seconds())
+        if ttl > 0:
+            cache.set_many({key: authToken, digestKey(authToken.digest): key}, ttl)
+        return user, authToken
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from knox.models import AuthToken
+
+from apps.users.models import StreamTicket
+
+
+class Command(BaseCommand):
+    help = ('Delete the expired knox tokens and stream tickets. Every login makes a new token and knox only '
+            'deletes expired ones of a user who logs in again, so run this every day e.g from the scheduler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only count the expired tokens')
+        parser.add_argument('--chunk', type=int, default=1000, help='tokens deleted per query')
+
+    def handle(self, *args, **options):
+        expired = AuthToken.objects.filter(expiry__lt=timezone.now())
+        expiredTickets = StreamTicket.objects.filter(expiry__lt=timezone.now())
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} expired tokens')
+            self.stdout.write(f'{expiredTickets.count()} expired stream tickets')
+            return
+
+        deleted = 0
+        # in chunks so a table which has grown for months is not loaded at once for the delete signals
+        while True:
+            chunk = list(expired.values_list('pk', flat=True)[:options['chunk']])
+            if not chunk:
+                break
+            deleted += AuthToken.objects.filter(pk__in=chunk).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired tokens'))
+        tickets = expiredTickets.delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {tickets} expired stream tickets'))
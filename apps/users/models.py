@@ -7,4 +7,16 @@ class ExtendUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True)
     finishedTutorial = models.BooleanField(default=False)
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+
+class StreamTicket(models.Model):
+    # A short lived, single use stand in for a knox token in the query of
+    # /api/timeslots/stream/, which EventSource can not send headers to.
+    # Only the sha256 of the ticket is kept, see apps/users/auth.py.
+    key = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='streamTickets')
+    expiry = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.user} until {self.expiry}'
@@ -1,9 +1,23 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from knox.models import AuthToken
 from .models import ExtendUser
+from . import auth
 
 @receiver(post_save, sender=User)
 def create_extended_user(sender, instance, created, **kwargs):
     if created:
         ExtendUser.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_token(sender, instance, **kwargs):
+    auth.forget([instance.digest])
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    # e.g the user was made inactive, the cached copy must not stay logged in
+    if not created:
+        auth.forget(AuthToken.objects.filter(user=instance).values_list('digest', flat=True))
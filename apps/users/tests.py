@@ -1,3 +1,115 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from knox.models import AuthToken
+from rest_framework.test import APITestCase
+
+from . import auth
+from .models import StreamTicket
+
+
+class CachedTokenTest(APITestCase):
+    def setUp(self):
+        caches[auth.CACHE].clear()
+        self.user = User.objects.create_user(username='teacher', password='teacher')
+        self.token = AuthToken.objects.create(self.user)[1]
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def getUser(self):
+        return self.client.get('/api/auth/user')
+
+    def test_second_request_checks_token_once(self):
+        self.assertEqual(self.getUser().status_code, 200)
+        # the token is still there, then the ExtendUser the route reads
+        with self.assertNumQueries(2):
+            response = self.getUser()
+        self.assertEqual(response.data['user']['username'], 'teacher')
+
+    def test_cached_token_not_stored(self):
+        self.getUser()
+        self.assertIsNone(caches[auth.CACHE].get(f'knox:{self.token}'))
+        self.assertIsNotNone(caches[auth.CACHE].get(auth.tokenKey(self.token.encode())))
+
+    def test_logout_forgets_token(self):
+        self.getUser()
+        self.assertEqual(self.client.post('/api/auth/logout').status_code, 204)
+        self.assertEqual(self.getUser().status_code, 401)
+
+    def test_logout_all_forgets_every_token(self):
+        other = AuthToken.objects.create(self.user)[1]
+        self.getUser()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {other}')
+        self.getUser()
+        self.assertEqual(self.client.post('/api/auth/logoutall/').status_code, 204)
+        self.assertEqual(self.getUser().status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(self.getUser().status_code, 401)
+
+    def test_inactive_user_rejected(self):
+        self.getUser()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.getUser().status_code, 401)
+
+    def test_logout_elsewhere_rejected(self):
+        self.getUser()
+        # deleted without signals, as another server process's logout leaves this one's cache
+        AuthToken.objects.filter(user=self.user)._raw_delete('default')
+        self.assertEqual(self.getUser().status_code, 401)
+        self.assertIsNone(caches[auth.CACHE].get(auth.tokenKey(self.token.encode())))
+
+    def test_deactivated_elsewhere_rejected(self):
+        self.getUser()
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.getUser().status_code, 401)
+
+    def test_demoted_elsewhere_loses_staff(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertTrue(self.getUser().data['user']['is_staff'])
+        # update() sends no signals, as a change made by another server process
+        User.objects.filter(id=self.user.id).update(is_staff=False)
+        with self.assertNumQueries(2):
+            self.assertFalse(self.getUser().data['user']['is_staff'])
+
+    def test_expired_token_rejected(self):
+        self.getUser()
+        cached = caches[auth.CACHE].get(auth.tokenKey(self.token.encode()))
+        cached.expiry = timezone.now() - timedelta(seconds=1)
+        caches[auth.CACHE].set(auth.tokenKey(self.token.encode()), cached)
+        AuthToken.objects.filter(user=self.user).update(expiry=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.getUser().status_code, 401)
+
+    @override_settings(AUTH_TOKEN_CACHE_TTL=0)
+    def test_cache_turned_off(self):
+        self.getUser()
+        # the token, its user, the user's tokens for knox's clean up then the ExtendUser
+        with self.assertNumQueries(4):
+            self.getUser()
+
+
+class ClearTokensTest(APITestCase):
+    def test_deletes_only_expired(self):
+        user = User.objects.create_user(username='teacher', password='teacher')
+        for _ in range(3):
+            AuthToken.objects.create(user, expiry=timedelta(hours=-1))
+        current, _ = AuthToken.objects.create(user)
+        StreamTicket.objects.create(key='expired', user=user, expiry=timezone.now() - timedelta(seconds=1))
+        StreamTicket.objects.create(key='current', user=user, expiry=timezone.now() + timedelta(seconds=30))
+
+        out = StringIO()
+        call_command('cleartokens', '--dry-run', stdout=out)
+        self.assertIn('3 expired tokens', out.getvalue())
+        self.assertEqual(AuthToken.objects.count(), 4)
+
+        out = StringIO()
+        call_command('cleartokens', '--chunk', '2', stdout=out)
+        self.assertIn('Deleted 3 expired tokens', out.getvalue())
+        self.assertEqual(list(AuthToken.objects.all()), [current])
+        self.assertIn('Deleted 1 expired stream tickets', out.getvalue())
+        self.assertEqual(list(StreamTicket.objects.values_list('key', flat=True)), ['current'])
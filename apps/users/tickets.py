@@ -0,0 +1,50 @@
+import datetime
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import StreamTicket
+
+"""
+Stream tickets: EventSource can not set the Authorization header, and a
+knox token in the query of /api/timeslots/stream/ would be written to
+every access log on the way. A logged in client POSTs to
+/api/auth/streamticket for a ticket instead, which opens one stream within
+STREAM_TICKET_SECONDS and is then gone. They are kept in the database so
+a ticket from one server process opens a stream on any other.
+"""
+
+
+def ticketKey(ticket:str) -> str:
+    '''The stored key of a ticket, the ticket itself is never stored.'''
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+def issue(user) -> str:
+    """Make a ticket for the user, their expired ones are deleted on the way.
+
+    Returns:
+        str: the ticket to send as ?ticket=
+    """
+    now = timezone.now()
+    StreamTicket.objects.filter(user=user, expiry__lte=now).delete()
+    ticket = secrets.token_urlsafe(32)
+    StreamTicket.objects.create(key=ticketKey(ticket), user=user,
+                                expiry=now + datetime.timedelta(seconds=settings.STREAM_TICKET_SECONDS))
+    return ticket
+
+
+def redeem(ticket:str):
+    """Use up a ticket.
+
+    Returns:
+        User|None: its user, None if it does not exist, has expired, was used or the user is inactive
+    """
+    found = StreamTicket.objects.filter(key=ticketKey(ticket), expiry__gt=timezone.now()) \
+        .select_related('user').first()
+    # only the request whose delete removed the row may use it
+    if found is None or StreamTicket.objects.filter(key=found.key).delete()[0] != 1:
+        return None
+    return found.user if found.user.is_active else None
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from .views import LoginApi, GetUserApi, completeTutorial
+from .views import LoginApi, GetUserApi, StreamTicketApi, completeTutorial
 from knox import views as knox_views
 
 urlpatterns = [
@@ -7,5 +7,6 @@ urlpatterns = [
     path("api/auth/login", LoginApi.as_view()),
     path("api/auth/user", GetUserApi.as_view({'get': 'list'})),
     path("api/auth/logout", knox_views.LogoutView.as_view()),
+    path("api/auth/streamticket", StreamTicketApi.as_view()),
     path("api/completeTutorial", completeTutorial),
 ]
\ No newline at end of file
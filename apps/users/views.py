@@ -1,9 +1,11 @@
+from django.conf import settings
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from knox.models import AuthToken
 from .serializers import UserSerializer, LoginSerializer, ExtendedUserSerializer
 from  .models import ExtendUser
+from . import tickets
 from rest_framework import viewsets
 
 class LoginApi(generics.GenericAPIView):
@@ -24,11 +26,21 @@ class GetUserApi(viewsets.ViewSet):
     ]
 
     def list(self, request):
-        user = ExtendUser.objects.get(user=request.user)
+        # the serializer shows the username
+        user = ExtendUser.objects.select_related('user').get(user=request.user)
         serializedExtended = ExtendedUserSerializer(user)
         mainUser = UserSerializer(request.user)
         return Response({'user':mainUser.data ,'extended':serializedExtended.data})
 
+class StreamTicketApi(generics.GenericAPIView):
+    permission_classes = [
+        permissions.IsAuthenticated,
+    ]
+
+    def post(self, request):
+        '''A single use ticket to open /api/timeslots/stream/?ticket= with, see tickets.py.'''
+        return Response({'ticket': tickets.issue(request.user), 'expiresIn': settings.STREAM_TICKET_SECONDS})
+
 @api_view()
 def completeTutorial(request):
     user = ExtendUser.objects.get(user=request.user)
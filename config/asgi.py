@@ -0,0 +1,57 @@
+"""
+ASGI config, for the server-sent events of /api/timeslots/stream/ and the
+async overview and rooms routes (apps/api/asyncviews.py). Deploy it with
+SERVER=asgi (config/gunicorn.py) or run e.g uvicorn config.asgi:application,
+everything else is handed to Django as under config.wsgi.
+Django 3.2 reads a streaming response, e.g the exports of apps/api/export.py,
+on the event loop where their queries are not allowed. StreamingHandler
+reads each part on Django's sync thread instead.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'true')
+
+
+class StreamingHandler(ASGIHandler):
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [(str(header).encode('ascii'), str(value).encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        # the thread the view ran on, which has the request's database connection
+        nextPart = sync_to_async(next, thread_sensitive=True)
+        parts = iter(response)
+        done = object()
+        while True:
+            part = await nextPart(parts, done)
+            if part is done:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+# as get_asgi_application does
+django.setup(set_prefix=False)
+handler = StreamingHandler()
+
+# needs the apps loaded by django.setup
+from apps.api.stream import PATH, timeslotStream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].rstrip('/') == PATH.rstrip('/'):
+        return await timeslotStream(scope, receive, send)
+    return await handler(scope, receive, send)
@@ -0,0 +1,16 @@
+import os
+
+"""
+gunicorn settings, see the Procfile. The app is served over WSGI
+(config/wsgi.py) as it always was unless SERVER=asgi, which runs
+config/asgi.py in uvicorn's worker instead: the async overview and rooms
+routes and the server-sent events of /api/timeslots/stream/.
+`manage.py benchmarkservers` compares the two.
+gunicorn still takes the workers from WEB_CONCURRENCY and the port from PORT.
+"""
+
+if os.environ.get('SERVER', 'wsgi') == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi'
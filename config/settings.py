@@ -1,4 +1,6 @@
+import importlib.util
 import os
+import tempfile
 import django_heroku
 import environ
 
@@ -32,13 +34,67 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
   'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
-  'DEFAULT_AUTHENTICATION_CLASSES': ("knox.auth.TokenAuthentication",)
+  'DEFAULT_AUTHENTICATION_CLASSES': ("apps.users.auth.CachedTokenAuthentication",),
+  # Chosen by the Accept header (apps/api/renderers.py), MessagePack only when msgpack is installed
+  'DEFAULT_RENDERER_CLASSES': (
+      "apps.api.renderers.FastJSONRenderer",
+      *(("apps.api.renderers.MessagePackRenderer",) if importlib.util.find_spec("msgpack") else ()),
+      "rest_framework.renderers.BrowsableAPIRenderer",
+  ),
 }
 
+# Seconds a checked knox token and its user are remembered in each server process
+# (apps/users/auth.py), each request still checks the token was not logged out.
+# 0 makes all of knox's queries on every request.
+AUTH_TOKEN_CACHE_TTL = env.int("AUTH_TOKEN_CACHE_TTL", default=60)
+
+# Seconds a ticket to open /api/timeslots/stream/ with is valid for (apps/users/tickets.py)
+STREAM_TICKET_SECONDS = env.int("STREAM_TICKET_SECONDS", default=30)
+
 CORS_ORIGIN_ALLOW_ALL = True
 
+# Answer "who is free" from the in memory occupancy index (apps/api/occupancy.py)
+# Turn off to query the Timeslot table on every request instead.
+OCCUPANCY_INDEX = env.bool("OCCUPANCY_INDEX", default=True)
+
+# Days the Timeslot change log (apps/api/changelog.py) is kept by `manage.py compactchanges`,
+# clients which last synced before that download the whole timetable again.
+CHANGE_LOG_DAYS = env.int("CHANGE_LOG_DAYS", default=30)
+# How often each server process reads the change log for /api/timeslots/stream/ while
+# it has clients, to push the changes other processes made. 0 only pushes its own.
+CHANGE_POLL_SECONDS = env.float("CHANGE_POLL_SECONDS", default=1)
+
+# Serve /api/overview/ and /api/rooms/ from the async views of apps/api/asyncviews.py,
+# config/asgi.py turns it on. Their queries run on ASYNC_QUERY_THREADS threads which
+# each keep a database connection, 0 runs them on Django's sync thread one at a time.
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+ASYNC_QUERY_THREADS = env.int("ASYNC_QUERY_THREADS", default=4)
+
+# Count the SQL queries of each request (apps/api/middleware.py), off unless turned on.
+# Requests over either budget are logged with their most repeated queries.
+QUERY_METRICS = env.bool("QUERY_METRICS", default=False)
+QUERY_BUDGET = env.int("QUERY_BUDGET", default=20)
+QUERY_TIME_BUDGET_MS = env.float("QUERY_TIME_BUDGET_MS", default=200)
+
+# Serialized rooms, teachers, subjects and yeargroups (apps/api/reference.py), kept until
+# they change. It is kept in files so every server process on the machine shares it and
+# sees a change made by any of them. Its keys have the database name in them, so test
+# and benchmark databases never share data with the real one.
+CACHES = {
+    # in memory, it holds the tokens of apps/users/auth.py
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env("REFERENCE_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), 'timetable-reference')),
+        'TIMEOUT': None,
+    },
+}
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'apps.api.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +106,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'config.urls'
 
+# Gives each test run a reference cache directory of its own (config/testrunner.py)
+TEST_RUNNER = 'config.testrunner.TestRunner'
+
 
 TEMPLATES = [
     {
@@ -71,16 +130,26 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'timetableapplocal',
-        'USER': 'postgres',
-        'PASSWORD': env("PASSWORD"),
-        'HOST': 'localhost',
-        'PORT': '',
+# DATABASE_NAME is set by `manage.py benchmarkservers` so the servers it starts use its database
+if env.bool("SQLITE", default=False):
+    # A local file instead of Postgres, for working offline and running the benchmarks
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env("DATABASE_NAME", default=os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': env("DATABASE_NAME", default='timetableapplocal'),
+            'USER': 'postgres',
+            'PASSWORD': env("PASSWORD"),
+            'HOST': 'localhost',
+            'PORT': '',
+        }
     }
-}
 
 # Password validation
 # https://docs..com/en/2.2/ref/settings/#auth-password-validators
@@ -0,0 +1,29 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+"""
+Test runner giving the 'reference' cache a directory of its own. The
+cache is kept in files every process on the machine shares, a test run
+clearing and filling it would otherwise do so under the server's feet
+or under another test run's.
+"""
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.referenceDir = tempfile.mkdtemp(prefix='timetable-reference-test-')
+        self.referenceCache = override_settings(CACHES={
+            **settings.CACHES,
+            'reference': {**settings.CACHES['reference'], 'LOCATION': self.referenceDir},
+        })
+        self.referenceCache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.referenceCache.disable()
+        shutil.rmtree(self.referenceDir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)